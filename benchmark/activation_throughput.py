@@ -0,0 +1,375 @@
+# Benchmark der Aktivierung: Führt die echten Aktivierungsfunktionen für N Accounts je Anbieter mit je M Coupons
+# gegen die lokalen Ersatz-Server aus benchmark/mock_providers.py aus. Gemessen werden Läufe pro Sekunde, aktivierte
+# Coupons pro Sekunde, p50/p95/p99 der Dauer je Account und je Coupon-Aktivierung sowie der höchste
+# Speicherbedarf (RSS).
+#
+# Mit --replay wird statt der Ersatz-Server eine mit HTTP_RECORD_FILE erstellte Aufzeichnung echter Anfragen
+# abgespielt (ohne Wartezeit, mit --replay-speed auch mit der aufgezeichneten Dauer). Mit --profile werden die
+# gewerteten Läufe zusätzlich mit cProfile aufgezeichnet.
+#
+# Mit --save-baseline werden die Ergebnisse eines Szenarios als Referenz gespeichert. Weicht ein späterer Lauf mehr
+# als --tolerance schlechter davon ab, endet das Skript mit Exit-Code 1.
+#
+# Ausführung aus dem Projektverzeichnis:
+#   PYTHONPATH=. python benchmark/activation_throughput.py --accounts 20 --coupons 100 --latency 50
+import argparse
+import asyncio
+import cProfile
+import json
+import math
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+
+from loguru import logger
+
+BENCHMARK_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+# Die Module des Projekts werden nach dem Wechsel in das temporäre Verzeichnis geladen.
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIRECTORY))
+sys.path.insert(0, BENCHMARK_DIRECTORY)
+
+from mock_providers import DC_BASE_PATH, PAYBACK_BASE_PATH, MockSettings, serve
+
+DEFAULT_BASELINES = os.path.join(BENCHMARK_DIRECTORY, "baselines.json")
+
+# Kennzahlen, bei denen ein höherer Wert besser ist; bei allen anderen ist ein niedrigerer Wert besser
+HIGHER_IS_BETTER = {"runs_per_second", "coupons_per_second"}
+
+# Die Drosselung der Anfragen würde sonst statt der Aktivierung gemessen.
+SETTINGS = {
+    "DC_REQUESTS_PER_SECOND": "1000000",
+    "PAYBACK_REQUESTS_PER_SECOND": "1000000",
+    "INCREMENTAL_CATALOG": "no",
+}
+
+
+def _write_secrets(directory, args, base_url, overrides):
+    settings = dict(SETTINGS)
+    if args.replay:
+        settings["HTTP_REPLAY_FILE"] = os.path.abspath(args.replay)
+        settings["HTTP_REPLAY_SPEED"] = str(args.replay_speed)
+    else:
+        settings["DC_API_BASE_URL"] = base_url + DC_BASE_PATH
+        settings["PAYBACK_API_BASE_URL"] = base_url + PAYBACK_BASE_PATH
+    settings.update(overrides)
+
+    with open(os.path.join(directory, "secrets.properties"), "w") as file:
+        file.write("[secrets]\n")
+        file.write("TELEGRAM_API_TOKEN = benchmark\n")
+        file.write("ALLOWED_USER_IDS =\n")
+        file.write("DEUTSCHLANDCARD_SECRET_API_TOKEN = benchmark\n")
+        file.write("PAYBACK_BASIC_AUTH_USERNAME = benchmark\n")
+        file.write("PAYBACK_BASIC_AUTH_CREDENTIAL = benchmark\n")
+        file.write("PAYBACK_PRINCIPAL = 138\n")
+        file.write("\n[settings]\n")
+        for key, value in settings.items():
+            file.write(f"{key} = {value}\n")
+
+
+def _accounts(count):
+    dc_accounts = [
+        {
+            "id": i,
+            "dc_card_number": f"{3000000000 + i}",
+            "dc_birthdate": "2000-01-01",
+            "dc_plz": "12345",
+        }
+        for i in range(count)
+    ]
+    payback_accounts = [
+        {
+            "id": i,
+            "payback_username": f"benchmark{i}@example.com",
+            "payback_password": "benchmark",
+        }
+        for i in range(count)
+    ]
+
+    return dc_accounts, payback_accounts
+
+
+def percentile(values, fraction):
+    """
+    Gibt das Perzentil nach dem Nearest-Rank-Verfahren zurück.
+    """
+    if not values:
+        return 0.0
+
+    values = sorted(values)
+    return values[max(math.ceil(fraction * len(values)) - 1, 0)]
+
+
+def _peak_rss_mb():
+    # ru_maxrss ist unter Linux in KiB angegeben. Die Prozesse von --processes werden vom Forkserver gestartet und
+    # sind daher keine Kindprozesse des Benchmarks; erfasst wird nur der Hauptprozess (und ggf. der Ersatz-Server).
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return max(own, children) / 1024
+
+
+async def _run(dc_accounts, payback_accounts, processes):
+    # Die Module lesen beim Import die secrets.properties Datei und werden daher erst nach deren Erstellung geladen.
+    from src.activation.engine import activate_all_accounts
+    from src.activation.process_runner import activate_all_accounts_in_processes
+    from src.activation.report import build_activation_report
+    from src.metrics.tracing import CATEGORY_RUN, Trace, span, tracing
+    from src.net.http_pool import close_http_clients
+
+    trace = Trace()
+
+    with tracing(trace), span("run", CATEGORY_RUN):
+        if processes > 1:
+            results = await activate_all_accounts_in_processes(
+                dc_accounts, payback_accounts, processes
+            )
+        else:
+            results = await activate_all_accounts(dc_accounts, payback_accounts)
+
+        with span("report"):
+            build_activation_report(*results)
+
+    await close_http_clients()
+
+    return results, trace
+
+
+def run_benchmark(args, profiler=None):
+    dc_accounts, payback_accounts = _accounts(args.accounts)
+    if args.provider == "dc":
+        payback_accounts = []
+    elif args.provider == "payback":
+        dc_accounts = []
+
+    run_seconds = []
+    account_seconds = []
+    coupon_seconds = []
+    report_seconds = []
+    activated = 0
+    errored = 0
+
+    for repetition in range(args.warmup + args.repeat):
+        measured = repetition >= args.warmup
+        if profiler is not None and measured:
+            profiler.enable()
+
+        started_at = time.perf_counter()
+        (dc_results, payback_results), trace = asyncio.run(
+            _run(dc_accounts, payback_accounts, args.processes)
+        )
+        duration = time.perf_counter() - started_at
+
+        if profiler is not None and measured:
+            profiler.disable()
+
+        # Der Aufwärmlauf füllt den Token-Cache und wird nicht gewertet.
+        if not measured:
+            continue
+
+        run_seconds.append(duration)
+
+        for event in trace.events:
+            if event["name"] == "account":
+                account_seconds.append(event["dur"] / 1e6)
+            elif event["name"] == "activate coupon":
+                coupon_seconds.append(event["dur"] / 1e6)
+            elif event["name"] == "report":
+                report_seconds.append(event["dur"] / 1e6)
+
+        for account_result in dc_results + payback_results:
+            if account_result.error is not None:
+                errored = errored + 1
+            else:
+                activated = activated + account_result.result[0]
+                errored = errored + account_result.result[2]
+
+    total_seconds = sum(run_seconds)
+
+    return {
+        "runs_per_second": len(run_seconds) / total_seconds,
+        "coupons_per_second": activated / total_seconds,
+        "account_p50": percentile(account_seconds, 0.50),
+        "account_p95": percentile(account_seconds, 0.95),
+        "account_p99": percentile(account_seconds, 0.99),
+        "coupon_p50": percentile(coupon_seconds, 0.50),
+        "coupon_p95": percentile(coupon_seconds, 0.95),
+        "coupon_p99": percentile(coupon_seconds, 0.99),
+        "report_seconds": sum(report_seconds) / len(report_seconds),
+        "peak_rss_mb": _peak_rss_mb(),
+    }, errored
+
+
+def compare_with_baseline(results, baseline, tolerance):
+    """
+    :return: Liste der Kennzahlen, die mehr als tolerance (Anteil) schlechter als die Referenz sind
+    """
+    regressions = []
+
+    for key, reference in baseline.items():
+        value = results.get(key)
+        if value is None or not reference:
+            continue
+
+        if key in HIGHER_IS_BETTER:
+            regressed = value < reference * (1 - tolerance)
+        else:
+            regressed = value > reference * (1 + tolerance)
+
+        if regressed:
+            regressions.append((key, reference, value))
+
+    return regressions
+
+
+def _scenario_name(args):
+    if args.replay:
+        return (
+            f"replay-{os.path.basename(args.replay)}-speed{args.replay_speed:g}-"
+            f"{args.provider}-{args.accounts}-p{args.processes}"
+        )
+
+    return (
+        f"{args.provider}-{args.accounts}x{args.coupons}-{args.latency:g}ms-"
+        f"jitter{args.jitter:g}-errors{args.error_rate:g}-p{args.processes}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark der Coupon-Aktivierung")
+    parser.add_argument("--accounts", type=int, default=20, help="Accounts je Anbieter")
+    parser.add_argument("--coupons", type=int, default=100, help="Coupons je Account")
+    parser.add_argument("--latency", type=float, default=50, help="Antwortzeit in ms")
+    parser.add_argument(
+        "--jitter", type=float, default=0, help="Abweichung der Antwortzeit in ms"
+    )
+    parser.add_argument(
+        "--error-rate", type=float, default=0.0, help="Anteil der Anfragen mit 503"
+    )
+    parser.add_argument(
+        "--replay",
+        metavar="CASSETTE",
+        help="Aufzeichnung (HTTP_RECORD_FILE) statt der Ersatz-Server abspielen",
+    )
+    parser.add_argument(
+        "--replay-speed",
+        type=float,
+        default=0.0,
+        help="Faktor der aufgezeichneten Dauer der Anfragen (1 = original, 0 = ohne Wartezeit)",
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="PATH",
+        help="cProfile-Statistik der gewerteten Läufe speichern (nur der Hauptprozess)",
+    )
+    parser.add_argument("--provider", choices=("both", "dc", "payback"), default="both")
+    parser.add_argument("--processes", type=int, default=0, help="ACTIVATION_PROCESSES")
+    parser.add_argument("--repeat", type=int, default=3, help="Gewertete Läufe")
+    parser.add_argument(
+        "--warmup", type=int, default=1, help="Nicht gewertete Läufe vorab"
+    )
+    parser.add_argument(
+        "--setting",
+        action="append",
+        default=[],
+        metavar="KEY=VALUE",
+        help="Zusätzliche Einstellung im Abschnitt [settings], z.B. DC_COUPON_ACTIVATION_PARALLELISM=8",
+    )
+    parser.add_argument(
+        "--baselines", default=DEFAULT_BASELINES, help="Datei der Referenzwerte"
+    )
+    parser.add_argument(
+        "--save-baseline", action="store_true", help="Ergebnis als Referenz speichern"
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="Erlaubte Verschlechterung (Anteil)",
+    )
+    args = parser.parse_args()
+
+    overrides = dict(setting.split("=", 1) for setting in args.setting)
+    scenario = _scenario_name(args) + "".join(
+        f"-{key}={value}" for key, value in sorted(overrides.items())
+    )
+
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+    server = None
+    base_url = None
+    if not args.replay:
+        receiver, sender = multiprocessing.Pipe(duplex=False)
+        server = multiprocessing.Process(
+            target=serve,
+            args=(
+                MockSettings(
+                    args.coupons,
+                    args.latency / 1000,
+                    args.jitter / 1000,
+                    args.error_rate,
+                ),
+                sender,
+            ),
+            daemon=True,
+        )
+        server.start()
+        base_url = f"http://127.0.0.1:{receiver.recv()}"
+
+    profiler = cProfile.Profile() if args.profile else None
+
+    baselines_path = os.path.abspath(args.baselines)
+    working_directory = os.getcwd()
+
+    # Datenbank und Konfiguration des Benchmarks liegen in einem temporären Verzeichnis.
+    with tempfile.TemporaryDirectory() as directory:
+        _write_secrets(directory, args, base_url, overrides)
+        os.chdir(directory)
+        try:
+            results, errored = run_benchmark(args, profiler)
+        finally:
+            os.chdir(working_directory)
+            if server is not None:
+                server.terminate()
+
+    if profiler is not None:
+        profiler.dump_stats(args.profile)
+
+    print(f"Szenario: {scenario}")
+    for key, value in results.items():
+        print(f"  {key:20} {value:12.4f}")
+    if errored:
+        print(f"  Fehlerhafte Accounts bzw. Coupons: {errored}")
+    if profiler is not None:
+        print(f"Profil gespeichert in {args.profile}.")
+
+    baselines = {}
+    if os.path.exists(baselines_path):
+        with open(baselines_path) as file:
+            baselines = json.load(file)
+
+    if args.save_baseline:
+        baselines[scenario] = results
+        with open(baselines_path, "w") as file:
+            json.dump(baselines, file, indent=2, sort_keys=True)
+        print(f"Referenz gespeichert in {baselines_path}.")
+        return
+
+    if scenario not in baselines:
+        print("Keine Referenz für dieses Szenario vorhanden (--save-baseline).")
+        return
+
+    regressions = compare_with_baseline(results, baselines[scenario], args.tolerance)
+    for key, reference, value in regressions:
+        print(f"REGRESSION {key}: {value:.4f} (Referenz {reference:.4f})")
+
+    if regressions:
+        sys.exit(1)
+
+    print("Keine Verschlechterung gegenüber der Referenz.")
+
+
+if __name__ == "__main__":
+    main()
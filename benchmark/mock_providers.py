@@ -0,0 +1,236 @@
+# Lokale Ersatz-Server für die DeutschlandCard- und Payback-API. Sie implementieren die Endpunkte, die die
+# API-Clients verwenden, mit einstellbarer Antwortzeit, Größe des Coupon-Katalogs und Fehlerquote. Ein Server
+# beantwortet die Anfragen beider Anbieter; die Clients werden über DC_API_BASE_URL und PAYBACK_API_BASE_URL auf ihn
+# umgeleitet.
+#
+# Eigenständige Ausführung aus dem Projektverzeichnis, z.B. um den Bot gegen die Ersatz-Server laufen zu lassen:
+#   python benchmark/mock_providers.py --port 8080 --coupons 100 --latency 50
+import argparse
+import datetime
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Pfade der beiden APIs; der Principal von Payback ist beliebig.
+DC_BASE_PATH = "/dlc-integration/app-dc/v2"
+PAYBACK_BASE_PATH = "/138/v1"
+
+
+class MockSettings:
+    """
+    Verhalten der Ersatz-Server.
+
+    :param coupons: Anzahl der Coupons im Katalog jedes Accounts
+    :param latency: Antwortzeit in Sekunden
+    :param jitter: Zufällige Abweichung der Antwortzeit in Sekunden (in beide Richtungen)
+    :param error_rate: Anteil der Anfragen, die mit 503 beantwortet werden
+    :param seed: Startwert des Zufallsgenerators, damit Läufe mit denselben Einstellungen vergleichbar sind
+    """
+
+    def __init__(self, coupons=100, latency=0.05, jitter=0.0, error_rate=0.0, seed=1):
+        self.coupons = coupons
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.seed = seed
+
+
+def _dc_catalog(count):
+    now = datetime.datetime.now()
+
+    return {
+        "coupons": [
+            {
+                "publicPromotionId": f"DC{i}",
+                "partnerSubgroup": "benchmark",
+                "status": "NRG",
+                "visibleFrom": (now - datetime.timedelta(days=1)).isoformat(
+                    timespec="seconds"
+                ),
+                "visibleTo": (now + datetime.timedelta(days=7)).isoformat(
+                    timespec="seconds"
+                ),
+                "content": {
+                    "headline": f"Coupon {i}",
+                    "shortDescription": "Benchmark",
+                    "partnerName": f"Partner {i % 20}",
+                },
+            }
+            for i in range(count)
+        ]
+    }
+
+
+def _payback_catalog(count):
+    now = datetime.datetime.now(datetime.timezone.utc)
+
+    return {
+        "couponListItem": [
+            {
+                "coupon": {
+                    "couponID": str(100000 + i),
+                    "couponStatus": 1,
+                    "partner": [{"partnerDisplayName": f"Partner {i % 20}"}],
+                    "validity": {
+                        "validFrom": (now - datetime.timedelta(days=1)).strftime(
+                            "%Y-%m-%dT%H:%M:%S%z"
+                        ),
+                        "validTo": (now + datetime.timedelta(days=7)).strftime(
+                            "%Y-%m-%dT%H:%M:%S%z"
+                        ),
+                    },
+                    "couponContentSet": {
+                        "textItem": [
+                            {"textValue": "Benchmark"},
+                            {"textValue": "Benchmark"},
+                            {"textValue": f"Coupon {i}"},
+                            {"textValue": "Benchmark"},
+                        ]
+                    },
+                }
+            }
+            for i in range(count)
+        ]
+    }
+
+
+def _responses(settings):
+    # Die Antworten werden einmal erzeugt, damit die Server selbst die Messung nicht bremsen.
+    def encode(data):
+        return json.dumps(data).encode("utf-8")
+
+    return {
+        DC_BASE_PATH + "/members/login": encode({"x-auth-token": "benchmark"}),
+        DC_BASE_PATH + "/members/coupons/query": encode(_dc_catalog(settings.coupons)),
+        DC_BASE_PATH + "/members/coupons/registration": encode({}),
+        DC_BASE_PATH
+        + "/members/points": encode(
+            {"balance": 1000, "expiringPoints": 0, "dateOfNextExpiry": "2099-12-31"}
+        ),
+        PAYBACK_BASE_PATH
+        + "/json/secureauthenticate": encode(
+            {
+                "standardAuthentication": {
+                    "token": "benchmark",
+                    "refreshToken": "-",
+                    "tokenValidityDuration": 3600,
+                }
+            }
+        ),
+        PAYBACK_BASE_PATH
+        + "/json/getcoupons": encode(_payback_catalog(settings.coupons)),
+        PAYBACK_BASE_PATH + "/json/activatecoupon": encode({}),
+        PAYBACK_BASE_PATH
+        + "/json/getaccountbalance": encode(
+            {
+                "accountBalanceDetails": [
+                    {
+                        "totalPointsAmount": 1000,
+                        "expiryAnnouncement": {"pointsToExpireAmount": 0},
+                    }
+                ]
+            }
+        ),
+    }
+
+
+class _MockHandler(BaseHTTPRequestHandler):
+    # Keep-Alive wie bei den echten Servern, damit die Verbindungspools der Clients wirken
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        server = self.server
+
+        length = int(self.headers.get("Content-Length", 0))
+        self.rfile.read(length)
+
+        body = server.responses.get(self.path)
+        if body is None:
+            self._reply(404, b"{}")
+            return
+
+        with server.random_lock:
+            delay = server.settings.latency + server.random.uniform(
+                -server.settings.jitter, server.settings.jitter
+            )
+            failed = server.random.random() < server.settings.error_rate
+
+        time.sleep(max(delay, 0.0))
+
+        if failed:
+            self._reply(503, b"{}")
+        else:
+            self._reply(200, body)
+
+    def _reply(self, status, body):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MockProviderServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, settings, host="127.0.0.1", port=0):
+        super().__init__((host, port), _MockHandler)
+        self.settings = settings
+        self.responses = _responses(settings)
+        self.random = random.Random(settings.seed)
+        self.random_lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+def serve(settings, port_pipe, host="127.0.0.1", port=0):
+    """
+    Startet den Server und meldet seinen Port über port_pipe. Wird als eigener Prozess gestartet, damit der Server
+    die Messung der Clients (CPU-Zeit, Speicher) nicht beeinflusst.
+    """
+    server = MockProviderServer(settings, host, port)
+    port_pipe.send(server.server_address[1])
+    server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Ersatz-Server für DeutschlandCard und Payback"
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--coupons", type=int, default=100, help="Coupons je Account")
+    parser.add_argument("--latency", type=float, default=50, help="Antwortzeit in ms")
+    parser.add_argument(
+        "--jitter", type=float, default=0, help="Abweichung der Antwortzeit in ms"
+    )
+    parser.add_argument(
+        "--error-rate", type=float, default=0.0, help="Anteil der Anfragen mit 503"
+    )
+    args = parser.parse_args()
+
+    server = MockProviderServer(
+        MockSettings(
+            args.coupons, args.latency / 1000, args.jitter / 1000, args.error_rate
+        ),
+        args.host,
+        args.port,
+    )
+
+    print(f"DC_API_BASE_URL = {server.base_url}{DC_BASE_PATH}")
+    print(f"PAYBACK_API_BASE_URL = {server.base_url}{PAYBACK_BASE_PATH}")
+
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+# Micro-Benchmark: Vergleicht das Parsen der Gültigkeitszeitstempel mit dateutil (bisheriger Weg) mit
+# parse_timestamp (fromisoformat mit Cache).
+#
+# Ausführung aus dem Projektverzeichnis:
+#   PYTHONPATH=. python benchmark/timestamp_parsing.py
+import datetime
+import timeit
+
+from dateutil import parser as dateparser
+
+from src.activation.timestamps import parse_timestamp
+
+# Typische Zeitstempel: Payback mit Offset, DeutschlandCard ohne Offset. Viele Coupons teilen sich dieselben Werte.
+start = datetime.datetime(2024, 2, 1, 0, 0, 0)
+PAYBACK_VALUES = [
+    (start + datetime.timedelta(days=i % 30)).strftime("%Y-%m-%dT%H:%M:%S+01:00")
+    for i in range(200)
+]
+DC_VALUES = [(start + datetime.timedelta(days=i % 30)).isoformat() for i in range(200)]
+VALUES = PAYBACK_VALUES + DC_VALUES
+NUMBER = 20
+
+
+def with_dateutil():
+    for value in VALUES:
+        dateparser.parse(value)
+
+
+def with_fromisoformat_uncached():
+    for value in VALUES:
+        parse_timestamp.__wrapped__(value)
+
+
+def with_parse_timestamp():
+    parse_timestamp.cache_clear()
+    for value in VALUES:
+        parse_timestamp(value)
+
+
+# Beide Wege müssen denselben Zeitpunkt ergeben.
+for value in PAYBACK_VALUES[:5]:
+    assert dateparser.parse(value) == parse_timestamp(value)
+for value in DC_VALUES[:5]:
+    assert dateparser.parse(value).astimezone() == parse_timestamp(value)
+
+baseline = None
+for name, function in [
+    ("dateutil.parser.parse", with_dateutil),
+    ("fromisoformat (ohne Cache)", with_fromisoformat_uncached),
+    ("parse_timestamp (mit Cache)", with_parse_timestamp),
+]:
+    seconds = min(timeit.repeat(function, number=NUMBER, repeat=5))
+    per_value = seconds / (NUMBER * len(VALUES)) * 1e6
+    baseline = baseline or per_value
+
+    print(f"{name:30} {per_value:8.2f} µs/Zeitstempel  (x{baseline / per_value:.1f})")
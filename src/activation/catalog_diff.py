@@ -0,0 +1,53 @@
+from src.config import get_incremental_catalog
+from src.database.snapshots import get_coupon_snapshot, store_coupon_snapshot
+
+
+class CatalogSnapshot:
+    """
+    Vergleicht den aktuellen Coupon-Katalog eines Accounts mit dem Stand des letzten Laufs. Coupons, deren
+    Fingerabdruck (Status und Gültigkeit) sich nicht geändert hat und deren Entscheidung nicht zeitabhängig ist,
+    müssen nicht erneut ausgewertet werden.
+
+    Nur übersprungene Coupons werden vermerkt. Aktivierte und fehlerhafte Coupons werden im nächsten Lauf erneut
+    ausgewertet, sodass eine fehlgeschlagene Aktivierung nicht dauerhaft übergangen wird.
+    """
+
+    def __init__(self, provider, account_key):
+        self.provider = provider
+        self.account_key = account_key
+        self.enabled = get_incremental_catalog()
+        self.previous = (
+            get_coupon_snapshot(provider, account_key) if self.enabled else {}
+        )
+        self.current = {}
+
+    def is_unchanged(self, coupon_id, fingerprint, now):
+        """
+        :param now: aktueller Zeitpunkt als Unix-Timestamp
+        :return: True, wenn der Coupon seit dem letzten Lauf unverändert übersprungen werden kann
+        """
+        entry = self.previous.get(coupon_id)
+
+        if entry is None or entry[0] != fingerprint:
+            return False
+
+        recheck_at = entry[1]
+        if recheck_at is not None and recheck_at <= now:
+            return False
+
+        self.current[coupon_id] = entry
+        return True
+
+    def record_skipped(self, coupon_id, fingerprint, recheck_at=None):
+        """
+        Vermerkt einen übersprungenen Coupon.
+
+        :param recheck_at: Unix-Timestamp, ab dem der Coupon trotz unverändertem Fingerabdruck erneut ausgewertet
+            werden muss (z.B. Beginn der Gültigkeit), oder None
+        """
+        self.current[coupon_id] = [fingerprint, recheck_at]
+
+    def save(self):
+        # Coupons, die nicht mehr im Katalog enthalten sind, fallen dabei aus dem gespeicherten Stand heraus. Der Stand
+        # wird auch ohne INCREMENTAL_CATALOG gespeichert, da die Planung der Läufe darauf aufbaut.
+        store_coupon_snapshot(self.provider, self.account_key, self.current)
@@ -0,0 +1,63 @@
+from src.database.checkpoints import (
+    add_run_coupon,
+    complete_run_account,
+    get_run_account_result,
+    get_run_coupons,
+    get_unfinished_runs,
+)
+from src.database.database import get_dc_accounts_by_ids, get_payback_accounts_by_ids
+
+
+def load_interrupted_runs():
+    """
+    Lädt die Aktivierungsläufe, die vor einem Neustart nicht abgeschlossen wurden, mit ihren Accounts. Zwischenzeitlich
+    entfernte Accounts fallen dabei heraus.
+
+    :return: Liste von Tupeln (ID des Laufs, Zeilen aus dc_accounts, Zeilen aus payback_accounts)
+    """
+    runs = []
+
+    for run_id, dc_ids, payback_ids in get_unfinished_runs():
+        dc_accounts = get_dc_accounts_by_ids(dc_ids)
+        payback_accounts = get_payback_accounts_by_ids(payback_ids)
+
+        runs.append(
+            (
+                run_id,
+                [dc_accounts[i] for i in dc_ids if i in dc_accounts],
+                [payback_accounts[i] for i in payback_ids if i in payback_accounts],
+            )
+        )
+
+    return runs
+
+
+class AccountCheckpoint:
+    """
+    Zwischenstand eines Accounts innerhalb eines Aktivierungslaufs. Vermerkt jeden aktivierten Coupon sofort in der
+    Datenbank, sodass ein nach einem Neustart fortgesetzter Lauf diese Coupons nicht erneut aktiviert, aber weiterhin
+    als aktiviert zählt.
+    """
+
+    def __init__(self, run_id, provider, account_id):
+        self.run_id = run_id
+        self.provider = provider
+        self.account_id = account_id
+        self.activated = get_run_coupons(run_id, provider, account_id)
+
+    def completed_result(self):
+        """
+        :return: (Ergebnis-Tupel oder None, Fehlermeldung oder None), falls der Account in diesem Lauf bereits
+            abgeschlossen wurde, sonst None
+        """
+        return get_run_account_result(self.run_id, self.provider, self.account_id)
+
+    def is_activated(self, coupon_id):
+        return str(coupon_id) in self.activated
+
+    def record_activated(self, coupon_id):
+        self.activated.add(str(coupon_id))
+        add_run_coupon(self.run_id, self.provider, self.account_id, coupon_id)
+
+    def complete(self, result, error):
+        complete_run_account(self.run_id, self.provider, self.account_id, result, error)
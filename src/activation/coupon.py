@@ -0,0 +1,145 @@
+class Coupon:
+    """
+    Anbieterunabhängige, kompakte Darstellung eines Coupons. Ein Coupon wird je Account einmal aus der Antwort des
+    Anbieters erstellt; danach arbeiten Filter, Aktivierung und Log-Ausgaben nur noch mit diesem Objekt anstatt mit
+    den verschachtelten Dictionaries der API.
+    """
+
+    __slots__ = (
+        "provider",
+        "coupon_id",
+        "partner",
+        "status",
+        "valid_from",
+        "valid_to",
+        "headline",
+        "affiliate_url_app",
+        "affiliate_url_web",
+        "partner_subgroup",
+    )
+
+    def __init__(
+        self,
+        provider,
+        coupon_id,
+        partner,
+        status,
+        valid_from,
+        valid_to,
+        headline,
+        affiliate_url_app=None,
+        affiliate_url_web=None,
+        partner_subgroup=None,
+    ):
+        """
+        :param provider: "dc" oder "payback"
+        :param coupon_id: ID, mit der der Coupon aktiviert wird (DC: publicPromotionId, Payback: couponID)
+        :param partner: Anzeigename des Partners
+        :param status: Status des Coupons beim Anbieter (DC: z.B. "NRG", Payback: CouponStatus-Wert)
+        :param valid_from: Beginn der Gültigkeit bzw. Sichtbarkeit als String des Anbieters
+        :param valid_to: Ende der Gültigkeit bzw. Sichtbarkeit als String des Anbieters
+        :param headline: Anzeigetext für Log-Ausgaben
+        :param affiliate_url_app: Affiliate-Link für die App (nur DC), falls vorhanden
+        :param affiliate_url_web: Affiliate-Link für das Web (nur DC), falls vorhanden
+        :param partner_subgroup: Für die Aktivierung benötigte Partner-Untergruppe (nur DC)
+        """
+        self.provider = provider
+        self.coupon_id = coupon_id
+        self.partner = partner
+        self.status = status
+        self.valid_from = valid_from
+        self.valid_to = valid_to
+        self.headline = headline
+        self.affiliate_url_app = affiliate_url_app
+        self.affiliate_url_web = affiliate_url_web
+        self.partner_subgroup = partner_subgroup
+
+    @classmethod
+    def from_dc(cls, payload, metadata_store=None):
+        """
+        Erstellt einen Coupon aus einem Eintrag des Arrays "coupons" der DeutschlandCard-API. Ist ein
+        CouponMetadataStore angegeben, wird der Anzeigetext mit den anderen Accounts des Laufs geteilt.
+        """
+        content = payload["content"]
+        coupon_id = payload["publicPromotionId"]
+
+        def describe():
+            return (
+                content["headline"]
+                + " "
+                + content["shortDescription"]
+                + " "
+                + content["partnerName"]
+            )
+
+        return cls(
+            "dc",
+            coupon_id,
+            content["partnerName"],
+            payload["status"],
+            payload["visibleFrom"],
+            payload["visibleTo"],
+            (
+                metadata_store.get_description("dc", coupon_id, describe)
+                if metadata_store
+                else describe()
+            ),
+            affiliate_url_app=content.get("affiliateURLApp") or None,
+            affiliate_url_web=content.get("affiliateURLWeb") or None,
+            partner_subgroup=payload["partnerSubgroup"],
+        )
+
+    @classmethod
+    def from_payback(cls, payload, metadata_store=None):
+        """
+        Erstellt einen Coupon aus dem Feld "coupon" eines Eintrags des Arrays "couponListItem" der Payback-API. Ist
+        ein CouponMetadataStore angegeben, werden Partner und Anzeigetext mit den anderen Accounts des Laufs geteilt.
+        """
+        coupon_id = payload["couponID"]
+
+        def describe():
+            text_items = payload["couponContentSet"]["textItem"]
+
+            return (
+                payload["partner"][0]["partnerDisplayName"],
+                f"{text_items[2]['textValue']} {text_items[3]['textValue']}".replace(
+                    "\n", " "
+                ),
+            )
+
+        partner, headline = (
+            metadata_store.get_description("payback", coupon_id, describe)
+            if metadata_store
+            else describe()
+        )
+
+        return cls(
+            "payback",
+            coupon_id,
+            partner,
+            payload["couponStatus"],
+            payload["validity"]["validFrom"],
+            payload["validity"]["validTo"],
+            headline,
+        )
+
+    @property
+    def has_affiliate_url(self):
+        return bool(self.affiliate_url_app or self.affiliate_url_web)
+
+    def fingerprint(self):
+        """
+        Gibt alle Angaben zurück, von denen die Entscheidung über die Aktivierung des Coupons abhängt.
+        """
+        return repr(
+            (
+                self.status,
+                self.valid_from,
+                self.valid_to,
+                self.affiliate_url_app,
+                self.affiliate_url_web,
+            )
+        )
+
+    def __repr__(self):
+        return f"Coupon({self.provider}:{self.coupon_id}:{self.partner}:{self.status})"
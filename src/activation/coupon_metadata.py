@@ -0,0 +1,64 @@
+from loguru import logger
+
+from src.activation.timestamps import parse_timestamp
+
+
+class CouponMetadataStore:
+    """
+    Gemeinsamer Speicher für die aufbereiteten Angaben der Coupons eines Laufs. Accounts desselben Anbieters sehen
+    größtenteils dieselben Coupons; Gültigkeitszeiträume und Anzeigetexte werden daher je Coupon-ID nur einmal
+    geparst bzw. erstellt und für alle weiteren Accounts wiederverwendet.
+    """
+
+    def __init__(self):
+        self.descriptions = {}
+        self.validities = {}
+        self.parsed = 0
+        self.reused = 0
+
+    def get_description(self, provider, coupon_id, describe):
+        """
+        Gibt den Anzeigetext eines Coupons zurück. Der Anzeigetext kann auch aus mehreren Angaben bestehen (z.B. Partner
+        und Text), die gemeinsam als Tupel gespeichert werden.
+
+        :param describe: Funktion ohne Parameter, die den Anzeigetext erstellt, falls er noch nicht vorliegt
+        """
+        key = (provider, coupon_id)
+
+        description = self.descriptions.get(key)
+        if description is not None:
+            self.reused = self.reused + 1
+            return description
+
+        description = describe()
+        self.descriptions[key] = description
+        self.parsed = self.parsed + 1
+
+        return description
+
+    def get_validity(self, provider, coupon_id, valid_from, valid_to):
+        """
+        Gibt Beginn und Ende der Gültigkeit eines Coupons als datetime mit Zeitzone zurück. Die Rohwerte werden mit dem
+        gespeicherten Eintrag verglichen, sodass abweichende Angaben für einzelne Accounts korrekt geparst werden.
+        """
+        key = (provider, coupon_id)
+
+        entry = self.validities.get(key)
+        if entry is not None and entry[0] == valid_from and entry[1] == valid_to:
+            self.reused = self.reused + 1
+            return entry[2], entry[3]
+
+        begin = parse_timestamp(valid_from)
+        end = parse_timestamp(valid_to)
+        self.validities[key] = (valid_from, valid_to, begin, end)
+        self.parsed = self.parsed + 1
+
+        return begin, end
+
+    def log_statistics(self):
+        total = self.parsed + self.reused
+
+        logger.info(
+            f"Coupon metadata: {len(self.validities)} distinct validities and {len(self.descriptions)} descriptions "
+            f"prepared, {self.reused} of {total} lookups reused ({(self.reused / total * 100) if total else 0:.0f}%)."
+        )
@@ -0,0 +1,215 @@
+import asyncio
+from typing import NamedTuple, Optional
+
+from loguru import logger
+
+from src.activation.checkpoint import AccountCheckpoint
+from src.activation.coupon_metadata import CouponMetadataStore
+from src.config import (
+    get_dc_max_concurrent_accounts,
+    get_payback_max_concurrent_accounts,
+)
+from src.deutschland_card.DeutschlandCardApi import (
+    dc_activate_all_coupons_and_get_account_balance,
+)
+from src.metrics.tracing import CATEGORY_ACCOUNT, span
+from src.net.http_pool import log_pool_statistics
+from src.payback.PaybackAPI import payback_activate_all_available_coupons
+
+
+class AccountResult(NamedTuple):
+    """
+    Ergebnis der Aktivierung eines einzelnen Accounts.
+
+    result enthält das Tupel der Aktivierungsfunktionen (aktiviert, übersprungen, fehlerhaft, Punkte, bald
+    verfallende Punkte, Verfallsdatum). Ist bei der Verarbeitung ein Fehler aufgetreten, ist result None und
+    error enthält die Fehlermeldung.
+    """
+
+    provider: str
+    account_id: int
+    label: str
+    result: Optional[tuple]
+    error: Optional[str]
+
+
+def dc_account_label(account):
+    return account["dc_card_number"]
+
+
+def payback_account_label(account):
+    return account["payback_username"]
+
+
+def _load_checkpoint(provider, account, label, run_id):
+    """
+    :return: (AccountCheckpoint oder None, AccountResult, falls der Account im Lauf bereits abgeschlossen ist)
+    """
+    if run_id is None:
+        return None, None
+
+    checkpoint = AccountCheckpoint(run_id, provider, account["id"])
+
+    completed = checkpoint.completed_result()
+    if completed is not None:
+        logger.info(f"Account {label} was already completed in run {run_id}.")
+        return checkpoint, AccountResult(provider, account["id"], label, *completed)
+
+    return checkpoint, None
+
+
+async def _activate_account(provider, account, label, run_id, activate):
+    checkpoint, completed = _load_checkpoint(provider, account, label, run_id)
+    if completed is not None:
+        return completed
+
+    try:
+        # Jeder Account erhält im Trace eine eigene Spur, auf der seine Phasen eingetragen werden.
+        with span(
+            "account",
+            CATEGORY_ACCOUNT,
+            new_lane=True,
+            provider=provider,
+            account=label,
+        ):
+            result = await activate(checkpoint)
+    except Exception as e:
+        logger.error(f"Could not activate coupons for {label}: {e}")
+        result, error = None, str(e)
+    else:
+        _log_account_result(label, result)
+        error = None
+
+    if checkpoint is not None:
+        checkpoint.complete(result, error)
+
+    return AccountResult(provider, account["id"], label, result, error)
+
+
+async def activate_dc_account(account, metadata_store=None, run_id=None):
+    """
+    Aktiviert alle Coupons eines DeutschlandCard-Accounts (Zeile aus get_dc_accounts()) und gibt das Ergebnis als
+    AccountResult zurück. Fehler werden nicht weitergereicht, sondern im Ergebnis vermerkt.
+
+    Gehört die Aktivierung zu einem gespeicherten Aktivierungslauf (run_id), wird ihr Zwischenstand festgehalten; ein
+    im Lauf bereits abgeschlossener Account wird nicht erneut verarbeitet.
+    """
+    return await _activate_account(
+        "dc",
+        account,
+        dc_account_label(account),
+        run_id,
+        lambda checkpoint: dc_activate_all_coupons_and_get_account_balance(
+            account["dc_card_number"],
+            account["dc_birthdate"],
+            account["dc_plz"],
+            metadata_store,
+            checkpoint,
+        ),
+    )
+
+
+async def activate_payback_account(account, metadata_store=None, run_id=None):
+    """
+    Aktiviert alle Coupons eines Payback-Accounts (Zeile aus get_payback_accounts()) und gibt das Ergebnis als
+    AccountResult zurück. Fehler werden nicht weitergereicht, sondern im Ergebnis vermerkt.
+
+    Gehört die Aktivierung zu einem gespeicherten Aktivierungslauf (run_id), wird ihr Zwischenstand festgehalten; ein
+    im Lauf bereits abgeschlossener Account wird nicht erneut verarbeitet.
+    """
+    return await _activate_account(
+        "payback",
+        account,
+        payback_account_label(account),
+        run_id,
+        lambda checkpoint: payback_activate_all_available_coupons(
+            account["payback_username"],
+            account["payback_password"],
+            metadata_store,
+            checkpoint,
+        ),
+    )
+
+
+def _log_account_result(label, result):
+    (
+        count_activated,
+        count_skipped,
+        count_errored,
+        points,
+        expiring_points,
+        points_expiry,
+    ) = result
+
+    logger.info(
+        f"Activated {count_activated} coupons for {label}. Skipped {count_skipped} and errored {count_errored}."
+    )
+    logger.info(
+        f"Points for {label}: {points}. Expiring points: {expiring_points} at {points_expiry}."
+    )
+
+
+async def _activate_bounded(
+    semaphore, activate, account, metadata_store, run_id, progress
+):
+    async with semaphore:
+        account_result = await activate(account, metadata_store, run_id)
+
+    if progress is not None:
+        progress.record(account_result)
+
+    return account_result
+
+
+async def activate_all_accounts(
+    dc_accounts, payback_accounts, run_id=None, progress=None
+):
+    """
+    Aktiviert die Coupons aller übergebenen Accounts nebenläufig. Je Anbieter werden höchstens so viele Accounts
+    gleichzeitig verarbeitet, wie in der Konfiguration (DC_MAX_CONCURRENT_ACCOUNTS bzw.
+    PAYBACK_MAX_CONCURRENT_ACCOUNTS) angegeben ist.
+
+    :param dc_accounts: Zeilen der Tabelle dc_accounts
+    :param payback_accounts: Zeilen der Tabelle payback_accounts
+    :param run_id: ID des gespeicherten Aktivierungslaufs, dessen Zwischenstand festgehalten wird (optional)
+    :param progress: RunProgress, in dem jeder abgeschlossene Account vermerkt wird (optional)
+    :return: Listen der AccountResults für DeutschlandCard und Payback in der Reihenfolge der übergebenen Accounts
+    """
+    dc_semaphore = asyncio.Semaphore(get_dc_max_concurrent_accounts())
+    payback_semaphore = asyncio.Semaphore(get_payback_max_concurrent_accounts())
+
+    # Die aufbereiteten Coupon-Angaben werden von allen Accounts dieses Laufs gemeinsam genutzt.
+    metadata_store = CouponMetadataStore()
+
+    dc_tasks = [
+        _activate_bounded(
+            dc_semaphore,
+            activate_dc_account,
+            account,
+            metadata_store,
+            run_id,
+            progress,
+        )
+        for account in dc_accounts
+    ]
+    payback_tasks = [
+        _activate_bounded(
+            payback_semaphore,
+            activate_payback_account,
+            account,
+            metadata_store,
+            run_id,
+            progress,
+        )
+        for account in payback_accounts
+    ]
+
+    # Beide Anbieter laufen gleichzeitig; gather erhält die Reihenfolge der Accounts für den Bericht.
+    results = await asyncio.gather(*dc_tasks, *payback_tasks)
+
+    metadata_store.log_statistics()
+    if progress is not None:
+        progress.record_metadata(metadata_store.parsed, metadata_store.reused)
+    log_pool_statistics()
+
+    return list(results[: len(dc_tasks)]), list(results[len(dc_tasks) :])
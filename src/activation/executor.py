@@ -0,0 +1,57 @@
+import asyncio
+import threading
+
+from loguru import logger
+
+from src.net.http_pool import close_http_clients
+
+
+class ActivationExecutor:
+    """
+    Führt die Aktivierung in einer eigenen Event-Loop in einem eigenen Thread aus. Die Anfragen an die Anbieter, die
+    Datenbankzugriffe der Aktivierung und die Aufbereitung der Coupons laufen damit nicht in der Event-Loop des Bots,
+    der währenddessen weiter auf Befehle antwortet.
+    """
+
+    def __init__(self):
+        self.loop = None
+        self.thread = None
+
+    def start(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(
+            target=self._run_loop, name="activation", daemon=True
+        )
+        self.thread.start()
+
+        logger.info("Started activation executor.")
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    async def run(self, coroutine):
+        """
+        Führt die Coroutine in der Event-Loop der Aktivierung aus und wartet in der aufrufenden Event-Loop auf das
+        Ergebnis. Wird der Aufrufer abgebrochen, wird auch die Coroutine abgebrochen.
+        """
+        future = asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+        return await asyncio.wrap_future(future)
+
+    async def stop(self):
+        """
+        Beendet die Event-Loop der Aktivierung. Noch laufende Aktivierungen werden dabei nicht abgeschlossen, sondern
+        nach dem nächsten Start anhand ihres gespeicherten Zwischenstands fortgesetzt.
+        """
+        if self.loop is None:
+            return
+
+        # Die Verbindungen der Aktivierung werden in ihrer eigenen Event-Loop geschlossen.
+        await self.run(close_http_clients())
+
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        await asyncio.to_thread(self.thread.join)
+        self.loop.close()
+
+        self.loop = None
+        self.thread = None
@@ -0,0 +1,41 @@
+import time
+
+from src.database.history import (
+    OUTCOME_ACTIVATED,
+    OUTCOME_FAILED,
+    add_activation_history,
+)
+
+
+class ActivationHistory:
+    """
+    Sammelt die Ergebnisse der Aktivierungen eines Accounts während eines Laufs und schreibt sie am Ende gebündelt in
+    die Tabelle activation_history, anstatt für jeden Coupon einzeln auf die Datenbank zuzugreifen.
+    """
+
+    def __init__(self, provider, account_key):
+        self.provider = provider
+        self.account_key = account_key
+        self.rows = []
+
+    def record(self, coupon, activated, latency):
+        """
+        :param coupon: aktivierter bzw. fehlgeschlagener Coupon
+        :param activated: True, wenn die Aktivierung erfolgreich war
+        :param latency: Dauer der Aktivierung in Sekunden
+        """
+        self.rows.append(
+            {
+                "provider": self.provider,
+                "account_key": self.account_key,
+                "coupon_id": str(coupon.coupon_id),
+                "partner": coupon.partner,
+                "outcome": OUTCOME_ACTIVATED if activated else OUTCOME_FAILED,
+                "latency": latency,
+                "activated_at": time.time(),
+            }
+        )
+
+    def save(self):
+        add_activation_history(self.rows)
+        self.rows = []
@@ -0,0 +1,150 @@
+import codecs
+import json
+
+from src.net.resilience import TRANSIENT_ERRORS, get_circuit_breaker
+
+# Ab dieser Größe wird der bereits verarbeitete Teil des Puffers verworfen.
+_COMPACT_THRESHOLD = 64 * 1024
+
+
+async def iter_json_array(chunks, key):
+    """
+    Liefert die Elemente des Arrays unter dem Schlüssel key des äußersten JSON-Objekts einzeln, während die Daten
+    noch empfangen werden. Es wird nur das aktuell dekodierte Element im Speicher gehalten, unabhängig davon, wie
+    groß das Array insgesamt ist.
+
+    :param chunks: Asynchroner Iterator über die Bytes des JSON-Dokuments (z.B. response.aiter_bytes())
+    :param key: Name des Arrays im äußersten Objekt (z.B. "coupons" oder "couponListItem")
+    :raises ValueError: wenn das Dokument kein Array key enthält oder kein gültiges JSON ist
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder("utf-8")()
+    chunks = chunks.__aiter__()
+    buffer = ""
+    pos = 0
+
+    async def read_more():
+        nonlocal buffer, pos
+        try:
+            chunk = await chunks.__anext__()
+        except StopAsyncIteration:
+            return False
+
+        buffer = buffer[pos:] + text_decoder.decode(chunk)
+        pos = 0
+        return True
+
+    # Zuerst wird das Dokument bis zum Beginn des gesuchten Arrays durchsucht. Dabei werden Verschachtelung und
+    # Strings berücksichtigt, damit nur ein Schlüssel des äußersten Objekts als Treffer zählt.
+    depth = 0
+    in_string = False
+    escaped = False
+    expect_key = False
+    string_chars = []
+    last_key = None
+    after_colon = False
+
+    while True:
+        if pos >= len(buffer) and not await read_more():
+            # Wie beim vollständigen Laden ist eine Antwort ohne das Array (z.B. eine Fehlermeldung) ein Fehler und
+            # keine leere Liste.
+            raise ValueError(f"JSON document has no array {key}")
+
+        char = buffer[pos]
+        pos = pos + 1
+
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+                if depth == 1 and expect_key:
+                    last_key = "".join(string_chars)
+                    expect_key = False
+            elif depth == 1 and expect_key:
+                string_chars.append(char)
+            continue
+
+        if char in " \t\r\n":
+            continue
+
+        if after_colon:
+            after_colon = False
+            if char == "[" and last_key == key:
+                break
+
+        if char == '"':
+            in_string = True
+            string_chars = []
+        elif char in "{[":
+            depth = depth + 1
+            expect_key = depth == 1 and char == "{"
+        elif char in "}]":
+            depth = depth - 1
+        elif char == "," and depth == 1:
+            expect_key = True
+        elif char == ":" and depth == 1:
+            after_colon = True
+
+    # Danach werden die Elemente des Arrays einzeln dekodiert.
+    while True:
+        while True:
+            while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                pos = pos + 1
+            if pos < len(buffer):
+                break
+            if not await read_more():
+                raise ValueError(f"Unexpected end of JSON array {key}")
+
+        if buffer[pos] == "]":
+            return
+
+        try:
+            item, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            # Das Element ist noch nicht vollständig empfangen.
+            if not await read_more():
+                raise
+            continue
+
+        # Ein Element ist erst vollständig, wenn das folgende Trennzeichen empfangen wurde: Endet ein Chunk mitten in
+        # einer Zahl, würde raw_decode sonst nur deren Anfang liefern (z.B. 12 statt 12345 oder -1 statt -1.5).
+        # Andernfalls wird weiter gelesen und erneut dekodiert.
+        next_pos = end
+        while next_pos < len(buffer) and buffer[next_pos] in " \t\r\n":
+            next_pos = next_pos + 1
+        if next_pos >= len(buffer) or buffer[next_pos] not in ",]":
+            if not await read_more():
+                raise ValueError(f"Invalid or incomplete JSON array {key}")
+            continue
+
+        pos = end
+        if pos > _COMPACT_THRESHOLD:
+            buffer = buffer[pos:]
+            pos = 0
+
+        yield item
+
+
+async def iter_response_array(response, key, provider=None):
+    """
+    Liefert die Elemente des Arrays key aus einer gestreamten httpx-Antwort und schließt die Antwort danach.
+
+    Fehler beim Empfang oder Dekodieren treten erst beim Iterieren auf, also nachdem der mit provider_call versehene
+    Aufruf bereits zurückgekehrt ist. Sie werden nicht wiederholt, da die bis dahin gelieferten Coupons womöglich
+    schon aktiviert werden; der Account gilt als fehlerhaft und wird im nächsten Lauf erneut bearbeitet.
+    Verbindungsfehler zählen aber wie bei provider_call als Ausfall im Circuit Breaker des Anbieters.
+
+    :param provider: Kennung des Anbieters ("dc" oder "payback") für den Circuit Breaker (optional)
+    """
+    try:
+        async for item in iter_json_array(response.aiter_bytes(), key):
+            yield item
+    except TRANSIENT_ERRORS:
+        if provider is not None:
+            get_circuit_breaker(provider).record_failure(False)
+        raise
+    finally:
+        await response.aclose()
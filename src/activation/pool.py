@@ -0,0 +1,64 @@
+import asyncio
+
+
+async def as_async_iterable(items):
+    """
+    Stellt eine gewöhnliche Liste als asynchronen Iterator bereit.
+    """
+    for item in items:
+        yield item
+
+
+async def run_bounded(items, worker, parallelism):
+    """
+    Verarbeitet die Elemente mit einem Pool von höchstens parallelism gleichzeitig laufenden Workern. Jeder Worker
+    holt sich das nächste noch offene Element, sodass nie mehr als parallelism Aufrufe gleichzeitig aktiv sind.
+
+    Die Elemente können auch aus einem asynchronen Iterator stammen. Die Verarbeitung beginnt dann bereits, während
+    weitere Elemente noch erzeugt werden.
+
+    :param items: Liste oder asynchroner Iterator der zu verarbeitenden Elemente
+    :param worker: Coroutine-Funktion, die mit einem Element aufgerufen wird
+    :param parallelism: Maximale Anzahl gleichzeitiger Aufrufe (mindestens 1)
+    :return: Ergebnisse von worker in der Reihenfolge der Elemente
+    :raises: den ersten Fehler eines Workers, nachdem alle übrigen Worker beendet sind
+    """
+    if isinstance(items, list):
+        if not items:
+            return []
+        parallelism = min(parallelism, len(items))
+        items = as_async_iterable(items)
+
+    pending = items.__aiter__()
+    # Ein asynchroner Iterator darf nicht von mehreren Workern gleichzeitig weitergeschaltet werden.
+    lock = asyncio.Lock()
+    results = []
+
+    async def _next():
+        async with lock:
+            try:
+                item = await pending.__anext__()
+            except StopAsyncIteration:
+                return None
+
+            results.append(None)
+            return len(results) - 1, item
+
+    async def _work():
+        while (entry := await _next()) is not None:
+            index, item = entry
+            results[index] = await worker(item)
+
+    workers = [asyncio.create_task(_work()) for _ in range(max(parallelism, 1))]
+
+    try:
+        await asyncio.gather(*workers)
+    except BaseException:
+        # Schlägt ein Worker fehl (z.B. weil die gestreamte Liste abbricht), werden die übrigen abgebrochen und
+        # abgewartet, damit nach dem Fehler keine Aufrufe des Accounts mehr laufen.
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        raise
+
+    return results
@@ -0,0 +1,194 @@
+import asyncio
+import contextlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from loguru import logger
+
+from src.activation.engine import activate_all_accounts
+from src.activation.progress import RunProgress
+from src.database.history import create_history_table
+from src.database.snapshots import create_snapshot_table
+from src.database.tokens import create_token_table
+from src.metrics.registry import collect_metrics, merge_metrics, reset_metrics
+from src.metrics.tracing import Trace, current_trace, tracing
+from src.net.http_pool import close_http_clients
+
+
+def split_into_shards(accounts, shard_count):
+    """
+    Verteilt die Accounts reihum auf shard_count Shards. Jeder Eintrag eines Shards ist ein Tupel aus der
+    ursprünglichen Position und dem Account, damit die Ergebnisse später wieder in die Ausgangsreihenfolge gebracht
+    werden können.
+    """
+    shards = [[] for _ in range(shard_count)]
+
+    for index, account in enumerate(accounts):
+        shards[index % shard_count].append((index, account))
+
+    return shards
+
+
+class _ShardProgress(RunProgress):
+    """
+    Fortschritt eines Shards im Worker-Prozess. Jeder abgeschlossene Account wird zusätzlich über die Queue an den Bot
+    gemeldet, damit dessen Fortschrittsnachricht nicht erst am Ende des Shards weiterzählt.
+    """
+
+    def __init__(self, account_count, queue):
+        super().__init__(account_count)
+        self.queue = queue
+
+    def record(self, account_result):
+        super().record(account_result)
+
+        if self.queue is not None:
+            self.queue.put(account_result)
+
+
+async def _drain_progress(queue, progress):
+    # Liest die von den Prozessen gemeldeten Accounts, bis nach dem Ende aller Shards None eingereiht wird.
+    while (account_result := await asyncio.to_thread(queue.get)) is not None:
+        progress.record(account_result)
+
+
+async def _activate_and_close(dc_accounts, payback_accounts, run_id, progress):
+    try:
+        return await activate_all_accounts(
+            dc_accounts, payback_accounts, run_id, progress
+        )
+    finally:
+        await close_http_clients()
+
+
+def _activate_shard(dc_shard, payback_shard, run_id, trace_started_at, queue):
+    # Läuft im Worker-Prozess: Jeder Prozess hat seine eigene Event-Loop und damit auch seine eigenen
+    # HTTP-Sessions zu den Anbietern und Datenbankverbindungen.
+    # Ein Prozess kann mehrere Shards nacheinander bearbeiten und meldet jeweils nur die Metriken des Shards zurück.
+    reset_metrics()
+
+    # Wird der Lauf aufgezeichnet, zeichnet auch der Prozess seine Spans auf derselben Zeitachse auf.
+    trace = Trace(trace_started_at) if trace_started_at is not None else None
+    # Der Fortschritt des Shards meldet die abgeschlossenen Accounts und liefert die Wiederverwendung der
+    # Coupon-Angaben für den Fortschritt des Laufs.
+    progress = _ShardProgress(len(dc_shard) + len(payback_shard), queue)
+
+    with tracing(trace):
+        dc_results, payback_results = asyncio.run(
+            _activate_and_close(
+                [account for _, account in dc_shard],
+                [account for _, account in payback_shard],
+                run_id,
+                progress,
+            )
+        )
+
+    return (
+        list(zip([index for index, _ in dc_shard], dc_results)),
+        list(zip([index for index, _ in payback_shard], payback_results)),
+        collect_metrics(),
+        trace.events if trace is not None else [],
+        (progress.metadata_prepared, progress.metadata_reused),
+    )
+
+
+def _merge(indexed_results, count):
+    results = [None] * count
+
+    for index, result in indexed_results:
+        results[index] = result
+
+    return results
+
+
+async def activate_all_accounts_in_processes(
+    dc_accounts, payback_accounts, processes, run_id=None, progress=None
+):
+    """
+    Aktiviert die Coupons aller übergebenen Accounts in einem Pool aus processes Worker-Prozessen. Die Accounts
+    werden dazu in Shards aufgeteilt; innerhalb eines Shards arbeitet die nebenläufige Aktivierung aus
+    activate_all_accounts, deren Begrenzungen je Anbieter damit pro Prozess gelten.
+
+    :param dc_accounts: Zeilen der Tabelle dc_accounts
+    :param payback_accounts: Zeilen der Tabelle payback_accounts
+    :param processes: Anzahl der Worker-Prozesse
+    :param run_id: ID des gespeicherten Aktivierungslaufs, dessen Zwischenstand festgehalten wird (optional)
+    :param progress: RunProgress, in dem jeder von den Prozessen abgeschlossene Account vermerkt wird (optional)
+    :return: Listen der AccountResults für DeutschlandCard und Payback in der Reihenfolge der übergebenen Accounts
+    """
+    shard_count = max(1, min(processes, max(len(dc_accounts), len(payback_accounts))))
+
+    dc_shards = split_into_shards(dc_accounts, shard_count)
+    payback_shards = split_into_shards(payback_accounts, shard_count)
+
+    logger.info(
+        f"Activating {len(dc_accounts)} DC and {len(payback_accounts)} Payback accounts in {shard_count} processes."
+    )
+
+    # Die gemeinsam beschriebenen Tabellen werden vor dem Start der Prozesse angelegt.
+    create_token_table()
+    create_snapshot_table()
+    create_history_table()
+
+    trace = current_trace()
+    trace_started_at = trace.started_at if trace is not None else None
+
+    # Die Prozesse werden nicht vom Bot abgespalten (fork), sondern von einem eigenen Server-Prozess: Der Bot hat
+    # mehrere Threads (Aktivierung, Datenbank, Metriken, Telegram), deren Locks (Logging, SQLite, HTTP-Pools) beim
+    # Abspalten gesperrt übernommen werden und den Prozess blockieren könnten. Jeder Prozess öffnet seine
+    # Datenbankverbindungen und HTTP-Sessions daher selbst.
+    mp_context = multiprocessing.get_context("forkserver")
+    loop = asyncio.get_running_loop()
+
+    # Die Prozesse melden jeden abgeschlossenen Account über eine Queue, die ein Manager-Prozess bereitstellt.
+    with (
+        mp_context.Manager() if progress is not None else contextlib.nullcontext()
+    ) as manager, ProcessPoolExecutor(
+        max_workers=shard_count, mp_context=mp_context
+    ) as executor:
+        queue = manager.Queue() if manager is not None else None
+        drain = (
+            asyncio.create_task(_drain_progress(queue, progress))
+            if queue is not None
+            else None
+        )
+
+        futures = [
+            loop.run_in_executor(
+                executor,
+                _activate_shard,
+                dc_shards[i],
+                payback_shards[i],
+                run_id,
+                trace_started_at,
+                queue,
+            )
+            for i in range(shard_count)
+        ]
+
+        try:
+            shard_results = await asyncio.gather(*futures)
+        finally:
+            if drain is not None:
+                await asyncio.to_thread(queue.put, None)
+                await drain
+
+    if progress is not None:
+        for *_, metadata in shard_results:
+            progress.record_metadata(*metadata)
+
+    # Die Anfragen und Spans der Prozesse werden in den Metriken und dem Trace dieses Prozesses mitgezählt.
+    for _, _, metrics, events, _ in shard_results:
+        merge_metrics(metrics)
+        if trace is not None:
+            trace.extend(events)
+
+    dc_results = [r for dc_result, *_ in shard_results for r in dc_result]
+    payback_results = [
+        r for _, payback_result, *_ in shard_results for r in payback_result
+    ]
+
+    return (
+        _merge(dc_results, len(dc_accounts)),
+        _merge(payback_results, len(payback_accounts)),
+    )
@@ -0,0 +1,95 @@
+import time
+
+
+class RunProgress:
+    """
+    Fortschritt eines Aktivierungslaufs. Wird von der Aktivierung für jeden abgeschlossenen Account fortgeschrieben
+    und vom Bot regelmäßig gelesen, um die Fortschrittsnachricht zu aktualisieren.
+    """
+
+    def __init__(self, account_count):
+        self.account_count = account_count
+        self.completed_accounts = 0
+        self.failed_accounts = 0
+        self.activated_coupons = 0
+        self.metadata_prepared = 0
+        self.metadata_reused = 0
+        self.started_at = time.monotonic()
+
+    def record(self, account_result):
+        """
+        Vermerkt das AccountResult eines abgeschlossenen Accounts.
+        """
+        self.completed_accounts = self.completed_accounts + 1
+
+        if account_result.error is not None:
+            self.failed_accounts = self.failed_accounts + 1
+        else:
+            self.activated_coupons = self.activated_coupons + account_result.result[0]
+
+    def record_metadata(self, prepared, reused):
+        """
+        Vermerkt, wie oft die Angaben eines Coupons neu aufbereitet bzw. aus dem CouponMetadataStore wiederverwendet
+        wurden.
+        """
+        self.metadata_prepared = self.metadata_prepared + prepared
+        self.metadata_reused = self.metadata_reused + reused
+
+    @property
+    def elapsed_seconds(self):
+        return time.monotonic() - self.started_at
+
+    def eta_seconds(self):
+        """
+        :return: Geschätzte Restdauer in Sekunden anhand der bisherigen Dauer je Account, oder None, solange noch kein
+            Account abgeschlossen ist
+        """
+        if not self.completed_accounts:
+            return None
+
+        remaining = self.account_count - self.completed_accounts
+        return self.elapsed_seconds / self.completed_accounts * remaining
+
+    def describe(self, finished=False):
+        lines = [
+            (
+                "<b>Aktivierung abgeschlossen</b>"
+                if finished
+                else "<b>Aktivierung läuft …</b>"
+            ),
+            f"Accounts: {self.completed_accounts} von {self.account_count}"
+            + (f" ({self.failed_accounts} fehlerhaft)" if self.failed_accounts else ""),
+            f"Aktivierte Coupons: {self.activated_coupons}",
+        ]
+
+        if finished:
+            lines.append(f"Dauer: {_format_duration(self.elapsed_seconds)}")
+
+            lookups = self.metadata_prepared + self.metadata_reused
+            if lookups:
+                lines.append(
+                    f"Wiederverwendete Coupon-Angaben: {self.metadata_reused} von {lookups}"
+                    f" ({self.metadata_reused / lookups * 100:.0f} %)"
+                )
+        else:
+            eta = self.eta_seconds()
+            lines.append(
+                f"Verbleibend: ca. {_format_duration(eta)}"
+                if eta is not None
+                else "Verbleibend: unbekannt"
+            )
+
+        return "\n".join(lines)
+
+
+def _format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+
+    if minutes >= 60:
+        hours, minutes = divmod(minutes, 60)
+        return f"{hours} h {minutes} min"
+
+    if minutes:
+        return f"{minutes} min {seconds} s"
+
+    return f"{seconds} s"
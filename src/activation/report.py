@@ -0,0 +1,248 @@
+# Höchstlänge einer Telegram-Nachricht in Zeichen. Telegram zählt in UTF-16-Einheiten, ein Emoji zählt daher doppelt.
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+
+class ReportSection:
+    """
+    Abschnitt eines Berichts aus Überschrift und Zeilen. Die Zeilen werden erst beim Aufteilen in Nachrichten
+    zusammengesetzt, sodass der Aufwand auch bei vielen Accounts linear bleibt.
+    """
+
+    def __init__(self, title):
+        self.title = title
+        self.lines = []
+
+    def add(self, line):
+        self.lines.append(line)
+
+    def __bool__(self):
+        return bool(self.lines)
+
+
+class ReportHistory:
+    """
+    Merkt sich die zuletzt verschickte Zeile je Account und Nachricht. Damit enthält ein Bericht nur die Zeilen, die
+    sich seit dem letzten Bericht geändert haben; Fehler werden immer gemeldet.
+    """
+
+    def __init__(self):
+        self.lines = {}
+
+    def is_changed(self, kind, account_result, line):
+        key = (kind, account_result.provider, account_result.account_id)
+
+        if account_result.error is not None:
+            self.lines.pop(key, None)
+            return True
+
+        if self.lines.get(key) == line:
+            return False
+
+        self.lines[key] = line
+        return True
+
+
+class ReportDigest:
+    """
+    Sammelt die Ergebnisse der geplanten Läufe, die gebündelt in einem gemeinsamen Bericht verschickt werden. Je
+    Account bleibt ein Ergebnis: Aktivierte und fehlerhafte Coupons werden über die Läufe summiert, übersprungene
+    Coupons und der Punktestand stammen aus dem letzten Lauf. Ein fehlgeschlagener Lauf ersetzt das bisherige
+    Ergebnis des Accounts.
+    """
+
+    def __init__(self):
+        self.results = {"dc": {}, "payback": {}}
+
+    def add(self, dc_results, payback_results):
+        for provider, account_results in (
+            ("dc", dc_results),
+            ("payback", payback_results),
+        ):
+            results = self.results[provider]
+
+            for account_result in account_results:
+                key = account_result.account_id
+                previous = results.get(key)
+
+                if (
+                    previous is not None
+                    and previous.error is None
+                    and account_result.error is None
+                ):
+                    activated, _, errored, *_ = previous.result
+                    account_result = account_result._replace(
+                        result=(
+                            activated + account_result.result[0],
+                            account_result.result[1],
+                            errored + account_result.result[2],
+                            *account_result.result[3:],
+                        )
+                    )
+
+                results[key] = account_result
+
+    def take(self):
+        """
+        Gibt die gesammelten Ergebnisse zurück und leert den Digest.
+
+        :return: Listen der AccountResults für DeutschlandCard und Payback
+        """
+        dc_results = list(self.results["dc"].values())
+        payback_results = list(self.results["payback"].values())
+        self.results = {"dc": {}, "payback": {}}
+
+        return dc_results, payback_results
+
+
+def build_activation_report(dc_results, payback_results, history=None):
+    """
+    Erstellt aus den AccountResults die Telegram-Nachrichten: die ersten enthalten die Anzahl der aktivierten,
+    übersprungenen und fehlerhaften Coupons je Account, die folgenden die Punktestände. Jede Nachricht bleibt unter
+    TELEGRAM_MESSAGE_LIMIT Zeichen; längere Berichte werden an Zeilengrenzen aufgeteilt.
+
+    :param history: ReportHistory (optional); ist sie angegeben, enthält der Bericht nur geänderte Zeilen
+    :return: Liste der Nachrichten; leer, wenn keine Accounts vorhanden sind bzw. sich nichts geändert hat
+    """
+    activation_sections = []
+    points_sections = []
+
+    def add(section, kind, account_result, line):
+        if history is None or history.is_changed(kind, account_result, line):
+            section.add(line)
+
+    if dc_results:
+        activation = ReportSection(
+            "Für folgende DeutschlandCard-Accounts wurde eine Aktivierung durchgeführt:"
+        )
+        points = ReportSection("Punkte der DeutschlandCard-Accounts:")
+
+        for account_result in dc_results:
+            add(
+                activation,
+                "activation",
+                account_result,
+                _format_activation_line(account_result),
+            )
+            add(points, "points", account_result, _format_points_line(account_result))
+
+        activation_sections.append(activation)
+        points_sections.append(points)
+
+    if payback_results:
+        activation = ReportSection(
+            "Für folgende Payback-Accounts wurde eine Aktivierung durchgeführt:"
+        )
+        points = ReportSection("Punkte der Payback-Accounts:")
+
+        for account_result in payback_results:
+            add(
+                activation,
+                "activation",
+                account_result,
+                _format_activation_line(account_result),
+            )
+
+            # Fehlerhafte Payback-Accounts werden nur in der ersten Nachricht aufgeführt.
+            if account_result.error is None:
+                add(
+                    points,
+                    "points",
+                    account_result,
+                    _format_points_line(account_result),
+                )
+
+        activation_sections.append(activation)
+        points_sections.append(points)
+
+    # Aktivierungen und Punktestände beginnen jeweils mit einer neuen Nachricht.
+    return split_into_messages(activation_sections) + split_into_messages(
+        points_sections
+    )
+
+
+def split_into_messages(sections, limit=TELEGRAM_MESSAGE_LIMIT):
+    """
+    Setzt die nicht leeren Abschnitte zu Nachrichten zusammen, die höchstens limit Zeichen lang sind. Aufgeteilt wird
+    nur an Zeilengrenzen; die Überschrift eines Abschnitts steht nie allein am Ende einer Nachricht.
+
+    :return: Liste der Nachrichten
+    """
+    messages = []
+    parts = []
+    length = 0
+
+    def flush():
+        nonlocal parts, length
+
+        if parts:
+            messages.append("".join(parts).strip("\n"))
+        parts = []
+        length = 0
+
+    def append(text, reserve=0):
+        nonlocal length
+
+        if length + _length(text) + reserve > limit:
+            flush()
+
+        parts.append(text)
+        length = length + _length(text)
+
+    for section in sections:
+        if not section:
+            continue
+
+        title = section.title + "\n\n"
+
+        # Zwischen zwei Abschnitten einer Nachricht steht eine Leerzeile mehr.
+        append("\n" + title, reserve=_length(section.lines[0]) + 1)
+
+        for line in section.lines:
+            line = line + "\n"
+
+            # Eine Zeile, die selbst mit der Überschrift allein (samt Leerzeile davor) nicht in eine Nachricht passt
+            # (praktisch ausgeschlossen), wird hart gekürzt.
+            if _length("\n" + title) + _length(line) > limit:
+                line = _truncate(line, limit - _length("\n" + title))
+
+            # Wird ein Abschnitt aufgeteilt, beginnt die nächste Nachricht erneut mit seiner Überschrift.
+            if length + _length(line) > limit:
+                flush()
+                append(title, reserve=_length(line))
+
+            append(line)
+
+    flush()
+
+    return messages
+
+
+def _length(text):
+    return len(text.encode("utf-16-le")) // 2
+
+
+def _truncate(text, limit):
+    # Gekürzt wird in UTF-16-Einheiten; ein dabei geteiltes Emoji (Surrogatpaar) fällt ganz weg.
+    return text.encode("utf-16-le")[: limit * 2].decode("utf-16-le", errors="ignore")
+
+
+def _format_activation_line(account_result):
+    if account_result.error is not None:
+        return f"{account_result.label}: Fehler aufgetreten 👎."
+
+    count_activated, count_skipped, count_errored, _, _, _ = account_result.result
+
+    return f"{account_result.label}: 👍 {count_activated} 👌 {count_skipped} 👎 {count_errored}"
+
+
+def _format_points_line(account_result):
+    if account_result.error is not None:
+        return f"{account_result.label}: Fehler aufgetreten 👎."
+
+    _, _, _, points, expiring_points, points_expiry = account_result.result
+
+    return f"{account_result.label}: {points} Punkte " + (
+        f"({expiring_points} verfallen am {points_expiry})"
+        if expiring_points > 0
+        else ""
+    )
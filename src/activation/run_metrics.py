@@ -0,0 +1,76 @@
+from src.metrics.registry import Counter, Gauge, Histogram
+
+# Obergrenzen der Buckets in Sekunden für die Dauer eines Aktivierungslaufs
+RUN_BUCKETS = (1.0, 5.0, 15.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0, 3600.0)
+
+RUNS = Counter(
+    "coupons_activation_runs_total", "Abgeschlossene Aktivierungsläufe", ("status",)
+)
+RUN_SECONDS = Histogram(
+    "coupons_activation_run_seconds",
+    "Dauer der Aktivierungsläufe",
+    ("status",),
+    RUN_BUCKETS,
+)
+RUN_ACCOUNTS = Counter(
+    "coupons_activation_accounts_total",
+    "In Aktivierungsläufen verarbeitete Accounts",
+    ("provider", "status"),
+)
+RUN_COUPONS = Counter(
+    "coupons_activation_coupons_total",
+    "In Aktivierungsläufen ausgewertete Coupons",
+    ("provider", "outcome"),
+)
+RUN_METADATA_LOOKUPS = Counter(
+    "coupons_activation_metadata_lookups_total",
+    "In Aktivierungsläufen neu aufbereitete bzw. wiederverwendete Coupon-Angaben",
+    ("outcome",),
+)
+RUN_COUPONS_PER_SECOND = Gauge(
+    "coupons_activation_last_run_coupons_per_second",
+    "Aktivierte Coupons pro Sekunde im letzten Aktivierungslauf",
+)
+
+# Position der Zähler im Ergebnis-Tupel eines Accounts
+_OUTCOMES = (("activated", 0), ("skipped", 1), ("errored", 2))
+
+
+def record_activation_run(dc_results, payback_results, progress):
+    """
+    Erfasst einen abgeschlossenen Aktivierungslauf.
+
+    :param dc_results: AccountResults der DeutschlandCard-Accounts
+    :param payback_results: AccountResults der Payback-Accounts
+    :param progress: RunProgress des Laufs (Dauer und Wiederverwendung der Coupon-Angaben)
+    """
+    duration = progress.elapsed_seconds
+    activated = 0
+
+    for account_result in dc_results + payback_results:
+        if account_result.error is not None:
+            RUN_ACCOUNTS.inc(provider=account_result.provider, status="error")
+            continue
+
+        RUN_ACCOUNTS.inc(provider=account_result.provider, status="ok")
+
+        for outcome, index in _OUTCOMES:
+            RUN_COUPONS.inc(
+                account_result.result[index],
+                provider=account_result.provider,
+                outcome=outcome,
+            )
+
+        activated = activated + account_result.result[0]
+
+    RUN_METADATA_LOOKUPS.inc(progress.metadata_prepared, outcome="prepared")
+    RUN_METADATA_LOOKUPS.inc(progress.metadata_reused, outcome="reused")
+
+    RUNS.inc(status="completed")
+    RUN_SECONDS.observe(duration, status="completed")
+    RUN_COUPONS_PER_SECOND.set(activated / duration if duration > 0 else 0.0)
+
+
+def record_failed_activation_run(duration):
+    RUNS.inc(status="failed")
+    RUN_SECONDS.observe(duration, status="failed")
@@ -0,0 +1,267 @@
+import random
+import time
+
+from loguru import logger
+
+from src.activation.engine import dc_account_label, payback_account_label
+from src.activation.timing_wheel import TimingWheel
+from src.config import get_discovery_poll_hours
+from src.database.database import (
+    get_dc_accounts,
+    get_dc_accounts_by_ids,
+    get_payback_accounts,
+    get_payback_accounts_by_ids,
+    get_unscheduled_dc_accounts,
+    get_unscheduled_payback_accounts,
+    run_in_database_thread,
+    set_dc_accounts_next_due,
+    set_payback_accounts_next_due,
+)
+from src.database.snapshots import get_account_next_recheck_time
+
+# Mindestabstand in Sekunden zwischen zwei Läufen desselben Accounts, damit dicht aufeinanderfolgende
+# Gültigkeitsbeginne in einem Lauf zusammengefasst werden
+MIN_RUN_GAP = 5 * 60
+# Verzögerung in Sekunden nach dem Gültigkeitsbeginn, damit der Coupon beim Anbieter sicher aktivierbar ist
+VISIBILITY_GRACE = 60
+# Zufällige zusätzliche Verzögerung in Sekunden, damit Accounts mit demselben Gültigkeitsbeginn nicht gleichzeitig
+# fällig werden
+START_JITTER = 5 * 60
+# Anteil von DISCOVERY_POLL_HOURS, um den ein Suchlauf zufällig vorgezogen wird, damit sich die Accounts über den Tag
+# verteilen
+DISCOVERY_JITTER = 0.1
+# Zeitraum in Sekunden, über den beim Start des Bots überfällige bzw. neu registrierte Accounts verteilt werden
+STARTUP_SPREAD = 15 * 60
+NEW_ACCOUNT_SPREAD = 60
+
+# Auflösung und Anzahl der Fächer des Timing Wheels (eine Umdrehung entspricht einem Tag)
+TICK_SECONDS = 60
+WHEEL_SLOTS = 24 * 60
+
+# Anbieter: (Funktion für die Bezeichnung, Funktion zum Laden per IDs, Funktion zum Speichern der Fälligkeiten)
+_PROVIDERS = {
+    "dc": (dc_account_label, get_dc_accounts_by_ids, set_dc_accounts_next_due),
+    "payback": (
+        payback_account_label,
+        get_payback_accounts_by_ids,
+        set_payback_accounts_next_due,
+    ),
+}
+
+
+def get_account_next_due_time(provider, account_key, now=None):
+    """
+    Gibt den Zeitpunkt (Unix-Timestamp) zurück, zu dem ein Account erneut aktiviert werden soll. Das ist der im
+    gespeicherten Katalog des Accounts vermerkte früheste Beginn der Gültigkeit bzw. Sichtbarkeit eines noch nicht
+    aktivierbaren Coupons, spätestens aber der nächste Suchlauf nach etwa DISCOVERY_POLL_HOURS Stunden, der neu
+    hinzugekommene Coupons findet.
+
+    :param provider: "dc" oder "payback"
+    :param account_key: Kartennummer bzw. Benutzername des Accounts
+    :param now: Zeitpunkt des aktuellen Laufs als Unix-Timestamp (Standard: jetzt)
+    """
+    now = now or time.time()
+
+    discovery = get_discovery_poll_hours() * 60 * 60
+    next_due = now + discovery * random.uniform(1 - DISCOVERY_JITTER, 1)
+
+    upcoming = get_account_next_recheck_time(provider, account_key)
+    if upcoming is not None and upcoming > now:
+        next_due = min(
+            next_due, upcoming + VISIBILITY_GRACE + random.uniform(0, START_JITTER)
+        )
+
+    return max(next_due, now + MIN_RUN_GAP)
+
+
+class AccountScheduler:
+    """
+    Plant jeden Account einzeln ein. Die Fälligkeit wird in der Spalte next_due_at der Account-Tabellen gespeichert
+    und überdauert damit einen Neustart; im Speicher liegen nur die Schlüssel (Anbieter, Account-ID) in einem
+    TimingWheel, aus dem der regelmäßige Job des Bots die fälligen Accounts entnimmt.
+
+    Die Methoden, die während des Betriebs aufgerufen werden, greifen über run_in_database_thread auf die Datenbank
+    zu und schreiben die Fälligkeiten gebündelt; das TimingWheel wird nur in der Event-Loop verändert. Accounts, die
+    gerade aktiviert werden, sind bis zu ihrem reschedule in running vermerkt, damit sie nicht von einem zweiten Lauf
+    gleichzeitig aktiviert werden.
+    """
+
+    def __init__(self, now=None):
+        self.wheel = TimingWheel(TICK_SECONDS, WHEEL_SLOTS, now or time.time())
+        self.running = set()
+
+    async def load(self, now=None):
+        """
+        Lädt beim Start die gespeicherten Fälligkeiten aller Accounts.
+        """
+        self._schedule_all(
+            await run_in_database_thread(_load_due_times, now or time.time())
+        )
+
+        logger.info(f"Scheduled {len(self.wheel)} accounts.")
+
+    def _schedule_all(self, due_times):
+        for key, next_due_at in due_times:
+            self.wheel.schedule(key, next_due_at)
+
+    async def schedule_new_accounts(self, now=None):
+        """
+        Plant neu registrierte Accounts (ohne next_due_at) für die nächsten Minuten ein.
+        """
+        self._schedule_all(
+            await run_in_database_thread(_assign_new_due_times, now or time.time())
+        )
+
+    async def pop_due_accounts(self, now=None):
+        """
+        Entnimmt alle fälligen Accounts. Sie müssen nach ihrem Lauf mit reschedule erneut eingeplant werden.
+
+        :return: Listen der fälligen Zeilen aus dc_accounts und payback_accounts
+        """
+        due = self.wheel.advance(now or time.time())
+
+        if not due:
+            return [], []
+
+        # Die Accounts gelten schon während des Ladens als laufend, damit sie kein anderer Lauf beansprucht.
+        self.running.update(due)
+        dc_accounts, payback_accounts = await run_in_database_thread(
+            _load_accounts, due
+        )
+        self.running.difference_update(
+            set(due) - set(_keys(dc_accounts, payback_accounts))
+        )
+
+        return dc_accounts, payback_accounts
+
+    def claim(self, dc_accounts, payback_accounts):
+        """
+        Nimmt Accounts aus dem Zeitplan, die außerhalb davon aktiviert werden (z.B. beim Fortsetzen eines
+        unterbrochenen Laufs oder bei einem manuellen Lauf). Sie werden nach ihrem Lauf ebenfalls mit reschedule
+        erneut eingeplant.
+
+        :return: Listen der übergebenen Accounts ohne die, die bereits von einem anderen Lauf aktiviert werden
+        """
+        claimed = {"dc": [], "payback": []}
+
+        for provider, accounts in (("dc", dc_accounts), ("payback", payback_accounts)):
+            for account in accounts:
+                key = (provider, account["id"])
+                if key in self.running:
+                    continue
+
+                self.wheel.cancel(key)
+                self.running.add(key)
+                claimed[provider].append(account)
+
+        return claimed["dc"], claimed["payback"]
+
+    async def reschedule(self, dc_accounts, payback_accounts, now=None):
+        """
+        Plant die Accounts nach ihrem Lauf anhand ihres gespeicherten Coupon-Katalogs erneut ein.
+        """
+        due_times = await run_in_database_thread(
+            _assign_next_due_times,
+            dc_accounts,
+            payback_accounts,
+            now or time.time(),
+        )
+
+        # Erst mit der neuen Fälligkeit gelten die Accounts nicht mehr als laufend.
+        self.running.difference_update(_keys(dc_accounts, payback_accounts))
+        self._schedule_all(due_times)
+
+
+def _keys(dc_accounts, payback_accounts):
+    return [("dc", account["id"]) for account in dc_accounts] + [
+        ("payback", account["id"]) for account in payback_accounts
+    ]
+
+
+def _store(provider, next_due_times):
+    _, _, set_next_due = _PROVIDERS[provider]
+    set_next_due(next_due_times)
+
+
+def _load_due_times(now):
+    due_times = []
+
+    for provider, accounts in (
+        ("dc", get_dc_accounts()),
+        ("payback", get_payback_accounts()),
+    ):
+        overdue = []
+
+        for account in accounts:
+            next_due_at = account.get("next_due_at")
+
+            # Nach einer längeren Pause sind viele Accounts gleichzeitig überfällig und werden über STARTUP_SPREAD
+            # verteilt.
+            if next_due_at is None or next_due_at < now:
+                next_due_at = now + random.uniform(0, STARTUP_SPREAD)
+                overdue.append((account["id"], next_due_at))
+
+            due_times.append(((provider, account["id"]), next_due_at))
+
+        _store(provider, overdue)
+
+    return due_times
+
+
+def _assign_new_due_times(now):
+    due_times = []
+
+    for provider, accounts in (
+        ("dc", get_unscheduled_dc_accounts()),
+        ("payback", get_unscheduled_payback_accounts()),
+    ):
+        next_due_times = [
+            (account["id"], now + random.uniform(0, NEW_ACCOUNT_SPREAD))
+            for account in accounts
+        ]
+
+        _store(provider, next_due_times)
+        due_times.extend(
+            ((provider, account_id), next_due_at)
+            for account_id, next_due_at in next_due_times
+        )
+
+    return due_times
+
+
+def _assign_next_due_times(dc_accounts, payback_accounts, now):
+    due_times = []
+
+    for provider, accounts in (("dc", dc_accounts), ("payback", payback_accounts)):
+        label, _, _ = _PROVIDERS[provider]
+
+        next_due_times = [
+            (account["id"], get_account_next_due_time(provider, label(account), now))
+            for account in accounts
+        ]
+
+        _store(provider, next_due_times)
+        due_times.extend(
+            ((provider, account_id), next_due_at)
+            for account_id, next_due_at in next_due_times
+        )
+
+    return due_times
+
+
+def _load_accounts(keys):
+    ids = {"dc": [], "payback": []}
+    for provider, account_id in keys:
+        ids[provider].append(account_id)
+
+    due = {}
+    for provider, account_ids in ids.items():
+        _, get_accounts, _ = _PROVIDERS[provider]
+        accounts = get_accounts(account_ids)
+
+        # Zwischenzeitlich entfernte Accounts fallen dabei heraus; die Reihenfolge der Fälligkeiten bleibt erhalten.
+        due[provider] = [
+            accounts[account_id] for account_id in account_ids if account_id in accounts
+        ]
+
+    return due["dc"], due["payback"]
@@ -0,0 +1,27 @@
+import datetime
+import functools
+
+from dateutil import parser as dateparser
+
+
+@functools.lru_cache(maxsize=4096)
+def parse_timestamp(value):
+    """
+    Parst einen Zeitstempel der Anbieter in ein datetime mit Zeitzone. Payback liefert ISO-8601 mit Offset
+    (z.B. "2024-02-22T20:04:32+01:00" oder "2019-09-18T22:01:37+02"), DeutschlandCard ohne Offset in lokaler Zeit.
+    Diese Formate verarbeitet datetime.fromisoformat direkt; nur unerwartete Formate werden an dateutil übergeben.
+
+    Da viele Coupons dieselben Zeitstempel haben, werden die Ergebnisse zwischengespeichert.
+
+    :param value: Zeitstempel als String
+    :return: datetime mit Zeitzone; Zeitstempel ohne Offset werden als lokale Zeit interpretiert
+    """
+    try:
+        parsed = datetime.datetime.fromisoformat(value)
+    except ValueError:
+        parsed = dateparser.parse(value)
+
+    if parsed.tzinfo is None:
+        parsed = parsed.astimezone()
+
+    return parsed
@@ -0,0 +1,76 @@
+import math
+
+
+class TimingWheel:
+    """
+    Timing Wheel für eine große Anzahl geplanter Einträge. Die Zeit ist in Ticks zu tick_seconds Sekunden eingeteilt,
+    die reihum auf slot_count Fächer verteilt werden. Ein Eintrag liegt im Fach seines Fälligkeits-Ticks; liegt die
+    Fälligkeit mehr als eine Umdrehung entfernt, bleibt er beim Weiterdrehen so lange liegen, bis seine Runde erreicht
+    ist. Einplanen und Entnehmen kosten damit unabhängig von der Anzahl der Einträge nur einen Zugriff auf ein Fach.
+    """
+
+    def __init__(self, tick_seconds, slot_count, now):
+        """
+        :param tick_seconds: Dauer eines Ticks in Sekunden (Auflösung der Fälligkeiten)
+        :param slot_count: Anzahl der Fächer; slot_count * tick_seconds ist die Dauer einer Umdrehung
+        :param now: Startzeitpunkt als Unix-Timestamp
+        """
+        self.tick_seconds = tick_seconds
+        self.slots = [{} for _ in range(slot_count)]
+        self.locations = {}
+        # Letzter bereits abgearbeiteter Tick
+        self.position = self._tick(now) - 1
+
+    def _tick(self, timestamp):
+        return int(timestamp // self.tick_seconds)
+
+    def __len__(self):
+        return len(self.locations)
+
+    def __contains__(self, key):
+        return key in self.locations
+
+    def schedule(self, key, due):
+        """
+        Plant key zum Zeitpunkt due (Unix-Timestamp) ein. Ein bereits eingeplanter Eintrag wird dabei verschoben;
+        ein bereits vergangener Zeitpunkt wird beim nächsten Weiterdrehen fällig.
+        """
+        self.cancel(key)
+
+        # Aufgerundet, damit ein Eintrag nie vor seiner Fälligkeit entnommen wird.
+        tick = max(math.ceil(due / self.tick_seconds), self.position + 1)
+        slot = tick % len(self.slots)
+
+        self.slots[slot][key] = tick
+        self.locations[key] = slot
+
+    def cancel(self, key):
+        slot = self.locations.pop(key, None)
+        if slot is not None:
+            del self.slots[slot][key]
+
+    def advance(self, now):
+        """
+        Dreht das Rad bis zum Zeitpunkt now weiter und entnimmt alle bis dahin fälligen Einträge.
+
+        :return: Liste der fälligen Einträge, nach Fälligkeit sortiert
+        """
+        target = self._tick(now)
+        due = []
+
+        # Nach einer Unterbrechung von mehr als einer Umdrehung genügt es, jedes Fach einmal zu besuchen.
+        first = max(self.position + 1, target - len(self.slots) + 1)
+
+        for tick in range(first, target + 1):
+            slot = self.slots[tick % len(self.slots)]
+
+            for key, key_tick in list(slot.items()):
+                if key_tick <= target:
+                    del slot[key]
+                    del self.locations[key]
+                    due.append((key_tick, key))
+
+        self.position = max(self.position, target)
+
+        due.sort(key=lambda entry: entry[0])
+        return [key for _, key in due]
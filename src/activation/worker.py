@@ -0,0 +1,245 @@
+import asyncio
+import json
+import os
+import socket
+import time
+
+from loguru import logger
+
+from src.activation.coupon_metadata import CouponMetadataStore
+from src.activation.engine import (
+    AccountResult,
+    activate_dc_account,
+    activate_payback_account,
+    dc_account_label,
+    payback_account_label,
+)
+from src.config import (
+    get_worker_concurrency,
+    get_worker_lease_seconds,
+    get_worker_run_timeout_seconds,
+)
+from src.database.checkpoints import remove_activation_run
+from src.database.database import (
+    get_dc_account_by_id,
+    get_payback_account_by_id,
+    run_in_database_thread,
+)
+from src.database.leases import (
+    LEASE_DONE,
+    claim_next_lease,
+    complete_lease,
+    create_run,
+    get_run_leases,
+    remove_run,
+    renew_lease,
+)
+from src.database.history import create_history_table
+from src.database.snapshots import create_snapshot_table
+from src.database.tokens import create_token_table
+from src.net.http_pool import close_http_clients
+
+# Wartezeit in Sekunden, bevor ein Worker ohne Arbeit bzw. der Koordinator erneut in der Datenbank nachsieht
+POLL_INTERVAL = 5
+
+
+async def run_worker(worker_id=None):
+    """
+    Startet den Worker-Modus: Der Worker beansprucht fortlaufend Accounts aus offenen Aktivierungsläufen, aktiviert
+    deren Coupons und schreibt das Ergebnis zurück. Mehrere Worker (auch auf verschiedenen Rechnern) können sich
+    dieselbe Datenbank teilen.
+    """
+    worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+    concurrency = get_worker_concurrency()
+
+    logger.info(f"Worker {worker_id} started with concurrency {concurrency}.")
+
+    # Die gemeinsam beschriebenen Tabellen werden angelegt, bevor mehrere Accounts gleichzeitig darauf schreiben.
+    create_token_table()
+    create_snapshot_table()
+    create_history_table()
+
+    # Die aufbereiteten Coupon-Angaben werden innerhalb eines Laufs von allen Accounts des Workers geteilt.
+    metadata_stores = {}
+
+    try:
+        await asyncio.gather(
+            *(_work(worker_id, metadata_stores) for _ in range(concurrency))
+        )
+    finally:
+        await close_http_clients()
+
+
+async def _work(worker_id, metadata_stores):
+    lease_seconds = get_worker_lease_seconds()
+
+    while True:
+        lease = await run_in_database_thread(claim_next_lease, worker_id, lease_seconds)
+
+        if lease is None:
+            await asyncio.sleep(POLL_INTERVAL)
+            continue
+
+        if lease["run_id"] not in metadata_stores:
+            # Nur der Speicher des aktuellen Laufs wird aufbewahrt.
+            metadata_stores.clear()
+            metadata_stores[lease["run_id"]] = CouponMetadataStore()
+
+        await _process_lease(
+            lease, worker_id, lease_seconds, metadata_stores[lease["run_id"]]
+        )
+
+
+async def _heartbeat(lease, worker_id, lease_seconds, activation):
+    # Das Lease wird regelmäßig verlängert, lange bevor es abläuft. Nur wenn der Worker abstürzt oder hängt, läuft es
+    # ab und kann von einem anderen Worker übernommen werden. Ist es verloren, wird die Aktivierung abgebrochen, damit
+    # der Account nie von zwei Workern gleichzeitig bearbeitet wird.
+    while True:
+        await asyncio.sleep(lease_seconds / 3)
+
+        if not await run_in_database_thread(
+            renew_lease, lease["id"], worker_id, lease_seconds
+        ):
+            logger.warning(
+                f"Worker {worker_id} lost lease {lease['id']} for {lease['provider']} account {lease['account_id']},"
+                f" cancelling its activation."
+            )
+            activation.cancel()
+            return False
+
+
+async def _process_lease(lease, worker_id, lease_seconds, metadata_store):
+    if lease["provider"] == "dc":
+        account = await run_in_database_thread(
+            get_dc_account_by_id, lease["account_id"]
+        )
+        activate = activate_dc_account
+    else:
+        account = await run_in_database_thread(
+            get_payback_account_by_id, lease["account_id"]
+        )
+        activate = activate_payback_account
+
+    if account is None:
+        result, error = None, "Account nicht gefunden"
+    else:
+        # Der Zwischenstand wird unter der ID des Laufs festgehalten, sodass ein Worker, der das Lease nach einem
+        # Absturz übernimmt, bei den noch nicht aktivierten Coupons fortsetzt.
+        activation = asyncio.create_task(
+            activate(account, metadata_store, lease["run_id"])
+        )
+        heartbeat = asyncio.create_task(
+            _heartbeat(lease, worker_id, lease_seconds, activation)
+        )
+
+        try:
+            account_result = await activation
+        except asyncio.CancelledError:
+            # Nur ein Abbruch durch den Heartbeat wird hier behandelt; wird der Worker selbst beendet, geht der
+            # Abbruch weiter.
+            if not heartbeat.done() or heartbeat.cancelled():
+                raise
+            return
+        finally:
+            heartbeat.cancel()
+
+        result, error = account_result.result, account_result.error
+
+    if not await run_in_database_thread(
+        complete_lease, lease["id"], worker_id, result, error
+    ):
+        logger.warning(
+            f"Worker {worker_id} could not complete lease {lease['id']}; it was taken over by another worker and"
+            f" the result is dropped."
+        )
+
+
+async def activate_all_accounts_with_workers(
+    dc_accounts, payback_accounts, run_id=None, progress=None
+):
+    """
+    Koordiniert einen Aktivierungslauf im Worker-Modus: Für jeden Account wird ein Lease angelegt, das die Worker
+    abarbeiten. Anschließend werden die Ergebnisse eingesammelt. Accounts, die bis zum Ablauf von
+    WORKER_RUN_TIMEOUT_SECONDS nicht bearbeitet wurden, werden als fehlerhaft gemeldet.
+
+    :param run_id: ID eines gespeicherten Aktivierungslaufs (optional). Wird ein unterbrochener Lauf fortgesetzt,
+        werden dessen noch vorhandene Leases weiterverwendet.
+    :param progress: RunProgress, in dem die von den Workern abgeschlossenen Accounts vermerkt werden (optional)
+    :return: Listen der AccountResults für DeutschlandCard und Payback in der Reihenfolge der übergebenen Accounts
+    """
+    if not dc_accounts and not payback_accounts:
+        return [], []
+
+    if run_id is None:
+        run_id = create_run(dc_accounts, payback_accounts)
+        owns_checkpoints = True
+    else:
+        if not get_run_leases(run_id):
+            create_run(dc_accounts, payback_accounts, run_id)
+        owns_checkpoints = False
+    deadline = time.monotonic() + get_worker_run_timeout_seconds()
+
+    recorded = set()
+
+    while True:
+        leases = get_run_leases(run_id)
+
+        if progress is not None:
+            _record_progress(progress, leases, recorded)
+
+        if all(lease["status"] == LEASE_DONE for lease in leases):
+            break
+
+        if time.monotonic() > deadline:
+            logger.error(f"Activation run {run_id} timed out waiting for workers.")
+            break
+
+        await asyncio.sleep(POLL_INTERVAL)
+
+    remove_run(run_id)
+    # Ohne gespeicherten Aktivierungslauf werden die Zwischenstände der Worker nicht mehr benötigt.
+    if owns_checkpoints:
+        remove_activation_run(run_id)
+
+    results = {(lease["provider"], lease["account_id"]): lease for lease in leases}
+
+    return (
+        [
+            _to_account_result(results, "dc", account, dc_account_label(account))
+            for account in dc_accounts
+        ],
+        [
+            _to_account_result(
+                results, "payback", account, payback_account_label(account)
+            )
+            for account in payback_accounts
+        ],
+    )
+
+
+def _record_progress(progress, leases, recorded):
+    for lease in leases:
+        if lease["status"] == LEASE_DONE and lease["id"] not in recorded:
+            recorded.add(lease["id"])
+            progress.record(
+                _to_account_result(
+                    {(lease["provider"], lease["account_id"]): lease},
+                    lease["provider"],
+                    {"id": lease["account_id"]},
+                    None,
+                )
+            )
+
+
+def _to_account_result(results, provider, account, label):
+    lease = results.get((provider, account["id"]))
+
+    if lease is None or lease["status"] != LEASE_DONE:
+        return AccountResult(
+            provider, account["id"], label, None, "Zeitüberschreitung der Worker"
+        )
+
+    data = json.loads(lease["result"])
+    result = tuple(data["result"]) if data["result"] is not None else None
+
+    return AccountResult(provider, account["id"], label, result, data["error"])
@@ -0,0 +1,115 @@
+import asyncio
+import time
+from typing import NamedTuple, Optional
+
+from loguru import logger
+
+from src.database.tokens import get_cached_token, remove_token, store_token
+from src.metrics.tracing import span
+
+# Abstand in Sekunden zum vom Anbieter angegebenen Ablauf, ab dem ein Token nicht mehr verwendet wird
+EXPIRY_MARGIN = 60
+
+
+class UnauthorizedError(Exception):
+    """
+    Wird von den API-Clients ausgelöst, wenn der Anbieter eine Anfrage wegen eines ungültigen oder abgelaufenen
+    Tokens ablehnt.
+    """
+
+
+class IssuedToken(NamedTuple):
+    """
+    Token zusammen mit der Gültigkeitsdauer in Sekunden, die der Anbieter beim Login angegeben hat. Eine
+    Login-Funktion kann ihn anstelle des reinen Tokens zurückgeben; ist expires_in None, gilt die konfigurierte Dauer.
+    """
+
+    token: object
+    expires_in: Optional[float]
+
+
+class CachedToken:
+    """
+    Verwaltet den Token eines Accounts über mehrere Läufe hinweg. Der Token wird in der Datenbank gespeichert und
+    wiederverwendet, solange er nicht abgelaufen ist. Gibt der Anbieter beim Login eine Gültigkeitsdauer an, läuft der
+    Token kurz davor ab, ansonsten nach der konfigurierten Dauer. Lehnt der Anbieter einen Aufruf als nicht autorisiert ab, wird
+    automatisch neu eingeloggt und der Aufruf einmal wiederholt.
+    """
+
+    def __init__(self, provider, account_key, login, ttl_seconds):
+        """
+        :param provider: Kennung des Anbieters ("dc" oder "payback")
+        :param account_key: Kennung des Accounts (Kartennummer oder Benutzername)
+        :param login: Coroutine-Funktion ohne Parameter, die einen neuen Token oder einen IssuedToken liefert
+        :param ttl_seconds: Gültigkeitsdauer eines neuen Tokens in Sekunden, falls der Anbieter keine angibt. Bei 0
+            wird kein Token zwischengespeichert.
+        """
+        self.provider = provider
+        self.account_key = account_key
+        self.login = login
+        self.ttl_seconds = ttl_seconds
+        self.token = None
+        self.lock = asyncio.Lock()
+
+    async def get(self):
+        async with self.lock:
+            if self.token is None:
+                self.token = get_cached_token(self.provider, self.account_key)
+
+            if self.token is None:
+                await self._refresh()
+
+            return self.token
+
+    async def _refresh(self):
+        logger.debug(f"Logging in {self.provider} account {self.account_key}.")
+
+        with span("login"):
+            issued = await self.login()
+
+        if isinstance(issued, IssuedToken):
+            self.token, expires_in = issued
+        else:
+            self.token, expires_in = issued, None
+
+        store_token(
+            self.provider,
+            self.account_key,
+            self.token,
+            time.time() + self._lifetime(expires_in),
+        )
+
+    def _lifetime(self, expires_in):
+        # Die Angabe des Anbieters hat Vorrang, außer das Zwischenspeichern ist abgeschaltet.
+        if expires_in is None or self.ttl_seconds <= 0:
+            return self.ttl_seconds
+
+        return max(expires_in - EXPIRY_MARGIN, 0)
+
+    async def invalidate(self, rejected_token):
+        async with self.lock:
+            # Laufen mehrere Aufrufe gleichzeitig in einen abgelaufenen Token, loggt nur der erste neu ein.
+            if self.token is not rejected_token:
+                return
+
+            remove_token(self.provider, self.account_key)
+            await self._refresh()
+
+    async def call(self, request):
+        """
+        Führt request mit dem aktuellen Token aus. Wird der Token abgelehnt, wird er erneuert und der Aufruf einmal
+        wiederholt.
+
+        :param request: Coroutine-Funktion, die den Token als einzigen Parameter erhält
+        """
+        token = await self.get()
+
+        try:
+            return await request(token)
+        except UnauthorizedError:
+            logger.info(
+                f"Token of {self.provider} account {self.account_key} was rejected, logging in again."
+            )
+            await self.invalidate(token)
+
+            return await request(await self.get())
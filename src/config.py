@@ -1,12 +1,68 @@
 import configparser
+import os
+import time
 
+from loguru import logger
 
-# Liest die secrets.properties Datei und gibt ein ConfigParser-Objekt zurück.
-def read_secrets():
-    config = configparser.ConfigParser()
-    config.read("secrets.properties")
+SECRETS_FILE = "secrets.properties"
+# Abstand in Sekunden, in dem höchstens geprüft wird, ob die secrets.properties Datei geändert wurde
+RELOAD_CHECK_SECONDS = 1.0
+
+
+class _Secrets:
+    """
+    Einmal eingelesener Stand der secrets.properties Datei samt der daraus abgeleiteten Werte, die bei jeder
+    Telegram-Nachricht benötigt werden.
+    """
+
+    def __init__(self, mtime, config):
+        self.mtime = mtime
+        self.config = config
+
+        allowed_user_ids = config.get("secrets", "ALLOWED_USER_IDS", fallback="")
+        self.allowed_user_ids = [
+            user_id.strip()
+            for user_id in allowed_user_ids.split(",")
+            if user_id.strip()
+        ]
+        self.allowed_user_id_set = frozenset(self.allowed_user_ids)
+
+
+_secrets = None
+_checked_at = 0.0
+
+
+def _load_secrets():
+    global _secrets, _checked_at
 
-    return config
+    now = time.monotonic()
+    if _secrets is not None and now - _checked_at < RELOAD_CHECK_SECONDS:
+        return _secrets
+
+    _checked_at = now
+
+    try:
+        mtime = os.stat(SECRETS_FILE).st_mtime_ns
+    except OSError:
+        mtime = None
+
+    # Die Datei wird nur neu eingelesen, wenn sie sich seit dem letzten Einlesen geändert hat.
+    if _secrets is None or _secrets.mtime != mtime:
+        config = configparser.ConfigParser()
+        config.read(SECRETS_FILE)
+
+        if _secrets is not None:
+            logger.info(f"Reloaded {SECRETS_FILE}.")
+
+        _secrets = _Secrets(mtime, config)
+
+    return _secrets
+
+
+# Gibt ein ConfigParser-Objekt mit dem Inhalt der secrets.properties Datei zurück. Die Datei wird nur einmal eingelesen
+# und automatisch neu geladen, sobald sie geändert wurde; das Objekt darf daher nicht verändert werden.
+def read_secrets():
+    return _load_secrets().config
 
 
 # Gibt das Telegram-API-Token aus der secrets.properties Datei zurück.
@@ -20,9 +76,13 @@ def get_telegram_token():
 # in der secrets.properties Datei definiert. Gibt eine Liste von Strings zurück.
 # Nur diese Benutzer dürfen mit dem Bot interagieren.
 def get_allowed_user_ids():
-    config = read_secrets()
-    allowed_user_ids = config.get("secrets", "ALLOWED_USER_IDS")
-    return allowed_user_ids.split(",")
+    return _load_secrets().allowed_user_ids
+
+
+# Gibt an, ob der Benutzer mit der übergebenen ID mit dem Bot interagieren darf. Die Prüfung erfolgt ohne Zugriff auf
+# die Datei über eine beim Einlesen erstellte Menge.
+def is_allowed_user_id(user_id):
+    return str(user_id) in _load_secrets().allowed_user_id_set
 
 
 # Gibt die DeutschlandCard-Kartennummer zurück. Diese wird nur für Test-Methoden innerhalb des Projekts
@@ -95,3 +155,286 @@ def get_payback_principal():
     config = read_secrets()
     principal = config.get("secrets", "PAYBACK_PRINCIPAL")
     return principal
+
+
+# Gibt an, wie viele DeutschlandCard-Accounts gleichzeitig verarbeitet werden dürfen. Die Einstellung ist optional
+# und befindet sich im Abschnitt [settings] der secrets.properties Datei.
+def get_dc_max_concurrent_accounts():
+    config = read_secrets()
+    return config.getint("settings", "DC_MAX_CONCURRENT_ACCOUNTS", fallback=4)
+
+
+# Gibt an, wie viele Payback-Accounts gleichzeitig verarbeitet werden dürfen. Die Einstellung ist optional
+# und befindet sich im Abschnitt [settings] der secrets.properties Datei.
+def get_payback_max_concurrent_accounts():
+    config = read_secrets()
+    return config.getint("settings", "PAYBACK_MAX_CONCURRENT_ACCOUNTS", fallback=4)
+
+
+# Gibt an, wie viele Coupons eines DeutschlandCard-Accounts gleichzeitig aktiviert werden dürfen. Die Einstellung ist
+# optional und befindet sich im Abschnitt [settings] der secrets.properties Datei.
+def get_dc_coupon_activation_parallelism():
+    config = read_secrets()
+    return config.getint("settings", "DC_COUPON_ACTIVATION_PARALLELISM", fallback=4)
+
+
+# Gibt an, wie viele Coupons eines Payback-Accounts gleichzeitig aktiviert werden dürfen. Die Einstellung ist
+# optional und befindet sich im Abschnitt [settings] der secrets.properties Datei.
+def get_payback_coupon_activation_parallelism():
+    config = read_secrets()
+    return config.getint(
+        "settings", "PAYBACK_COUPON_ACTIVATION_PARALLELISM", fallback=4
+    )
+
+
+# Gibt die Anzahl der Worker-Prozesse zurück, auf die die Accounts bei der Aktivierung verteilt werden. Bei 0 oder 1
+# läuft die Aktivierung im Prozess des Bots. Die Einstellung ist optional und befindet sich im Abschnitt [settings]
+# der secrets.properties Datei.
+def get_activation_processes():
+    config = read_secrets()
+    return config.getint("settings", "ACTIVATION_PROCESSES", fallback=0)
+
+
+# Gibt die URL der Datenbank zurück, in der die Accounts gespeichert werden. Mehrere Instanzen im Worker-Modus müssen
+# dieselbe Datenbank verwenden. Die Einstellung ist optional und befindet sich im Abschnitt [settings] der
+# secrets.properties Datei.
+def get_database_url():
+    config = read_secrets()
+    return config.get("settings", "DATABASE_URL", fallback="sqlite:///accounts.db")
+
+
+# Gibt an, ob der Bot die Aktivierung an separat gestartete Worker (main.py --worker) verteilt, anstatt sie selbst
+# durchzuführen. Die Einstellung ist optional und befindet sich im Abschnitt [settings] der secrets.properties Datei.
+def get_use_activation_workers():
+    config = read_secrets()
+    return config.getboolean("settings", "USE_ACTIVATION_WORKERS", fallback=False)
+
+
+# Gibt die Anzahl der Accounts zurück, die ein Worker gleichzeitig bearbeitet. Die Einstellung ist optional und
+# befindet sich im Abschnitt [settings] der secrets.properties Datei.
+def get_worker_concurrency():
+    config = read_secrets()
+    return config.getint("settings", "WORKER_CONCURRENCY", fallback=4)
+
+
+# Gibt die Dauer in Sekunden zurück, für die ein Worker einen Account beansprucht, ohne sich erneut zu melden. Die
+# Einstellung ist optional und befindet sich im Abschnitt [settings] der secrets.properties Datei.
+def get_worker_lease_seconds():
+    config = read_secrets()
+    return config.getint("settings", "WORKER_LEASE_SECONDS", fallback=120)
+
+
+# Gibt die maximale Dauer in Sekunden zurück, die der Bot auf die Ergebnisse der Worker wartet. Die Einstellung ist
+# optional und befindet sich im Abschnitt [settings] der secrets.properties Datei.
+def get_worker_run_timeout_seconds():
+    config = read_secrets()
+    return config.getint("settings", "WORKER_RUN_TIMEOUT_SECONDS", fallback=60 * 60)
+
+
+# Gibt die Dauer in Sekunden zurück, für die ein X-Auth-Token der DeutschlandCard zwischengespeichert wird. Die
+# Einstellung ist optional und befindet sich im Abschnitt [settings] der secrets.properties Datei.
+def get_dc_token_ttl_seconds():
+    config = read_secrets()
+    return config.getint("settings", "DC_TOKEN_TTL_SECONDS", fallback=30 * 60)
+
+
+# Gibt die Dauer in Sekunden zurück, für die eine Payback-Authentifizierung zwischengespeichert wird. Die Einstellung
+# ist optional und befindet sich im Abschnitt [settings] der secrets.properties Datei.
+def get_payback_token_ttl_seconds():
+    config = read_secrets()
+    return config.getint("settings", "PAYBACK_TOKEN_TTL_SECONDS", fallback=60 * 60)
+
+
+# Gibt an, ob unveränderte Coupons aus früheren Läufen ohne erneute Auswertung übersprungen werden. Die Einstellung
+# ist optional und befindet sich im Abschnitt [settings] der secrets.properties Datei.
+def get_incremental_catalog():
+    config = read_secrets()
+    return config.getboolean("settings", "INCREMENTAL_CATALOG", fallback=True)
+
+
+# Gibt an, ob die Coupon-Listen der Anbieter einzeln während des Empfangs dekodiert werden, anstatt die vollständige
+# Antwort in den Speicher zu laden. Die Einstellung ist optional und befindet sich im Abschnitt [settings] der
+# secrets.properties Datei.
+def get_stream_coupon_lists():
+    config = read_secrets()
+    return config.getboolean("settings", "STREAM_COUPON_LISTS", fallback=True)
+
+
+# Gibt an, wie viele Anfragen pro Sekunde je Endpunkt an die DeutschlandCard-Server gestellt werden dürfen. Die
+# Einstellung ist optional und befindet sich im Abschnitt [settings] der secrets.properties Datei.
+def get_dc_requests_per_second():
+    config = read_secrets()
+    return config.getfloat("settings", "DC_REQUESTS_PER_SECOND", fallback=10.0)
+
+
+# Gibt an, wie viele Anfragen pro Sekunde je Endpunkt an die Payback-Server gestellt werden dürfen. Die Einstellung
+# ist optional und befindet sich im Abschnitt [settings] der secrets.properties Datei.
+def get_payback_requests_per_second():
+    config = read_secrets()
+    return config.getfloat("settings", "PAYBACK_REQUESTS_PER_SECOND", fallback=10.0)
+
+
+# Gibt die Obergrenze der gleichzeitigen Anfragen an die DeutschlandCard-Server zurück. Innerhalb dieser Grenze wird
+# die Parallelität automatisch an die Antwortzeiten angepasst. Die Einstellung ist optional und befindet sich im
+# Abschnitt [settings] der secrets.properties Datei.
+def get_dc_max_concurrent_requests():
+    config = read_secrets()
+    return config.getint("settings", "DC_MAX_CONCURRENT_REQUESTS", fallback=16)
+
+
+# Gibt die Obergrenze der gleichzeitigen Anfragen an die Payback-Server zurück. Innerhalb dieser Grenze wird die
+# Parallelität automatisch an die Antwortzeiten angepasst. Die Einstellung ist optional und befindet sich im
+# Abschnitt [settings] der secrets.properties Datei.
+def get_payback_max_concurrent_requests():
+    config = read_secrets()
+    return config.getint("settings", "PAYBACK_MAX_CONCURRENT_REQUESTS", fallback=16)
+
+
+# Gibt an, wie oft ein wiederholbarer Aufruf an einen Anbieter bei vorübergehenden Fehlern höchstens versucht wird. Die
+# Einstellung ist optional und befindet sich im Abschnitt [settings] der secrets.properties Datei.
+def get_provider_call_attempts():
+    config = read_secrets()
+    return config.getint("settings", "PROVIDER_CALL_ATTEMPTS", fallback=3)
+
+
+# Gibt die Anzahl aufeinanderfolgender vorübergehender Fehler zurück, ab der ein Anbieter als ausgefallen gilt. Die
+# Einstellung ist optional und befindet sich im Abschnitt [settings] der secrets.properties Datei.
+def get_circuit_breaker_failure_threshold():
+    config = read_secrets()
+    return config.getint("settings", "CIRCUIT_BREAKER_FAILURE_THRESHOLD", fallback=5)
+
+
+# Gibt die Dauer in Sekunden zurück, für die Aufrufe an einen ausgefallenen Anbieter sofort abgelehnt werden, bevor ein
+# erneuter Versuch erfolgt. Die Einstellung ist optional und befindet sich im Abschnitt [settings] der
+# secrets.properties Datei.
+def get_circuit_breaker_reset_seconds():
+    config = read_secrets()
+    return config.getint("settings", "CIRCUIT_BREAKER_RESET_SECONDS", fallback=30)
+
+
+# Gibt die maximale Anzahl der Verbindungen zurück, die der gemeinsame Verbindungspool je Anbieter offen hält. Die
+# Einstellung ist optional und befindet sich im Abschnitt [settings] der secrets.properties Datei.
+def get_http_pool_size():
+    config = read_secrets()
+    return config.getint("settings", "HTTP_POOL_SIZE", fallback=20)
+
+
+# Gibt die Dauer in Sekunden zurück, für die eine unbenutzte Verbindung zu einem Anbieter für weitere Anfragen offen
+# gehalten wird. Die Einstellung ist optional und befindet sich im Abschnitt [settings] der secrets.properties Datei.
+def get_http_keepalive_seconds():
+    config = read_secrets()
+    return config.getfloat("settings", "HTTP_KEEPALIVE_SECONDS", fallback=60.0)
+
+
+# Gibt an, ob die Anfragen an die Anbieter über HTTP/2 gebündelt werden, sofern die Server dies unterstützen. Die
+# Einstellung ist optional und befindet sich im Abschnitt [settings] der secrets.properties Datei.
+def get_http2_enabled():
+    config = read_secrets()
+    return config.getboolean("settings", "HTTP2", fallback=False)
+
+
+# Gibt den Abstand in Stunden zurück, in dem spätestens ein vollständiger Lauf nach neuen Coupons sucht, auch wenn laut
+# den gespeicherten Katalogen kein Coupon gültig wird. Die Einstellung ist optional und befindet sich im Abschnitt
+# [settings] der secrets.properties Datei.
+def get_discovery_poll_hours():
+    config = read_secrets()
+    return config.getfloat("settings", "DISCOVERY_POLL_HOURS", fallback=12.0)
+
+
+# Gibt an, ob ein Bericht nur die Accounts enthält, deren Ergebnis oder Punktestand sich seit dem letzten Bericht
+# geändert hat. Die Einstellung ist optional und befindet sich im Abschnitt [settings] der secrets.properties Datei.
+def get_report_only_changes():
+    config = read_secrets()
+    return config.getboolean("settings", "REPORT_ONLY_CHANGES", fallback=False)
+
+
+# Gibt den Abstand in Stunden zurück, in dem die Ergebnisse der geplanten Läufe gesammelt in einem Bericht verschickt
+# werden. Bei 0 wird nach jedem geplanten Lauf ein eigener Bericht verschickt. Die Einstellung ist optional und befindet
+# sich im Abschnitt [settings] der secrets.properties Datei.
+def get_report_digest_hours():
+    config = read_secrets()
+    return config.getfloat("settings", "REPORT_DIGEST_HOURS", fallback=24.0)
+
+
+# Gibt den Abstand in Sekunden zurück, in dem die Fortschrittsnachricht eines Aktivierungslaufs aktualisiert wird.
+# Läufe, die schneller abgeschlossen sind, erhalten keine Fortschrittsnachricht. Die Einstellung ist optional und
+# befindet sich im Abschnitt [settings] der secrets.properties Datei.
+def get_progress_update_seconds():
+    config = read_secrets()
+    return config.getfloat("settings", "PROGRESS_UPDATE_SECONDS", fallback=15.0)
+
+
+# Gibt den Port zurück, unter dem die Metriken im Textformat von Prometheus bereitgestellt werden. Bei 0 wird kein
+# Metrik-Endpunkt gestartet. Die Einstellung ist optional und befindet sich im Abschnitt [settings] der
+# secrets.properties Datei.
+def get_metrics_port():
+    config = read_secrets()
+    return config.getint("settings", "METRICS_PORT", fallback=0)
+
+
+# Gibt die Adresse zurück, an die der Metrik-Endpunkt gebunden wird. Standardmäßig ist er nur lokal erreichbar. Die
+# Einstellung ist optional und befindet sich im Abschnitt [settings] der secrets.properties Datei.
+def get_metrics_host():
+    config = read_secrets()
+    return config.get("settings", "METRICS_HOST", fallback="127.0.0.1")
+
+
+# Gibt an, ob die Aktivierungsläufe mit ihren Phasen (Login, Coupon-Abfrage, Aktivierung, Punktestand, Bericht)
+# aufgezeichnet werden. Die Einstellung ist optional und befindet sich im Abschnitt [settings] der secrets.properties
+# Datei.
+def get_tracing_enabled():
+    config = read_secrets()
+    return config.getboolean("settings", "TRACING", fallback=False)
+
+
+# Gibt das Verzeichnis zurück, in das die Trace-Dateien der aufgezeichneten Läufe geschrieben werden. Die Einstellung
+# ist optional und befindet sich im Abschnitt [settings] der secrets.properties Datei.
+def get_trace_directory():
+    config = read_secrets()
+    return config.get("settings", "TRACE_DIRECTORY", fallback="traces")
+
+
+# Gibt die Basis-URL der DeutschlandCard-API zurück. Sie wird nur geändert, um die Aktivierung gegen einen lokalen
+# Ersatz-Server (siehe benchmark/mock_providers.py) laufen zu lassen. Die Einstellung ist optional und befindet sich
+# im Abschnitt [settings] der secrets.properties Datei.
+def get_dc_api_base_url():
+    config = read_secrets()
+    return config.get(
+        "settings",
+        "DC_API_BASE_URL",
+        fallback="https://wsp.deutschlandcard.de/dlc-integration/app-dc/v2",
+    )
+
+
+# Gibt die Basis-URL der Payback-API zurück. Wie bei get_dc_api_base_url wird sie nur für lokale Ersatz-Server
+# geändert. Die Einstellung ist optional und befindet sich im Abschnitt [settings] der secrets.properties Datei.
+def get_payback_api_base_url():
+    config = read_secrets()
+    return config.get(
+        "settings",
+        "PAYBACK_API_BASE_URL",
+        fallback=f"https://services-ext.payback.de/{get_payback_principal()}/v1",
+    )
+
+
+# Gibt die Datei zurück, in die alle Anfragen an die Anbieter mit ihren Antworten bereinigt aufgezeichnet werden
+# (leer = keine Aufzeichnung). Die Einstellung ist optional und befindet sich im Abschnitt [settings] der
+# secrets.properties Datei.
+def get_http_record_file():
+    config = read_secrets()
+    return config.get("settings", "HTTP_RECORD_FILE", fallback="")
+
+
+# Gibt die Datei einer Aufzeichnung zurück, deren Antworten statt der Anbieter abgespielt werden (leer = Anfragen an
+# die Anbieter). Die Einstellung ist optional und befindet sich im Abschnitt [settings] der secrets.properties Datei.
+def get_http_replay_file():
+    config = read_secrets()
+    return config.get("settings", "HTTP_REPLAY_FILE", fallback="")
+
+
+# Gibt den Faktor zurück, mit dem die aufgezeichnete Dauer der Anfragen beim Abspielen gewartet wird (1 = wie bei
+# der Aufzeichnung, 0 = ohne Wartezeit). Die Einstellung ist optional und befindet sich im Abschnitt [settings] der
+# secrets.properties Datei.
+def get_http_replay_speed():
+    config = read_secrets()
+    return config.getfloat("settings", "HTTP_REPLAY_SPEED", fallback=1.0)
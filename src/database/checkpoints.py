@@ -0,0 +1,161 @@
+import json
+import time
+import uuid
+
+from loguru import logger
+
+from src.database.database import db
+
+# Ein Aktivierungslauf wird mit seinen Accounts gespeichert, sobald er beginnt. Für jeden abgeschlossenen Account wird
+# das Ergebnis, für jeden aktivierten Coupon dessen ID vermerkt. Nach einem Neustart kann ein unterbrochener Lauf
+# damit beim nächsten offenen Account bzw. Coupon fortgesetzt werden.
+RUN_RUNNING = "running"
+
+_tables_ready = False
+
+
+def _prepare_tables():
+    global _tables_ready
+
+    if _tables_ready:
+        return
+
+    runs = db["activation_runs"]
+    runs.create_column("run_id", db.types.string(36))
+    runs.create_column("status", db.types.string(16))
+    runs.create_column("started_at", db.types.float)
+    runs.create_column("accounts", db.types.text)
+    runs.create_index(["run_id"])
+
+    accounts = db["run_accounts"]
+    accounts.create_column("run_id", db.types.string(36))
+    accounts.create_column("provider", db.types.string(16))
+    accounts.create_column("account_id", db.types.integer)
+    accounts.create_column("result", db.types.text)
+    accounts.create_index(["run_id", "provider", "account_id"])
+
+    coupons = db["run_coupons"]
+    coupons.create_column("run_id", db.types.string(36))
+    coupons.create_column("provider", db.types.string(16))
+    coupons.create_column("account_id", db.types.integer)
+    coupons.create_column("coupon_id", db.types.string(64))
+    coupons.create_index(["run_id", "provider", "account_id"])
+
+    _tables_ready = True
+
+
+def create_activation_run(dc_accounts, payback_accounts):
+    """
+    Speichert einen neuen Aktivierungslauf mit den IDs seiner Accounts.
+
+    :return: ID des Laufs
+    """
+    _prepare_tables()
+    run_id = str(uuid.uuid4())
+
+    db["activation_runs"].insert(
+        {
+            "run_id": run_id,
+            "status": RUN_RUNNING,
+            "started_at": time.time(),
+            "accounts": json.dumps(
+                {
+                    "dc": [account["id"] for account in dc_accounts],
+                    "payback": [account["id"] for account in payback_accounts],
+                }
+            ),
+        }
+    )
+
+    logger.info(
+        f"Started activation run {run_id} with {len(dc_accounts)} DC and {len(payback_accounts)} Payback accounts."
+    )
+
+    return run_id
+
+
+def get_unfinished_runs():
+    """
+    Gibt die Läufe zurück, die vor einem Neustart nicht abgeschlossen wurden.
+
+    :return: Liste von Tupeln (ID des Laufs, IDs der DC-Accounts, IDs der Payback-Accounts)
+    """
+    _prepare_tables()
+
+    runs = []
+    for row in db["activation_runs"].find(status=RUN_RUNNING, order_by="started_at"):
+        accounts = json.loads(row["accounts"])
+        runs.append((row["run_id"], accounts["dc"], accounts["payback"]))
+
+    return runs
+
+
+def remove_activation_run(run_id):
+    """
+    Entfernt einen abgeschlossenen Lauf samt aller Zwischenstände.
+    """
+    _prepare_tables()
+
+    db["activation_runs"].delete(run_id=run_id)
+    db["run_accounts"].delete(run_id=run_id)
+    db["run_coupons"].delete(run_id=run_id)
+
+
+def complete_run_account(run_id, provider, account_id, result, error):
+    _prepare_tables()
+
+    db["run_accounts"].insert(
+        {
+            "run_id": run_id,
+            "provider": provider,
+            "account_id": account_id,
+            "result": json.dumps({"result": result, "error": error}),
+        }
+    )
+
+
+def get_run_account_result(run_id, provider, account_id):
+    """
+    :return: (Ergebnis-Tupel oder None, Fehlermeldung oder None), falls der Account im Lauf abgeschlossen ist, sonst
+        None
+    """
+    _prepare_tables()
+
+    row = db["run_accounts"].find_one(
+        run_id=run_id, provider=provider, account_id=account_id
+    )
+
+    if row is None:
+        return None
+
+    data = json.loads(row["result"])
+    result = tuple(data["result"]) if data["result"] is not None else None
+
+    return result, data["error"]
+
+
+def add_run_coupon(run_id, provider, account_id, coupon_id):
+    _prepare_tables()
+
+    db["run_coupons"].insert(
+        {
+            "run_id": run_id,
+            "provider": provider,
+            "account_id": account_id,
+            "coupon_id": str(coupon_id),
+        }
+    )
+
+
+def get_run_coupons(run_id, provider, account_id):
+    """
+    Gibt die IDs der Coupons zurück, die im Lauf für den Account bereits aktiviert wurden.
+    """
+    _prepare_tables()
+
+    return {
+        row["coupon_id"]
+        for row in db["run_coupons"].find(
+            run_id=run_id, provider=provider, account_id=account_id
+        )
+    }
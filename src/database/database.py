@@ -1,18 +1,160 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
 import dataset
 from loguru import logger
+from sqlalchemy import bindparam, text
+
+from src.config import get_database_url
+
+# Bei SQLite schreibt dataset im WAL-Modus, sodass Lesezugriffe nicht auf laufende Schreibzugriffe warten. Zusätzlich
+# wird nur noch an Checkpoints synchronisiert und bei gesperrter Datenbank bis zu fünf Sekunden gewartet, anstatt
+# sofort mit einem Fehler abzubrechen.
+_SQLITE_STATEMENTS = ["PRAGMA synchronous=NORMAL", "PRAGMA busy_timeout=5000"]
+
+
+def _connect(url):
+    if not url.startswith("sqlite"):
+        return dataset.connect(url)
+
+    # dataset verwendet je Thread eine eigene Verbindung; die Prüfung von sqlite3 würde nur das Schließen der
+    # Verbindung des Datenbank-Threads beim Beenden verhindern.
+    return dataset.connect(
+        url,
+        engine_kwargs={"connect_args": {"check_same_thread": False}},
+        sqlite_wal_mode=True,
+        on_connect_statements=list(_SQLITE_STATEMENTS),
+    )
+
+
+db = _connect(get_database_url())
+
+# Höchstzahl der IDs je Abfrage, damit die Grenze der Parameter je Anweisung von SQLite nicht erreicht wird
+_IDS_PER_QUERY = 500
+
+
+class _AccountStatements:
+    """
+    Einmal erstellte Anweisungen für eine Account-Tabelle. Sie werden von SQLAlchemy nur einmal kompiliert und vom
+    Datenbanktreiber je Verbindung als vorbereitete Anweisungen wiederverwendet.
+    """
+
+    def __init__(self, table):
+        self.all = text(f"SELECT * FROM {table} ORDER BY id")
+        self.by_id = text(f"SELECT * FROM {table} WHERE id = :id")
+        self.by_ids = text(f"SELECT * FROM {table} WHERE id IN :ids").bindparams(
+            bindparam("ids", expanding=True)
+        )
+        self.unscheduled = text(
+            f"SELECT * FROM {table} WHERE next_due_at IS NULL ORDER BY id"
+        )
+        self.set_next_due = text(
+            f"UPDATE {table} SET next_due_at = :next_due_at WHERE id = :id"
+        )
+        self.delete = text(f"DELETE FROM {table} WHERE id = :id")
+
+
+_dc_statements = _AccountStatements("dc_accounts")
+_payback_statements = _AccountStatements("payback_accounts")
+
+_tables_ready = False
+_executor = None
+
+
+async def run_in_database_thread(function, *args, **kwargs):
+    """
+    Führt eine Funktion mit Datenbankzugriff in einem eigenen Thread aus, damit die Event-Loop des Bots währenddessen
+    weiter Nachrichten verarbeiten kann. Alle so ausgeführten Zugriffe laufen nacheinander im selben Thread und
+    damit über dieselbe Verbindung.
+    """
+    global _executor
+
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="database")
+
+    return await asyncio.get_running_loop().run_in_executor(
+        _executor, functools.partial(function, *args, **kwargs)
+    )
+
+
+def _prepare_tables():
+    global _tables_ready
+
+    if _tables_ready:
+        return
+
+    dc_accounts = db["dc_accounts"]
+    dc_accounts.create_column("dc_card_number", db.types.text)
+    dc_accounts.create_column("dc_birthdate", db.types.text)
+    dc_accounts.create_column("dc_plz", db.types.text)
+    dc_accounts.create_column("next_due_at", db.types.float)
+
+    payback_accounts = db["payback_accounts"]
+    payback_accounts.create_column("payback_username", db.types.text)
+    payback_accounts.create_column("payback_password", db.types.text)
+    payback_accounts.create_column("next_due_at", db.types.float)
+
+    # Eine Kartennummer bzw. ein Benutzername kann nur einmal registriert werden.
+    for table, column in (
+        (dc_accounts, "dc_card_number"),
+        (payback_accounts, "payback_username"),
+    ):
+        try:
+            table.create_index([column], name=f"ux_{table.name}_{column}", unique=True)
+        except Exception as e:
+            logger.warning(
+                f"Could not create unique index on {table.name}.{column}; remove the duplicate accounts: {e}"
+            )
+
+        table.create_index(["next_due_at"], name=f"ix_{table.name}_next_due_at")
+
+    _tables_ready = True
+
+
+def _query(statement, **params):
+    _prepare_tables()
+
+    return list(db.query(statement, **params))
+
+
+def _query_by_ids(statement, account_ids):
+    _prepare_tables()
+
+    account_ids = list(account_ids)
+    accounts = []
 
-db = dataset.connect("sqlite:///accounts.db")
+    for start in range(0, len(account_ids), _IDS_PER_QUERY):
+        accounts.extend(
+            db.query(statement, ids=account_ids[start : start + _IDS_PER_QUERY])
+        )
+
+    return accounts
+
+
+def _execute_many(statement, rows):
+    _prepare_tables()
+
+    if not rows:
+        return
+
+    # Alle Zeilen werden in einer Transaktion geschrieben.
+    with db:
+        db.executable.execute(statement, rows)
 
 
 def insert_dc_account(dc_card_number, dc_birthdate, dc_plz):
+    _prepare_tables()
     table = db["dc_accounts"]
 
-    table.insert(
+    # Wird eine bereits registrierte Karte erneut registriert, werden nur deren Angaben aktualisiert.
+    table.upsert(
         {
             "dc_card_number": dc_card_number,
             "dc_birthdate": dc_birthdate,
             "dc_plz": dc_plz,
-        }
+        },
+        ["dc_card_number"],
     )
 
     logger.info(
@@ -21,10 +163,13 @@ def insert_dc_account(dc_card_number, dc_birthdate, dc_plz):
 
 
 def insert_payback_account(payback_username, payback_password):
+    _prepare_tables()
     table = db["payback_accounts"]
 
-    table.insert(
-        {"payback_username": payback_username, "payback_password": payback_password}
+    # Wird ein bereits registrierter Account erneut registriert, wird nur dessen Passwort aktualisiert.
+    table.upsert(
+        {"payback_username": payback_username, "payback_password": payback_password},
+        ["payback_username"],
     )
 
     logger.info(
@@ -33,28 +178,94 @@ def insert_payback_account(payback_username, payback_password):
 
 
 def remove_dc_account_by_id(account_id):
-    table = db["dc_accounts"]
-
-    table.delete(id=account_id)
+    _execute_many(_dc_statements.delete, [{"id": account_id}])
 
     logger.info(f"Removed DC account with id {account_id}.")
 
 
 def remove_payback_account_by_id(account_id):
-    table = db["payback_accounts"]
-
-    table.delete(id=account_id)
+    _execute_many(_payback_statements.delete, [{"id": account_id}])
 
     logger.info(f"Removed Payback account with id {account_id}.")
 
 
 def get_dc_accounts():
-    table = db["dc_accounts"]
-
-    return list(table.all())
+    return _query(_dc_statements.all)
 
 
 def get_payback_accounts():
-    table = db["payback_accounts"]
+    return _query(_payback_statements.all)
+
+
+def get_dc_account_by_id(account_id):
+    accounts = _query(_dc_statements.by_id, id=account_id)
+
+    return accounts[0] if accounts else None
+
+
+def get_payback_account_by_id(account_id):
+    accounts = _query(_payback_statements.by_id, id=account_id)
+
+    return accounts[0] if accounts else None
+
+
+def get_dc_accounts_by_ids(account_ids):
+    """
+    Lädt mehrere DeutschlandCard-Accounts mit wenigen Abfragen. Nicht (mehr) vorhandene Accounts fehlen im Ergebnis.
+
+    :return: Dictionary von Account-ID auf Zeile aus dc_accounts
+    """
+    return {
+        account["id"]: account
+        for account in _query_by_ids(_dc_statements.by_ids, account_ids)
+    }
+
+
+def get_payback_accounts_by_ids(account_ids):
+    """
+    Lädt mehrere Payback-Accounts mit wenigen Abfragen. Nicht (mehr) vorhandene Accounts fehlen im Ergebnis.
+
+    :return: Dictionary von Account-ID auf Zeile aus payback_accounts
+    """
+    return {
+        account["id"]: account
+        for account in _query_by_ids(_payback_statements.by_ids, account_ids)
+    }
+
+
+def set_dc_accounts_next_due(next_due_times):
+    """
+    Speichert die nächsten Fälligkeiten mehrerer DeutschlandCard-Accounts in einer Transaktion.
+
+    :param next_due_times: Liste von Tupeln (Account-ID, Fälligkeit als Unix-Timestamp)
+    """
+    _execute_many(
+        _dc_statements.set_next_due,
+        [
+            {"id": account_id, "next_due_at": next_due_at}
+            for account_id, next_due_at in next_due_times
+        ],
+    )
+
+
+def set_payback_accounts_next_due(next_due_times):
+    """
+    Speichert die nächsten Fälligkeiten mehrerer Payback-Accounts in einer Transaktion.
+
+    :param next_due_times: Liste von Tupeln (Account-ID, Fälligkeit als Unix-Timestamp)
+    """
+    _execute_many(
+        _payback_statements.set_next_due,
+        [
+            {"id": account_id, "next_due_at": next_due_at}
+            for account_id, next_due_at in next_due_times
+        ],
+    )
+
+
+def get_unscheduled_dc_accounts():
+    return _query(_dc_statements.unscheduled)
+
 
-    return list(table.all())
+def get_unscheduled_payback_accounts():
+    return _query(_payback_statements.unscheduled)
@@ -0,0 +1,152 @@
+from sqlalchemy import text
+
+from src.database.database import db
+
+# Jede Aktivierung eines Coupons wird mit ihrem Ergebnis in der Tabelle activation_history vermerkt. Die Tabelle wird
+# nur angehängt; die Indizes decken die Abfragen je Account, je Partner und je Zeitraum ab, sodass diese auch bei
+# Millionen von Zeilen nur den betroffenen Bereich lesen.
+OUTCOME_ACTIVATED = "activated"
+OUTCOME_FAILED = "failed"
+
+_COLUMNS = (
+    "provider",
+    "account_key",
+    "coupon_id",
+    "partner",
+    "outcome",
+    "latency",
+    "activated_at",
+)
+
+_insert = text(
+    f"INSERT INTO activation_history ({', '.join(_COLUMNS)}) "
+    f"VALUES ({', '.join(':' + column for column in _COLUMNS)})"
+)
+_select_account = text(
+    "SELECT * FROM activation_history WHERE provider = :provider AND account_key = :account_key "
+    "AND activated_at >= :since AND activated_at < :until ORDER BY activated_at DESC LIMIT :limit"
+)
+_select_coupon = text(
+    "SELECT * FROM activation_history WHERE provider = :provider AND account_key = :account_key "
+    "AND coupon_id = :coupon_id ORDER BY activated_at DESC"
+)
+_select_partner = text(
+    "SELECT * FROM activation_history WHERE partner = :partner "
+    "AND activated_at >= :since AND activated_at < :until ORDER BY activated_at DESC LIMIT :limit"
+)
+_select_range = text(
+    "SELECT * FROM activation_history WHERE activated_at >= :since AND activated_at < :until "
+    "ORDER BY activated_at DESC LIMIT :limit"
+)
+
+# Obergrenze der Zeilen je Abfrage, falls keine angegeben ist
+DEFAULT_LIMIT = 1000
+
+_table_ready = False
+
+
+def create_history_table():
+    """
+    Legt die Tabelle activation_history samt Indizes an. Wird vor dem Start mehrerer Prozesse aufgerufen, damit diese
+    nicht gleichzeitig versuchen, die Tabelle anzulegen.
+    """
+    global _table_ready
+
+    if _table_ready:
+        return
+
+    table = db.create_table("activation_history")
+
+    table.create_column("provider", db.types.string(16))
+    table.create_column("account_key", db.types.text)
+    table.create_column("coupon_id", db.types.string(64))
+    table.create_column("partner", db.types.text)
+    table.create_column("outcome", db.types.string(16))
+    table.create_column("latency", db.types.float)
+    table.create_column("activated_at", db.types.float)
+
+    # Je Account (auch für einzelne Coupons), je Partner und je Zeitraum
+    table.create_index(
+        ["provider", "account_key", "activated_at"],
+        name="ix_activation_history_account",
+    )
+    table.create_index(
+        ["partner", "activated_at"], name="ix_activation_history_partner"
+    )
+    table.create_index(["activated_at"], name="ix_activation_history_time")
+
+    _table_ready = True
+
+
+def add_activation_history(rows):
+    """
+    Schreibt mehrere Einträge in einer Transaktion.
+
+    :param rows: Liste von Dictionaries mit den Schlüsseln provider, account_key, coupon_id, partner, outcome,
+        latency (Sekunden) und activated_at (Unix-Timestamp)
+    """
+    create_history_table()
+
+    if not rows:
+        return
+
+    with db:
+        db.executable.execute(_insert, rows)
+
+
+def get_account_history(
+    provider, account_key, since=0.0, until=float("inf"), limit=DEFAULT_LIMIT
+):
+    """
+    Gibt die Aktivierungen eines Accounts im Zeitraum [since, until) zurück, die neuesten zuerst.
+    """
+    create_history_table()
+
+    return list(
+        db.query(
+            _select_account,
+            provider=provider,
+            account_key=account_key,
+            since=since,
+            until=until,
+            limit=limit,
+        )
+    )
+
+
+def get_coupon_history(provider, account_key, coupon_id):
+    """
+    Gibt alle Aktivierungsversuche eines Coupons für einen Account zurück, die neuesten zuerst.
+    """
+    create_history_table()
+
+    return list(
+        db.query(
+            _select_coupon,
+            provider=provider,
+            account_key=account_key,
+            coupon_id=str(coupon_id),
+        )
+    )
+
+
+def get_partner_history(partner, since=0.0, until=float("inf"), limit=DEFAULT_LIMIT):
+    """
+    Gibt die Aktivierungen der Coupons eines Partners im Zeitraum [since, until) zurück, die neuesten zuerst.
+    """
+    create_history_table()
+
+    return list(
+        db.query(
+            _select_partner, partner=partner, since=since, until=until, limit=limit
+        )
+    )
+
+
+def get_history(since, until=float("inf"), limit=DEFAULT_LIMIT):
+    """
+    Gibt die Aktivierungen aller Accounts im Zeitraum [since, until) zurück, die neuesten zuerst.
+    """
+    create_history_table()
+
+    return list(db.query(_select_range, since=since, until=until, limit=limit))
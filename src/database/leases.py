@@ -0,0 +1,151 @@
+import json
+import time
+import uuid
+
+from loguru import logger
+
+from src.database.database import db
+
+# Ein Lease gehört zu genau einem Account eines Aktivierungslaufs. Workers beanspruchen Leases über ein bedingtes
+# UPDATE, sodass auch mehrere Worker auf verschiedenen Rechnern denselben Account nie gleichzeitig halten.
+LEASE_PENDING = "pending"
+LEASE_LEASED = "leased"
+LEASE_DONE = "done"
+
+
+_leases_table_ready = False
+
+
+def _leases_table():
+    global _leases_table_ready
+
+    table = db["account_leases"]
+    if _leases_table_ready:
+        return table
+
+    table.create_column("run_id", db.types.string(36))
+    table.create_column("provider", db.types.string(16))
+    table.create_column("account_id", db.types.integer)
+    table.create_column("status", db.types.string(16))
+    table.create_column("worker_id", db.types.string(64))
+    table.create_column("lease_expires_at", db.types.float)
+    table.create_column("result", db.types.text)
+    table.create_index(["status", "lease_expires_at"])
+    table.create_index(["run_id"])
+    _leases_table_ready = True
+
+    return table
+
+
+def create_run(dc_accounts, payback_accounts, run_id=None):
+    """
+    Legt einen neuen Aktivierungslauf an, indem für jeden Account ein offenes Lease erstellt wird.
+
+    :param run_id: ID eines gespeicherten Aktivierungslaufs, die für die Leases übernommen wird (optional)
+    :return: ID des Laufs
+    """
+    run_id = run_id or str(uuid.uuid4())
+
+    rows = [
+        {
+            "run_id": run_id,
+            "provider": provider,
+            "account_id": account["id"],
+            "status": LEASE_PENDING,
+            "worker_id": None,
+            "lease_expires_at": None,
+            "result": None,
+        }
+        for provider, accounts in (("dc", dc_accounts), ("payback", payback_accounts))
+        for account in accounts
+    ]
+    _leases_table().insert_many(rows)
+
+    logger.info(f"Created activation run {run_id} with {len(rows)} account leases.")
+
+    return run_id
+
+
+def claim_next_lease(worker_id, lease_duration):
+    """
+    Beansprucht das nächste offene Lease oder ein Lease, dessen Worker sich nicht mehr gemeldet hat.
+
+    :return: Zeile des beanspruchten Leases oder None, wenn aktuell nichts zu tun ist
+    """
+    table = _leases_table()
+    now = time.time()
+
+    candidates = db.query(
+        f"SELECT id FROM {table.name} WHERE status = :pending"
+        f" OR (status = :leased AND lease_expires_at < :now) ORDER BY id LIMIT 10",
+        pending=LEASE_PENDING,
+        leased=LEASE_LEASED,
+        now=now,
+    )
+
+    for candidate in list(candidates):
+        # Das UPDATE greift nur, wenn kein anderer Worker das Lease seit dem SELECT beansprucht hat.
+        claimed = db.query(
+            f"UPDATE {table.name} SET status = :leased, worker_id = :worker_id, lease_expires_at = :expires"
+            f" WHERE id = :id AND (status = :pending OR (status = :leased AND lease_expires_at < :now))",
+            leased=LEASE_LEASED,
+            pending=LEASE_PENDING,
+            worker_id=worker_id,
+            expires=now + lease_duration,
+            id=candidate["id"],
+            now=now,
+        )
+
+        if claimed.result_proxy.rowcount == 1:
+            return table.find_one(id=candidate["id"])
+
+    return None
+
+
+def renew_lease(lease_id, worker_id, lease_duration):
+    """
+    Verlängert ein gehaltenes Lease (Heartbeat).
+
+    :return: False, wenn das Lease inzwischen von einem anderen Worker übernommen wurde
+    """
+    table = _leases_table()
+
+    renewed = db.query(
+        f"UPDATE {table.name} SET lease_expires_at = :expires"
+        f" WHERE id = :id AND worker_id = :worker_id AND status = :leased",
+        expires=time.time() + lease_duration,
+        id=lease_id,
+        worker_id=worker_id,
+        leased=LEASE_LEASED,
+    )
+
+    return renewed.result_proxy.rowcount == 1
+
+
+def complete_lease(lease_id, worker_id, result, error):
+    """
+    Schließt ein Lease mit dem Ergebnis der Aktivierung ab.
+
+    :return: False, wenn das Lease inzwischen von einem anderen Worker übernommen wurde
+    """
+    table = _leases_table()
+
+    completed = db.query(
+        f"UPDATE {table.name} SET status = :done, result = :result"
+        f" WHERE id = :id AND worker_id = :worker_id AND status = :leased",
+        done=LEASE_DONE,
+        result=json.dumps({"result": result, "error": error}),
+        id=lease_id,
+        worker_id=worker_id,
+        leased=LEASE_LEASED,
+    )
+
+    return completed.result_proxy.rowcount == 1
+
+
+def get_run_leases(run_id):
+    return list(_leases_table().find(run_id=run_id, order_by="id"))
+
+
+def remove_run(run_id):
+    _leases_table().delete(run_id=run_id)
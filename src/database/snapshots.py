@@ -0,0 +1,66 @@
+import json
+
+from src.database.database import db
+
+
+def create_snapshot_table():
+    """
+    Legt die Tabelle coupon_snapshots samt Index an. dataset legt sie sonst erst beim ersten Schreiben an, was bei
+    mehreren gleichzeitig startenden Prozessen kollidiert.
+    """
+    table = db.create_table("coupon_snapshots")
+
+    table.create_column("provider", db.types.text)
+    table.create_column("account_key", db.types.text)
+    table.create_column("coupons", db.types.text)
+    table.create_column("next_recheck_at", db.types.float)
+    table.create_index(["provider", "account_key"])
+
+
+def get_coupon_snapshot(provider, account_key):
+    """
+    Gibt den beim letzten Lauf gespeicherten Stand des Coupon-Katalogs eines Accounts zurück. Der Stand ist ein
+    Dictionary von Coupon-ID auf [Fingerabdruck, Zeitpunkt der erneuten Prüfung oder None].
+    """
+    table = db["coupon_snapshots"]
+
+    row = table.find_one(provider=provider, account_key=account_key)
+
+    if row is None:
+        return {}
+
+    return json.loads(row["coupons"])
+
+
+def store_coupon_snapshot(provider, account_key, coupons):
+    table = db["coupon_snapshots"]
+
+    table.upsert(
+        {
+            "provider": provider,
+            "account_key": account_key,
+            "coupons": json.dumps(coupons),
+            # Frühester Zeitpunkt, zu dem ein übersprungener Coupon gültig wird; wird für die Planung der Läufe
+            # benötigt.
+            "next_recheck_at": min(
+                (entry[1] for entry in coupons.values() if entry[1] is not None),
+                default=None,
+            ),
+        },
+        ["provider", "account_key"],
+    )
+
+
+def get_account_next_recheck_time(provider, account_key):
+    """
+    Gibt den beim letzten Lauf vermerkten frühesten Zeitpunkt (Unix-Timestamp) zurück, zu dem ein übersprungener
+    Coupon des Accounts gültig wird, oder None.
+    """
+    table = db["coupon_snapshots"]
+
+    row = table.find_one(provider=provider, account_key=account_key)
+
+    if row is None:
+        return None
+
+    return row.get("next_recheck_at")
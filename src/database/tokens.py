@@ -0,0 +1,52 @@
+import json
+import time
+
+from src.database.database import db
+
+
+def create_token_table():
+    """
+    Legt die Tabelle auth_tokens samt Index an. dataset legt sie sonst erst beim ersten Schreiben an, was bei mehreren
+    gleichzeitig startenden Prozessen kollidiert.
+    """
+    table = db.create_table("auth_tokens")
+
+    table.create_column("provider", db.types.text)
+    table.create_column("account_key", db.types.text)
+    table.create_column("token", db.types.text)
+    table.create_column("expires_at", db.types.float)
+    table.create_index(["provider", "account_key"])
+
+
+def get_cached_token(provider, account_key):
+    """
+    Gibt den gespeicherten, noch nicht abgelaufenen Token eines Accounts zurück oder None.
+    """
+    table = db["auth_tokens"]
+
+    row = table.find_one(provider=provider, account_key=account_key)
+
+    if row is None or row["expires_at"] <= time.time():
+        return None
+
+    return json.loads(row["token"])
+
+
+def store_token(provider, account_key, token, expires_at):
+    table = db["auth_tokens"]
+
+    table.upsert(
+        {
+            "provider": provider,
+            "account_key": account_key,
+            "token": json.dumps(token),
+            "expires_at": expires_at,
+        },
+        ["provider", "account_key"],
+    )
+
+
+def remove_token(provider, account_key):
+    table = db["auth_tokens"]
+
+    table.delete(provider=provider, account_key=account_key)
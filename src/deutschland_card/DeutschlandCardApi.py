@@ -1,30 +1,71 @@
-import requests as req
+import httpx
 import json
 import datetime
 from enum import Enum
-from dateutil import parser as dateparser
 from loguru import logger
 
 from http.client import HTTPConnection  # py3
 import logging
 import contextlib
-
-from src.config import get_deutschlandcard_secret_api_token
+import time
+
+from src.activation.catalog_diff import CatalogSnapshot
+from src.activation.coupon import Coupon
+from src.activation.coupon_metadata import CouponMetadataStore
+from src.activation.history import ActivationHistory
+from src.activation.json_stream import iter_response_array
+from src.activation.pool import as_async_iterable, run_bounded
+from src.auth.token_cache import CachedToken, UnauthorizedError
+from src.config import (
+    get_dc_api_base_url,
+    get_deutschlandcard_secret_api_token,
+    get_dc_coupon_activation_parallelism,
+    get_dc_token_ttl_seconds,
+    get_stream_coupon_lists,
+)
+from src.metrics.tracing import span
+from src.net.http_pool import get_http_client
+from src.net.resilience import provider_call, raise_if_unavailable
 
 # Reverse-Engineered API from DeutschlandCard Android App
 X_API_TOKEN = get_deutschlandcard_secret_api_token()
 USER_AGENT = "okhttp/3.12.1"
-API_BASE_URL = "https://wsp.deutschlandcard.de/dlc-integration/app-dc/v2"
+API_BASE_URL = get_dc_api_base_url()
+# Timeout in Sekunden für einzelne Anfragen an die DeutschlandCard-Server
+REQUEST_TIMEOUT = 30
+
+
+def _raise_if_unauthorized(result):
+    # Ein abgelaufener oder ungültiger X-Auth-Token wird mit 401 bzw. 403 abgelehnt.
+    if result.status_code in (401, 403):
+        raise UnauthorizedError(
+            f"DeutschlandCard rejected token ({result.status_code})"
+        )
 
 
 class DeutschlandCardApi:
     def __init__(self):
         headers = {"x-api-token": X_API_TOKEN, "User-Agent": USER_AGENT}
 
-        self.session = req.Session()
-        self.session.headers = headers
+        # Alle Clients teilen sich Verbindungspool und Drosselung der Anfragen an die DeutschlandCard-Server. Der
+        # X-Auth-Token des Accounts wird je Anfrage gesetzt.
+        self.session = get_http_client("dc", headers=headers, timeout=REQUEST_TIMEOUT)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def close(self):
+        """
+        Gibt den API-Client frei. Die gemeinsame HTTP-Session des Anbieters bleibt geöffnet, damit weitere Accounts
+        ihre Verbindungen wiederverwenden (siehe close_http_clients).
+        """
+        self.session = None
 
-    def login(self, card_number, geb_dat, plz):
+    @provider_call("dc")
+    async def login(self, card_number, geb_dat, plz):
         """
         Führt den Login-Prozess wie in der DeutschlandCard-App durch. Diese Methode gibt den X-Auth-Token zurück, der für
         alle weiteren Anfragen benötigt wird.
@@ -41,21 +82,15 @@ class DeutschlandCardApi:
             "X-auth-token": "",
         }
 
-        result = self.session.post(
+        result = await self.session.post(
             f"{API_BASE_URL}/members/login", headers=_headers, json=_data
         )
+        raise_if_unavailable(result)
 
         return result.json()["x-auth-token"]
 
-    def getcoupons(self, card_number, token):
-        """
-        Gibt alle Coupons zurück, die für den Nutzer sichtbar sind.
-
-        :param card_number: Nummer der DeutschlandCard
-        :param token: Token, der nach dem Login zurückgegeben wird.
-        :return:
-        """
-        data = {
+    def _coupon_query(self, card_number):
+        return {
             # Wir fragen wie in der App nur die Coupons ab, die für den Nutzer sichtbar sind.
             "visibleFrom": (
                 datetime.datetime.now() - datetime.timedelta(days=1)
@@ -66,17 +101,62 @@ class DeutschlandCardApi:
             "cardNumber": card_number,
         }
 
+    @provider_call("dc")
+    async def getcoupons(self, card_number, token):
+        """
+        Gibt alle Coupons zurück, die für den Nutzer sichtbar sind.
+
+        :param card_number: Nummer der DeutschlandCard
+        :param token: Token, der nach dem Login zurückgegeben wird.
+        :return:
+        """
         headers = {
             "x-auth-token": token,
         }
 
-        result = self.session.post(
-            f"{API_BASE_URL}/members/coupons/query", headers=headers, json=data
+        result = await self.session.post(
+            f"{API_BASE_URL}/members/coupons/query",
+            headers=headers,
+            json=self._coupon_query(card_number),
         )
+        raise_if_unavailable(result)
+        _raise_if_unauthorized(result)
 
         return result.json()
 
-    def points(self, card_number, token):
+    @provider_call("dc")
+    async def getcoupons_stream(self, card_number, token):
+        """
+        Wie getcoupons, gibt aber einen asynchronen Iterator zurück, der die Coupons (Array "coupons") einzeln
+        liefert, während die Antwort noch empfangen wird.
+
+        :param card_number: Nummer der DeutschlandCard
+        :param token: Token, der nach dem Login zurückgegeben wird.
+        :return:
+        """
+        headers = {
+            "x-auth-token": token,
+        }
+
+        request = self.session.build_request(
+            "POST",
+            f"{API_BASE_URL}/members/coupons/query",
+            headers=headers,
+            json=self._coupon_query(card_number),
+        )
+        result = await self.session.send(request, stream=True)
+
+        try:
+            raise_if_unavailable(result)
+            _raise_if_unauthorized(result)
+        except Exception:
+            await result.aclose()
+            raise
+
+        return iter_response_array(result, "coupons", "dc")
+
+    @provider_call("dc")
+    async def points(self, card_number, token):
         """
         Gibt die Punkte des Nutzers und zugehörige Informationen wie bald ablaufende Punkte zurück.
 
@@ -90,13 +170,18 @@ class DeutschlandCardApi:
             "x-auth-token": token,
         }
 
-        result = self.session.post(
+        result = await self.session.post(
             f"{API_BASE_URL}/members/points", headers=headers, json=data
         )
+        raise_if_unavailable(result)
+        _raise_if_unauthorized(result)
 
         return result.json()
 
-    def activate_coupon(
+    # Die erneute Aktivierung eines bereits aktivierten Coupons hat keine weitere Wirkung; der Aufruf darf daher
+    # wiederholt werden.
+    @provider_call("dc")
+    async def activate_coupon(
         self, card_number, token, public_promotion_id, partner_subgroup
     ):
         """
@@ -118,9 +203,11 @@ class DeutschlandCardApi:
             "x-auth-token": token,
         }
 
-        result = self.session.post(
+        result = await self.session.post(
             f"{API_BASE_URL}/members/coupons/registration", headers=headers, json=data
         )
+        raise_if_unavailable(result)
+        _raise_if_unauthorized(result)
 
         if result.status_code != 200:
             logger.error(f"Could not activate {public_promotion_id}")
@@ -129,7 +216,9 @@ class DeutschlandCardApi:
         return
 
 
-def dc_activate_all_coupons_and_get_account_balance(card_number, birth_date, plz):
+async def dc_activate_all_coupons_and_get_account_balance(
+    card_number, birth_date, plz, metadata_store=None, checkpoint=None
+):
     """
     Aktiviert alle Coupons für den Nutzer. Diese Methode gibt die Anzahl der aktivierten, übersprungenen und fehlerhaften
     Coupons zurück. Außerdem gibt die Methode die Anzahl der Punkte, bald ablaufenden Punkte und das Datum des nächsten
@@ -138,74 +227,167 @@ def dc_activate_all_coupons_and_get_account_balance(card_number, birth_date, plz
     :param card_number: Nummer der DeutschlandCard
     :param birth_date: Geburtsdatum des Inhabers im Format "YYYY-MM-DD"
     :param plz: PLZ des Inhabers (bei Umzug ändern)
+    :param metadata_store: Für alle Accounts eines Laufs gemeinsamer CouponMetadataStore (optional)
+    :param checkpoint: AccountCheckpoint des laufenden Aktivierungslaufs (optional)
     :return: Anzahl der aktivierten, übersprungenen und fehlerhaften Coupons (in dieser Reihenfolge)
     """
-    api = DeutschlandCardApi()
-    token = api.login(card_number, birth_date, plz)
-
-    coupon_result = api.getcoupons(card_number, token)
-
-    def format_coupon(coupon):
-        return (
-            coupon["content"]["headline"]
-            + " "
-            + coupon["content"]["shortDescription"]
-            + " "
-            + coupon["content"]["partnerName"]
+    async with DeutschlandCardApi() as api:
+        return await _dc_activate_all_coupons_and_get_account_balance(
+            api,
+            card_number,
+            birth_date,
+            plz,
+            metadata_store or CouponMetadataStore(),
+            checkpoint,
         )
 
-    current_datetime = datetime.datetime.now()
+
+async def _dc_activate_all_coupons_and_get_account_balance(
+    api, card_number, birth_date, plz, metadata_store, checkpoint
+):
+    # Der Token wird über mehrere Läufe hinweg wiederverwendet und bei Bedarf automatisch erneuert.
+    token = CachedToken(
+        "dc",
+        card_number,
+        lambda: api.login(card_number, birth_date, plz),
+        get_dc_token_ttl_seconds(),
+    )
+
+    # Die Coupons werden entweder einzeln aus der noch laufenden Antwort dekodiert oder vollständig geladen.
+    with span("query coupons"):
+        if get_stream_coupon_lists():
+            coupons = await token.call(
+                lambda auth_token: api.getcoupons_stream(card_number, auth_token)
+            )
+        else:
+            coupon_result = await token.call(
+                lambda auth_token: api.getcoupons(card_number, auth_token)
+            )
+            coupons = as_async_iterable(coupon_result["coupons"])
+
+    # Die Sichtbarkeit wird wie bei Payback mit einem Zeitpunkt mit Zeitzone verglichen.
+    current_datetime = datetime.datetime.now(datetime.timezone.utc)
+    current_timestamp = current_datetime.timestamp()
     count_skipped = 0
-    count_activated = 0
     count_error = 0
+    count_resumed = 0
 
-    for coupon in coupon_result["coupons"]:
-        try:
+    # Coupons, die bereits in einem früheren Lauf unverändert übersprungen wurden, werden nicht erneut ausgewertet.
+    snapshot = CatalogSnapshot("dc", card_number)
+    # Die Ergebnisse der Aktivierungen werden gesammelt und nach dem Lauf des Accounts gemeinsam gespeichert.
+    history = ActivationHistory("dc", card_number)
 
-            def is_filled(coupon, key):
-                return key in coupon["content"] and coupon["content"][key]
+    def should_activate(coupon):
+        nonlocal count_skipped
 
-            def get_filled(coupon, key):
-                return coupon["content"][key] if is_filled(coupon, key) else "None"
+        fingerprint = coupon.fingerprint()
 
-            if is_filled(coupon, "affiliateURLApp") or is_filled(
-                coupon, "affiliateURLWeb"
-            ):
-                logger.debug(
-                    f"SKIPPED: {format_coupon(coupon)} has affiliate URL: {get_filled(coupon, 'affiliateURLApp')} {get_filled(coupon, 'affiliateURLWeb')}"
-                )
-                count_skipped = count_skipped + 1
-                continue
+        if snapshot.is_unchanged(coupon.coupon_id, fingerprint, current_timestamp):
+            count_skipped = count_skipped + 1
+            return False
+
+        if coupon.has_affiliate_url:
+            logger.debug(
+                f"SKIPPED: {coupon.headline} has affiliate URL: {coupon.affiliate_url_app} {coupon.affiliate_url_web}"
+            )
+            snapshot.record_skipped(coupon.coupon_id, fingerprint)
+            count_skipped = count_skipped + 1
+            return False
+
+        if coupon.status != "NRG":
+            logger.debug(f"SKIPPED: {coupon.headline} status is {coupon.status}")
+            snapshot.record_skipped(coupon.coupon_id, fingerprint)
+            count_skipped = count_skipped + 1
+            return False
+
+        begin, end = metadata_store.get_validity(
+            "dc", coupon.coupon_id, coupon.valid_from, coupon.valid_to
+        )
 
-            if coupon["status"] != "NRG":
-                logger.debug(
-                    f"SKIPPED: {format_coupon(coupon)} status is {coupon['status']}"
+        if not (begin < current_datetime < end):
+            logger.debug(f"SKIPPED: {coupon.headline} is not visible")
+            # Ein noch nicht sichtbarer Coupon muss ab Beginn der Sichtbarkeit erneut ausgewertet werden.
+            snapshot.record_skipped(
+                coupon.coupon_id,
+                fingerprint,
+                begin.timestamp() if current_datetime <= begin else None,
+            )
+            count_skipped = count_skipped + 1
+            return False
+
+        return True
+
+    async def coupons_to_activate():
+        nonlocal count_error, count_resumed
+
+        async for payload in coupons:
+            try:
+                # Der Coupon wird einmal aus der Antwort erstellt; die Rohdaten werden danach nicht mehr benötigt.
+                coupon = Coupon.from_dc(payload, metadata_store)
+
+                # Vor einem Neustart bereits aktivierte Coupons werden nicht erneut aktiviert, aber mitgezählt.
+                if checkpoint is not None and checkpoint.is_activated(coupon.coupon_id):
+                    count_resumed = count_resumed + 1
+                    continue
+
+                if not should_activate(coupon):
+                    continue
+            except Exception as e:
+                logger.error(
+                    f"Could not activate coupon: {payload.get('publicPromotionId')}"
                 )
-                count_skipped = count_skipped + 1
+                logger.error(e)
+                count_error = count_error + 1
                 continue
 
-            begin = dateparser.parse(coupon["visibleFrom"])
-            end = dateparser.parse(coupon["visibleTo"])
+            # Der Coupon wird sofort aktiviert, während weitere Coupons noch empfangen und ausgewertet werden.
+            yield coupon
 
-            if not (begin < current_datetime < end):
-                logger.debug(f"SKIPPED: {format_coupon(coupon)} is not visible")
-                count_skipped = count_skipped + 1
-                continue
+    async def activate(coupon):
+        started_at = time.perf_counter()
 
-            api.activate_coupon(
-                card_number,
-                token,
-                coupon["publicPromotionId"],
-                coupon["partnerSubgroup"],
-            )
-            logger.debug(f"ACTIVATED: {format_coupon(coupon)}")
-            count_activated = count_activated + 1
+        try:
+            # Die Coupons werden gleichzeitig aktiviert und erhalten daher im Trace eigene Spuren.
+            with span("activate coupon", new_lane=True, coupon_id=coupon.coupon_id):
+                await token.call(
+                    lambda auth_token: api.activate_coupon(
+                        card_number,
+                        auth_token,
+                        coupon.coupon_id,
+                        coupon.partner_subgroup,
+                    )
+                )
         except Exception as e:
-            logger.error(f"Could not activate coupon: {coupon['publicPromotionId']}")
+            logger.error(f"Could not activate coupon: {coupon.coupon_id}")
             logger.error(e)
-            count_error = count_error + 1
+            history.record(coupon, False, time.perf_counter() - started_at)
+            return False
+
+        history.record(coupon, True, time.perf_counter() - started_at)
+
+        if checkpoint is not None:
+            checkpoint.record_activated(coupon.coupon_id)
+
+        logger.debug(f"ACTIVATED: {coupon.headline}")
+        return True
 
-    points_json = api.points(card_number, token)
+    # Die Aktivierungen laufen parallel, jedoch mit höchstens DC_COUPON_ACTIVATION_PARALLELISM gleichzeitigen
+    # Anfragen.
+    with span("activate coupons"):
+        activated = await run_bounded(
+            coupons_to_activate(), activate, get_dc_coupon_activation_parallelism()
+        )
+    count_activated = activated.count(True) + count_resumed
+    count_error = count_error + activated.count(False)
+
+    with span("store results"):
+        snapshot.save()
+        history.save()
+
+    with span("balance"):
+        points_json = await token.call(
+            lambda auth_token: api.points(card_number, auth_token)
+        )
 
     balance = points_json["balance"]
     expiring_points = points_json["expiringPoints"]
@@ -1,3 +1,5 @@
+import asyncio
+
 from src.config import (
     get_debug_deutschlandcard_card_number,
     get_debug_deutschlandcard_geburtsdatum,
@@ -15,10 +17,12 @@ from src.deutschland_card.DeutschlandCardApi import (
     points,
     expiring_points,
     points_expiry,
-) = dc_activate_all_coupons_and_get_account_balance(
-    get_debug_deutschlandcard_card_number(),
-    get_debug_deutschlandcard_geburtsdatum(),
-    get_debug_deutschlandcard_plz(),
+) = asyncio.run(
+    dc_activate_all_coupons_and_get_account_balance(
+        get_debug_deutschlandcard_card_number(),
+        get_debug_deutschlandcard_geburtsdatum(),
+        get_debug_deutschlandcard_plz(),
+    )
 )
 
 print(f"Aktivierte Coupons: {count_activated}")
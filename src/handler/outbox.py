@@ -0,0 +1,179 @@
+import asyncio
+import functools
+
+from loguru import logger
+from telegram.error import BadRequest, NetworkError, RetryAfter, TelegramError
+
+# Anzahl der Versuche je Nachricht bei Flood Control bzw. vorübergehenden Netzwerkfehlern
+MAX_ATTEMPTS = 5
+# Wartezeit in Sekunden vor einem erneuten Versuch nach einem Netzwerkfehler
+NETWORK_RETRY_SECONDS = 2
+
+
+class Outbox:
+    """
+    Verschickt Nachrichten des Bots im Hintergrund. Jeder Empfänger hat eine eigene Warteschlange, die ihre Anfragen
+    (Nachrichten und Bearbeitungen) in der eingereihten Reihenfolge zustellt; die Empfänger werden dabei gleichzeitig
+    beliefert. Meldet Telegram Flood Control (RetryAfter), pausieren alle Warteschlangen für die angegebene Dauer und
+    die Anfrage wird erneut gestellt.
+    """
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.queues = {}
+        self.tasks = {}
+        # Zeitpunkt (Event-Loop-Zeit), bis zu dem laut Telegram keine Nachrichten verschickt werden dürfen
+        self.paused_until = 0.0
+
+    def send(self, chat_ids, messages):
+        """
+        Reiht die Nachrichten für alle Empfänger ein, ohne auf deren Zustellung zu warten.
+
+        :param chat_ids: IDs der Empfänger
+        :param messages: Liste der Nachrichten (HTML)
+        """
+        for chat_id in chat_ids:
+            for message in messages:
+                self.enqueue(
+                    chat_id,
+                    functools.partial(
+                        self.bot.send_message,
+                        chat_id=chat_id,
+                        text=message,
+                        parse_mode="HTML",
+                    ),
+                )
+
+    def send_progress(self, chat_ids, text):
+        """
+        Verschickt eine Nachricht, die danach mit ProgressMessage.update bearbeitet werden kann.
+
+        :return: ProgressMessage
+        """
+        return ProgressMessage(self, chat_ids, text)
+
+    def enqueue(self, chat_id, request):
+        """
+        Reiht eine Anfrage an Telegram für einen Empfänger ein.
+
+        :param request: Funktion ohne Parameter, die die Coroutine der Anfrage zurückgibt; sie wird bei jedem Versuch
+            erneut aufgerufen
+        """
+        queue = self.queues.get(chat_id)
+
+        if queue is None:
+            queue = asyncio.Queue()
+            self.queues[chat_id] = queue
+            self.tasks[chat_id] = asyncio.create_task(self._deliver(chat_id, queue))
+
+        queue.put_nowait(request)
+
+    async def join(self):
+        """
+        Wartet, bis alle eingereihten Nachrichten zugestellt (oder endgültig verworfen) wurden.
+        """
+        await asyncio.gather(*(queue.join() for queue in self.queues.values()))
+
+    async def close(self):
+        for task in self.tasks.values():
+            task.cancel()
+
+        await asyncio.gather(*self.tasks.values(), return_exceptions=True)
+
+        self.queues.clear()
+        self.tasks.clear()
+
+    async def _deliver(self, chat_id, queue):
+        while True:
+            request = await queue.get()
+
+            try:
+                await self._call(chat_id, request)
+            finally:
+                queue.task_done()
+
+    async def _call(self, chat_id, request):
+        loop = asyncio.get_running_loop()
+
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            delay = self.paused_until - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            try:
+                await request()
+                return
+            except RetryAfter as e:
+                logger.warning(
+                    f"Telegram flood control: waiting {e.retry_after} seconds before sending to {chat_id}."
+                )
+                self.paused_until = max(self.paused_until, loop.time() + e.retry_after)
+            except BadRequest as e:
+                # Die Nachricht selbst ist fehlerhaft; ein erneuter Versuch ist zwecklos.
+                logger.error(f"Telegram rejected a message to {chat_id}: {e}")
+                return
+            except NetworkError as e:
+                logger.warning(
+                    f"Could not send message to {chat_id} (attempt {attempt}): {e}"
+                )
+                await asyncio.sleep(NETWORK_RETRY_SECONDS * attempt)
+            except TelegramError as e:
+                # Z.B. wenn der Empfänger den Bot blockiert hat; ein erneuter Versuch ist zwecklos.
+                logger.error(f"Could not send message to {chat_id}: {e}")
+                return
+
+        logger.error(
+            f"Giving up sending a message to {chat_id} after {MAX_ATTEMPTS} attempts."
+        )
+
+
+class ProgressMessage:
+    """
+    Nachricht, die einmal an alle Empfänger verschickt und danach fortlaufend bearbeitet wird. Werden schneller neue
+    Texte gesetzt, als Telegram sie annimmt, wird nur der jeweils neueste übertragen.
+    """
+
+    def __init__(self, outbox, chat_ids, text):
+        self.outbox = outbox
+        self.chat_ids = list(chat_ids)
+        self.text = text
+        self.message_ids = {}
+        self.sent_texts = {}
+        self.pending_edits = set()
+
+        for chat_id in self.chat_ids:
+            outbox.enqueue(chat_id, functools.partial(self._send, chat_id))
+
+    def update(self, text):
+        self.text = text
+
+        for chat_id in self.chat_ids:
+            # Eine bereits eingereihte Bearbeitung überträgt beim Senden den dann aktuellen Text.
+            if chat_id not in self.pending_edits:
+                self.pending_edits.add(chat_id)
+                self.outbox.enqueue(chat_id, functools.partial(self._edit, chat_id))
+
+    async def _send(self, chat_id):
+        text = self.text
+        message = await self.outbox.bot.send_message(
+            chat_id=chat_id, text=text, parse_mode="HTML"
+        )
+
+        self.message_ids[chat_id] = message.message_id
+        self.sent_texts[chat_id] = text
+
+    async def _edit(self, chat_id):
+        self.pending_edits.discard(chat_id)
+
+        text = self.text
+        message_id = self.message_ids.get(chat_id)
+
+        # Telegram lehnt eine Bearbeitung ohne Änderung ab; ist die Nachricht nicht angekommen, gibt es nichts zu
+        # bearbeiten.
+        if message_id is None or self.sent_texts.get(chat_id) == text:
+            return
+
+        await self.outbox.bot.edit_message_text(
+            chat_id=chat_id, message_id=message_id, text=text, parse_mode="HTML"
+        )
+        self.sent_texts[chat_id] = text
@@ -13,7 +13,7 @@ from telegram.ext import (
     CallbackContext,
 )
 from src.config import get_allowed_user_ids, get_telegram_token
-from src.database.database import insert_dc_account
+from src.database.database import insert_dc_account, run_in_database_thread
 from src.handler.shared import is_allowed_to_interact, timeout, cancel
 
 DC_ENTER_CARD_NUMBER = 0
@@ -78,7 +78,8 @@ async def dc_plz_entered(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         "Vielen Dank, deine DeutschlandCard-Daten wurden erfolgreich registriert."
     )
 
-    insert_dc_account(
+    await run_in_database_thread(
+        insert_dc_account,
         context.user_data["dc_card_number"],
         context.user_data["dc_birthdate"],
         context.user_data["dc_plz"],
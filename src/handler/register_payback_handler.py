@@ -13,7 +13,7 @@ from telegram.ext import (
     CallbackContext,
 )
 from src.config import get_allowed_user_ids, get_telegram_token
-from src.database.database import insert_payback_account
+from src.database.database import insert_payback_account, run_in_database_thread
 from src.handler.shared import is_allowed_to_interact, timeout, cancel
 
 PAYBACK_ENTER_USERNAME = 0
@@ -56,8 +56,10 @@ async def payback_password_entered(
         "Vielen Dank, deine Payback-Daten wurden erfolgreich registriert."
     )
 
-    insert_payback_account(
-        context.user_data["payback_username"], context.user_data["payback_password"]
+    await run_in_database_thread(
+        insert_payback_account,
+        context.user_data["payback_username"],
+        context.user_data["payback_password"],
     )
 
     logger.info(
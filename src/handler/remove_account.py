@@ -18,6 +18,7 @@ from src.database.database import (
     get_payback_accounts,
     remove_dc_account_by_id,
     remove_payback_account_by_id,
+    run_in_database_thread,
 )
 from src.handler.shared import is_allowed_to_interact, timeout, cancel
 
@@ -29,8 +30,8 @@ async def remove_account(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     if not await is_allowed_to_interact(update):
         return ConversationHandler.END
 
-    dc_accounts = get_dc_accounts()
-    payback_accounts = get_payback_accounts()
+    dc_accounts = await run_in_database_thread(get_dc_accounts)
+    payback_accounts = await run_in_database_thread(get_payback_accounts)
 
     accounts = []
 
@@ -103,13 +104,13 @@ async def remove_account_selected(
     account = accounts[0]
 
     if account["type"] == "dc":
-        remove_dc_account_by_id(account["id"])
+        await run_in_database_thread(remove_dc_account_by_id, account["id"])
 
         logger.info(
             f"User {update.effective_user.id} removed DC account with username {account['card_number']} and PLZ {account['plz']}."
         )
     else:
-        remove_payback_account_by_id(account["id"])
+        await run_in_database_thread(remove_payback_account_by_id, account["id"])
 
         logger.info(
             f"User {update.effective_user.id} removed Payback account with username {account['username']}."
@@ -12,13 +12,11 @@ from telegram.ext import (
     Application,
     CallbackContext,
 )
-from src.config import get_allowed_user_ids, get_telegram_token
+from src.config import get_allowed_user_ids, get_telegram_token, is_allowed_user_id
 
 
 async def is_allowed_to_interact(update: Update) -> bool:
-    if not update.effective_user or not str(update.effective_user.id) in (
-        get_allowed_user_ids()
-    ):
+    if not update.effective_user or not is_allowed_user_id(update.effective_user.id):
         logger.info(
             f"User {update.effective_user.id} tried to interact with the bot, but is not allowed. (allowed are {get_allowed_user_ids()}))"
         )
@@ -1,4 +1,6 @@
 # coding=utf-8
+import argparse
+import asyncio
 from datetime import timedelta
 
 from loguru import logger
@@ -13,19 +15,92 @@ from telegram.ext import (
     Application,
     CallbackContext,
 )
-from config import get_allowed_user_ids, get_telegram_token
-from src.database.database import get_dc_accounts, get_payback_accounts
-from src.deutschland_card.DeutschlandCardApi import (
-    dc_activate_all_coupons_and_get_account_balance,
+from config import (
+    get_allowed_user_ids,
+    get_telegram_token,
+    get_activation_processes,
+    get_use_activation_workers,
+    get_report_only_changes,
+    get_report_digest_hours,
+    get_progress_update_seconds,
+    get_metrics_host,
+    get_metrics_port,
+    get_tracing_enabled,
+    get_trace_directory,
+)
+from src.activation.checkpoint import load_interrupted_runs
+from src.activation.engine import activate_all_accounts
+from src.activation.executor import ActivationExecutor
+from src.activation.process_runner import activate_all_accounts_in_processes
+from src.activation.progress import RunProgress
+from src.activation.report import (
+    ReportDigest,
+    ReportHistory,
+    build_activation_report,
+)
+from src.activation.run_metrics import (
+    record_activation_run,
+    record_failed_activation_run,
+)
+from src.activation.scheduler import TICK_SECONDS, AccountScheduler
+from src.activation.worker import activate_all_accounts_with_workers, run_worker
+from src.database.checkpoints import create_activation_run, remove_activation_run
+from src.database.database import (
+    get_dc_accounts,
+    get_payback_accounts,
+    run_in_database_thread,
 )
 from src.handler.register_dc_handler import get_register_dc_handler
 from src.handler.register_payback_handler import get_register_payback_handler
+from src.handler.outbox import Outbox
 from src.handler.remove_account import get_remove_account_handler
-from src.payback.PaybackAPI import payback_activate_all_available_coupons
+from src.handler.shared import is_allowed_to_interact
+from src.metrics.server import MetricsServer
+from src.metrics.tracing import (
+    CATEGORY_RUN,
+    Trace,
+    finish_trace,
+    get_trace_summary,
+    span,
+    tracing,
+)
+from src.net.http_pool import get_pool_statistics
+from src.net.rate_control import describe_rate_controllers
+
+# Schlüssel des AccountSchedulers, des ActivationExecutors, der Outbox, der zuletzt verschickten Berichtszeilen, der
+# gesammelten Ergebnisse der geplanten Läufe und des Metrik-Endpunkts in bot_data
+ACCOUNT_SCHEDULER = "account_scheduler"
+ACTIVATION_EXECUTOR = "activation_executor"
+OUTBOX = "outbox"
+REPORT_HISTORY = "report_history"
+REPORT_DIGEST = "report_digest"
+METRICS_SERVER = "metrics_server"
+# Schlüssel der Task des laufenden manuellen Laufs in bot_data
+MANUAL_RUN = "manual_run"
+
+# Wartezeit in Sekunden beim Beenden des Bots, bis die noch eingereihten Nachrichten verschickt sind
+OUTBOX_SHUTDOWN_SECONDS = 10
 
 
 # Hiermit kann das Menü für den Bot in Telegram gesetzt werden.
 async def post_init(application: Application) -> None:
+    # Die Zeitpläne aller Accounts werden beim Start aus der Datenbank geladen.
+    application.bot_data[ACCOUNT_SCHEDULER] = AccountScheduler()
+    await application.bot_data[ACCOUNT_SCHEDULER].load()
+    # Die Aktivierung läuft in einer eigenen Event-Loop, damit der Bot währenddessen auf Befehle antwortet.
+    application.bot_data[ACTIVATION_EXECUTOR] = ActivationExecutor()
+    application.bot_data[ACTIVATION_EXECUTOR].start()
+    application.bot_data[OUTBOX] = Outbox(application.bot)
+    application.bot_data[REPORT_HISTORY] = ReportHistory()
+    application.bot_data[REPORT_DIGEST] = ReportDigest()
+
+    # Die Metriken werden nur bereitgestellt, wenn ein Port konfiguriert ist.
+    if get_metrics_port():
+        application.bot_data[METRICS_SERVER] = MetricsServer(
+            get_metrics_host(), get_metrics_port()
+        )
+        application.bot_data[METRICS_SERVER].start()
+
     await application.bot.set_my_commands(
         [
             (
@@ -41,162 +116,350 @@ async def post_init(application: Application) -> None:
                 "Registriert einen neuen Payback-Account, dessen Coupons im konfigurierten Intervall aktiviert werden.",
             ),
             ("remove_account", "Entfernt einen Account."),
+            (
+                "rate_limits",
+                "Zeigt die aktuellen Grenzen und Drosselungen der Anfragen an die Anbieter.",
+            ),
+            (
+                "trace_summary",
+                "Zeigt die langsamsten Accounts und Phasen der aufgezeichneten Läufe.",
+            ),
             ("cancel", "Bricht eine bestehende Konversation ab."),
         ]
     )
 
 
-# Diese Methode wird jeden Tag aufgerufen und aktiviert alle Coupons der registrierten Benutzer.
-async def activate_coupons(context: CallbackContext):
-    dc_accounts = get_dc_accounts()
-    payback_accounts = get_payback_accounts()
+# Führt die Aktivierung der übergebenen Accounts im konfigurierten Modus durch.
+async def activate_accounts(dc_accounts, payback_accounts, run_id, progress):
+    # Im Worker-Modus übernehmen separat gestartete Worker die Aktivierung, der Bot sammelt nur die Ergebnisse ein.
+    # Bei vielen Accounts kann die Aktivierung alternativ auf mehrere Prozesse (und damit Kerne) verteilt werden.
+    processes = get_activation_processes()
+    if get_use_activation_workers():
+        return await activate_all_accounts_with_workers(
+            dc_accounts, payback_accounts, run_id, progress
+        )
+    elif processes > 1:
+        return await activate_all_accounts_in_processes(
+            dc_accounts, payback_accounts, processes, run_id, progress
+        )
+    else:
+        return await activate_all_accounts(
+            dc_accounts, payback_accounts, run_id, progress
+        )
+
+
+async def post_shutdown(application: Application) -> None:
+    await application.bot_data[ACTIVATION_EXECUTOR].stop()
+
+    if METRICS_SERVER in application.bot_data:
+        await asyncio.to_thread(application.bot_data[METRICS_SERVER].stop)
+
+    outbox = application.bot_data[OUTBOX]
+
+    # Noch gesammelte Ergebnisse der geplanten Läufe werden vor dem Beenden verschickt.
+    messages = build_digest_report(application.bot_data)
+    if messages:
+        outbox.send(get_allowed_user_ids(), messages)
+
+    try:
+        await asyncio.wait_for(outbox.join(), OUTBOX_SHUTDOWN_SECONDS)
+    except asyncio.TimeoutError:
+        logger.warning("Shutting down with unsent messages.")
+
+    await outbox.close()
+
+
+# Reiht die Nachrichten für alle berechtigten Benutzer in der Outbox ein, die sie im Hintergrund gleichzeitig an alle
+# Empfänger verschickt.
+def send_to_all(context: CallbackContext, messages):
+    context.bot_data[OUTBOX].send(get_allowed_user_ids(), messages)
+
+
+# Verschickt eine Fortschrittsnachricht, sobald ein Lauf länger als PROGRESS_UPDATE_SECONDS dauert, und aktualisiert
+# sie in diesem Abstand, bis finished gesetzt wird.
+async def report_progress(context: CallbackContext, progress, finished):
+    interval = get_progress_update_seconds()
 
-    async def send_to_all(text):
-        for user_id in get_allowed_user_ids():
-            await context.bot.send_message(
-                chat_id=user_id, text=text, parse_mode="HTML"
+    try:
+        await asyncio.wait_for(finished.wait(), interval)
+        return
+    except asyncio.TimeoutError:
+        pass
+
+    message = context.bot_data[OUTBOX].send_progress(
+        get_allowed_user_ids(), progress.describe()
+    )
+
+    while not finished.is_set():
+        try:
+            await asyncio.wait_for(finished.wait(), interval)
+        except asyncio.TimeoutError:
+            message.update(progress.describe())
+
+    message.update(progress.describe(finished=True))
+
+
+# Erstellt den Bericht aus den gesammelten Ergebnissen der geplanten Läufe und leert diese.
+def build_digest_report(bot_data):
+    dc_results, payback_results = bot_data[REPORT_DIGEST].take()
+    if not dc_results and not payback_results:
+        return []
+
+    history = bot_data[REPORT_HISTORY] if get_report_only_changes() else None
+    return build_activation_report(dc_results, payback_results, history)
+
+
+# Diese Methode wird alle REPORT_DIGEST_HOURS Stunden aufgerufen und verschickt die gesammelten Ergebnisse der
+# geplanten Läufe in einem gemeinsamen Bericht.
+async def send_report_digest(context: CallbackContext):
+    messages = build_digest_report(context.bot_data)
+
+    if not messages:
+        logger.info("Nothing to report in the digest.")
+        return
+
+    send_to_all(context, messages)
+
+
+# Aktiviert die Coupons der übergebenen Accounts, plant diese anschließend erneut ein und verschickt den Bericht.
+# Der Lauf wird mit seinem Zwischenstand gespeichert, damit er nach einem Neustart fortgesetzt werden kann; ein
+# fortgesetzter Lauf wird mit seiner bisherigen run_id übergeben. Die Ergebnisse geplanter Läufe (scheduled) werden
+# gesammelt und erst mit dem nächsten Digest verschickt, sofern REPORT_DIGEST_HOURS gesetzt ist.
+async def activate_and_report(
+    context: CallbackContext,
+    dc_accounts,
+    payback_accounts,
+    run_id=None,
+    scheduled=False,
+):
+    # Ist TRACING aktiviert, wird der Lauf mit seinen Phasen aufgezeichnet und als Trace-Datei gespeichert.
+    trace = Trace() if get_tracing_enabled() else None
+
+    try:
+        with tracing(trace), span(
+            "run", CATEGORY_RUN, accounts=len(dc_accounts) + len(payback_accounts)
+        ):
+            await _activate_and_report(
+                context, dc_accounts, payback_accounts, run_id, scheduled
             )
+    finally:
+        if trace is not None:
+            await asyncio.to_thread(finish_trace, trace, get_trace_directory())
 
-    message = ""
-    message2 = ""
-    if dc_accounts:
-        message = "Für folgende DeutschlandCard-Accounts wurde eine Aktivierung durchgeführt:\n\n"
-        message2 = "Punkte der DeutschlandCard-Accounts:\n\n"
-
-        for account in dc_accounts:
-            try:
-                card_number = account["dc_card_number"]
-                birthdate = account["dc_birthdate"]
-                plz = account["dc_plz"]
-
-                (
-                    count_activated,
-                    count_skipped,
-                    count_errored,
-                    points,
-                    expiring_points,
-                    points_expiry,
-                ) = dc_activate_all_coupons_and_get_account_balance(
-                    card_number, birthdate, plz
-                )
-
-                logger.info(
-                    f"Activated {count_activated} coupons for {account['dc_card_number']}. Skipped {count_skipped} and errored {count_errored}."
-                )
-                message = (
-                    message
-                    + f"{account['dc_card_number']}: 👍 {count_activated} 👌 {count_skipped} 👎 {count_errored}\n"
-                )
-
-                logger.info(
-                    f"Points for {account['dc_card_number']}: {points}. Expiring points: {expiring_points} at {points_expiry}."
-                )
-                message2 = (
-                    message2
-                    + f"{account['dc_card_number']}: {points} Punkte "
-                    + (
-                        f"({expiring_points} verfallen am {points_expiry})"
-                        if expiring_points > 0
-                        else ""
-                    )
-                    + "\n"
-                )
-            except Exception as e:
-                logger.error(
-                    f"Could not activate coupons for {account['dc_card_number']}: {e}"
-                )
-                message = (
-                    message + f"{account['dc_card_number']}: Fehler aufgetreten 👎.\n"
-                )
-                message2 = (
-                    message2 + f"{account['dc_card_number']}: Fehler aufgetreten 👎.\n"
-                )
-
-        message = message + "\n\n"
-        message2 = message2 + "\n\n"
-
-    if payback_accounts:
-        message = (
-            message
-            + "Für folgende Payback-Accounts wurde eine Aktivierung durchgeführt:\n\n"
-        )
-        message2 = message2 + "Punkte der Payback-Accounts:\n\n"
-
-        for account in payback_accounts:
-            try:
-                username = account["payback_username"]
-                password = account["payback_password"]
-
-                (
-                    count_activated,
-                    count_skipped,
-                    count_errored,
-                    points,
-                    expiring_points,
-                    points_expiry,
-                ) = payback_activate_all_available_coupons(username, password)
-
-                logger.info(
-                    f"Activated {count_activated} coupons for {account['payback_username']}. Skipped {count_skipped} and errored {count_errored}."
-                )
-                message = (
-                    message
-                    + f"{account['payback_username']}: 👍 {count_activated} 👌 {count_skipped} 👎 {count_errored}\n"
-                )
-
-                logger.info(
-                    f"Points for {account['payback_username']}: {points}. Expiring points: {expiring_points} at {points_expiry}."
-                )
-                message2 = (
-                    message2
-                    + f"{account['payback_username']}: {points} Punkte "
-                    + (
-                        f"({expiring_points} verfallen am {points_expiry})"
-                        if expiring_points > 0
-                        else ""
-                    )
-                    + "\n"
-                )
-            except Exception as e:
-                logger.error(
-                    f"Could not activate coupons for {account['payback_username']}: {e}"
-                )
-                message = (
-                    message + f"{account['payback_username']}: Fehler aufgetreten 👎.\n"
-                )
-
-    if not message:
-        message = "Es sind keine Accounts registriert."
-
-        await send_to_all(message)
+
+async def _activate_and_report(
+    context, dc_accounts, payback_accounts, run_id, scheduled
+):
+    progress = RunProgress(len(dc_accounts) + len(payback_accounts))
+    finished = asyncio.Event()
+    reporter = None
+
+    # Auch wenn der Lauf nicht angelegt werden kann, werden die Accounts im finally wieder eingeplant; sonst blieben
+    # sie im Scheduler als laufend vermerkt.
+    try:
+        if run_id is None:
+            run_id = await run_in_database_thread(
+                create_activation_run, dc_accounts, payback_accounts
+            )
+
+        reporter = asyncio.create_task(report_progress(context, progress, finished))
+
+        with span("activate"):
+            dc_results, payback_results = await context.bot_data[
+                ACTIVATION_EXECUTOR
+            ].run(activate_accounts(dc_accounts, payback_accounts, run_id, progress))
+    except Exception:
+        record_failed_activation_run(progress.elapsed_seconds)
+        raise
+    finally:
+        finished.set()
+        if reporter is not None:
+            await reporter
+
+        with span("reschedule"):
+            await context.bot_data[ACCOUNT_SCHEDULER].reschedule(
+                dc_accounts, payback_accounts
+            )
+
+    record_activation_run(dc_results, payback_results, progress)
+
+    await run_in_database_thread(remove_activation_run, run_id)
+
+    if scheduled and get_report_digest_hours() > 0:
+        context.bot_data[REPORT_DIGEST].add(dc_results, payback_results)
         return
 
-    await send_to_all(message)
-    await send_to_all(message2)
+    if not dc_results and not payback_results:
+        send_to_all(context, ["Es sind keine Accounts registriert."])
+        return
+
+    # Auf Wunsch enthält der Bericht nur Accounts, deren Ergebnis sich seit dem letzten Bericht geändert hat.
+    history = context.bot_data[REPORT_HISTORY] if get_report_only_changes() else None
+    with span("report"):
+        messages = build_activation_report(dc_results, payback_results, history)
+
+    if not messages:
+        logger.info("Nothing changed since the last report.")
+        return
+
+    send_to_all(context, messages)
+
+
+# Diese Methode aktiviert alle Coupons aller registrierten Benutzer unabhängig von deren Zeitplan. Accounts, die
+# gerade von einem geplanten Lauf aktiviert werden, werden nicht zusätzlich gestartet.
+async def activate_coupons(context: CallbackContext):
+    dc_accounts = await run_in_database_thread(get_dc_accounts)
+    payback_accounts = await run_in_database_thread(get_payback_accounts)
+
+    claimed_dc, claimed_payback = context.bot_data[ACCOUNT_SCHEDULER].claim(
+        dc_accounts, payback_accounts
+    )
+
+    if (dc_accounts or payback_accounts) and not (claimed_dc or claimed_payback):
+        logger.info("All accounts are already being activated.")
+        return
+
+    await activate_and_report(context, claimed_dc, claimed_payback)
+
+
+# Diese Methode wird jede Minute aufgerufen und startet die Aktivierung der Accounts, die laut ihrem Zeitplan fällig
+# geworden sind.
+async def dispatch_due_accounts(context: CallbackContext):
+    scheduler = context.bot_data[ACCOUNT_SCHEDULER]
+
+    await scheduler.schedule_new_accounts()
+    dc_accounts, payback_accounts = await scheduler.pop_due_accounts()
+
+    if not dc_accounts and not payback_accounts:
+        return
+
+    logger.info(
+        f"Dispatching {len(dc_accounts)} DC and {len(payback_accounts)} Payback accounts."
+    )
+
+    # Der Lauf wird nicht abgewartet, damit der nächste Tick pünktlich weitere fällige Accounts starten kann.
+    context.application.create_task(
+        activate_and_report(context, dc_accounts, payback_accounts, scheduled=True)
+    )
+
+
+# Diese Methode wird einmalig nach dem Start aufgerufen und setzt die Läufe fort, die durch einen Neustart unterbrochen
+# wurden. Bereits abgeschlossene Accounts und aktivierte Coupons werden dabei übersprungen.
+async def resume_interrupted_runs(context: CallbackContext):
+    scheduler = context.bot_data[ACCOUNT_SCHEDULER]
+
+    for run_id, dc_accounts, payback_accounts in await run_in_database_thread(
+        load_interrupted_runs
+    ):
+        if not dc_accounts and not payback_accounts:
+            await run_in_database_thread(remove_activation_run, run_id)
+            continue
+
+        logger.info(
+            f"Resuming activation run {run_id} with {len(dc_accounts)} DC and {len(payback_accounts)} Payback accounts."
+        )
 
-    pass
+        # Die Accounts des Laufs werden bis zu dessen Ende nicht zusätzlich nach ihrem Zeitplan gestartet.
+        dc_accounts, payback_accounts = scheduler.claim(dc_accounts, payback_accounts)
+        context.application.create_task(
+            activate_and_report(context, dc_accounts, payback_accounts, run_id)
+        )
 
 
 async def activate_coupons_manually(
     update: Update, context: ContextTypes.DEFAULT_TYPE
 ) -> None:
-    await activate_coupons(context)
+    # Es läuft höchstens ein manueller Lauf gleichzeitig; wiederholte Befehle währenddessen starten keinen weiteren.
+    manual_run = context.bot_data.get(MANUAL_RUN)
+    if manual_run is not None and not manual_run.done():
+        await update.message.reply_text(
+            "Die Aktivierung läuft bereits. Der Bericht folgt nach ihrem Abschluss."
+        )
+        return
 
+    # Der Lauf wird nicht abgewartet, damit der Bot währenddessen weitere Befehle verarbeitet.
+    context.bot_data[MANUAL_RUN] = context.application.create_task(
+        activate_coupons(context)
+    )
 
-app = ApplicationBuilder().token(get_telegram_token()).post_init(post_init).build()
 
-register_dc_account_handler = get_register_dc_handler()
-register_payback_account_handler = get_register_payback_handler()
-remove_account_handler = get_remove_account_handler()
+# Zeigt den Zustand der Drosselung der Anfragen an die Anbieter in diesem Prozess an.
+async def show_rate_limits(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    # Wir lassen nur geladene Gäste rein. ;-)
+    if not await is_allowed_to_interact(update):
+        return
 
+    message = describe_rate_controllers()
+    for statistics in get_pool_statistics():
+        message += f"HTTP: {statistics.describe()}\n"
 
-p = app.job_queue.run_repeating(
-    activate_coupons, interval=timedelta(days=1), first=timedelta(seconds=5)
-)
+    await update.message.reply_text(message, parse_mode="HTML")
+
+
+# Zeigt die langsamsten Accounts und Phasen der seit dem Start aufgezeichneten Läufe an.
+async def show_trace_summary(
+    update: Update, context: ContextTypes.DEFAULT_TYPE
+) -> None:
+    if not await is_allowed_to_interact(update):
+        return
+
+    await update.message.reply_text(get_trace_summary().describe(), parse_mode="HTML")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="python-coupons")
+    parser.add_argument(
+        "--worker",
+        action="store_true",
+        help="Startet einen Worker, der Accounts aus der gemeinsamen Datenbank aktiviert, anstatt des Telegram-Bots.",
+    )
+    args = parser.parse_args()
+
+    if args.worker:
+        asyncio.run(run_worker())
+        return
+
+    app = (
+        ApplicationBuilder()
+        .token(get_telegram_token())
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
+
+    register_dc_account_handler = get_register_dc_handler()
+    register_payback_account_handler = get_register_payback_handler()
+    remove_account_handler = get_remove_account_handler()
+
+    # Durch einen Neustart unterbrochene Läufe werden direkt nach dem Start fortgesetzt.
+    app.job_queue.run_once(resume_interrupted_runs, when=timedelta(seconds=1))
+
+    # Jeder Account hat einen eigenen Zeitplan; der Job entnimmt in jedem Tick die fällig gewordenen Accounts.
+    app.job_queue.run_repeating(
+        dispatch_due_accounts,
+        interval=timedelta(seconds=TICK_SECONDS),
+        first=timedelta(seconds=5),
+    )
+
+    # Die Ergebnisse der geplanten Läufe werden gesammelt in einem gemeinsamen Bericht verschickt.
+    digest_hours = get_report_digest_hours()
+    if digest_hours > 0:
+        app.job_queue.run_repeating(
+            send_report_digest,
+            interval=timedelta(hours=digest_hours),
+            first=timedelta(hours=digest_hours),
+        )
+
+    app.add_handler(CommandHandler("activate_coupons", activate_coupons_manually))
+    app.add_handler(CommandHandler("rate_limits", show_rate_limits))
+    app.add_handler(CommandHandler("trace_summary", show_trace_summary))
+
+    app.add_handler(register_dc_account_handler)
+    app.add_handler(register_payback_account_handler)
+    app.add_handler(remove_account_handler)
+    app.run_polling()
 
-app.add_handler(CommandHandler("activate_coupons", activate_coupons_manually))
 
-app.add_handler(register_dc_account_handler)
-app.add_handler(register_payback_account_handler)
-app.add_handler(remove_account_handler)
-app.run_polling()
+# Der Bot wird nur beim direkten Start gestartet, nicht wenn das Modul von einem Worker-Prozess importiert wird.
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+import bisect
+import math
+import threading
+
+# Obergrenzen der Buckets in Sekunden für die Dauer einzelner Anfragen an die Anbieter
+REQUEST_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_metrics = {}
+
+
+class Metric:
+    """
+    Basis der Metriken. Jede Metrik wird beim Erstellen unter ihrem Namen registriert und hält ihre Werte je
+    Kombination der Label-Werte. Die Werte werden aus mehreren Threads geschrieben (Bot, Aktivierung) und vom
+    Metrik-Endpunkt gelesen und sind daher durch ein Lock geschützt.
+    """
+
+    type = None
+
+    def __init__(self, name, description, label_names=()):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+        self.values = {}
+        self.lock = threading.Lock()
+
+        _metrics[name] = self
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def collect(self):
+        with self.lock:
+            return {key: self._copy(value) for key, value in self.values.items()}
+
+    def merge(self, values):
+        with self.lock:
+            for key, value in values.items():
+                self._merge_value(key, value)
+
+    def reset(self):
+        with self.lock:
+            self.values.clear()
+
+    def _copy(self, value):
+        return value
+
+    def _merge_value(self, key, value):
+        self.values[key] = self.values.get(key, 0.0) + value
+
+    def render(self):
+        lines = [
+            f"# HELP {self.name} {self.description}",
+            f"# TYPE {self.name} {self.type}",
+        ]
+
+        for key, value in sorted(self.collect().items()):
+            lines.extend(self._render_value(key, value))
+
+        return lines
+
+    def _render_value(self, key, value):
+        return [
+            f"{self.name}{_format_labels(self.label_names, key)} {_format_number(value)}"
+        ]
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount=1.0, **labels):
+        key = self._key(labels)
+
+        with self.lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+
+        with self.lock:
+            self.values[key] = float(value)
+
+    def _merge_value(self, key, value):
+        # Bei einem Messwert gilt der zuletzt übernommene Stand.
+        self.values[key] = value
+
+
+class Histogram(Metric):
+    """
+    Histogramm mit festen Buckets. Je Label-Kombination werden die Anzahl der Beobachtungen je Bucket sowie deren
+    Summe und Anzahl gezählt; die Buckets werden erst bei der Ausgabe kumuliert.
+    """
+
+    type = "histogram"
+
+    def __init__(self, name, description, label_names=(), buckets=REQUEST_BUCKETS):
+        super().__init__(name, description, label_names)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                # Ein Bucket je Obergrenze und einer für +Inf, dazu Summe und Anzahl
+                entry = [[0] * (len(self.buckets) + 1), 0.0, 0]
+                self.values[key] = entry
+
+            entry[0][index] = entry[0][index] + 1
+            entry[1] = entry[1] + value
+            entry[2] = entry[2] + 1
+
+    def _copy(self, value):
+        return [list(value[0]), value[1], value[2]]
+
+    def _merge_value(self, key, value):
+        entry = self.values.get(key)
+        if entry is None:
+            self.values[key] = self._copy(value)
+            return
+
+        entry[0] = [a + b for a, b in zip(entry[0], value[0])]
+        entry[1] = entry[1] + value[1]
+        entry[2] = entry[2] + value[2]
+
+    def _render_value(self, key, value):
+        bucket_counts, total, count = value
+        label_names = self.label_names + ("le",)
+
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + (math.inf,), bucket_counts):
+            cumulative = cumulative + bucket_count
+            labels = _format_labels(label_names, key + (_format_number(bound),))
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+
+        labels = _format_labels(self.label_names, key)
+        lines.append(f"{self.name}_sum{labels} {_format_number(total)}")
+        lines.append(f"{self.name}_count{labels} {count}")
+
+        return lines
+
+
+def _format_number(value):
+    if value == math.inf:
+        return "+Inf"
+
+    return repr(float(value))
+
+
+def _format_labels(label_names, values):
+    if not label_names:
+        return ""
+
+    labels = ",".join(
+        f'{name}="{_escape(value)}"' for name, value in zip(label_names, values)
+    )
+    return "{" + labels + "}"
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def render_metrics():
+    """
+    Gibt alle Metriken im Textformat von Prometheus zurück.
+    """
+    lines = []
+    for metric in _metrics.values():
+        lines.extend(metric.render())
+
+    return "\n".join(lines) + "\n"
+
+
+def collect_metrics():
+    """
+    Gibt die Werte aller Metriken dieses Prozesses zurück, um sie an einen anderen Prozess zu übergeben.
+    """
+    return {name: metric.collect() for name, metric in _metrics.items()}
+
+
+def merge_metrics(values):
+    """
+    Übernimmt die mit collect_metrics ermittelten Werte eines anderen Prozesses in die Metriken dieses Prozesses.
+    """
+    for name, metric_values in values.items():
+        metric = _metrics.get(name)
+        if metric is not None:
+            metric.merge(metric_values)
+
+
+def reset_metrics():
+    """
+    Setzt alle Metriken zurück. Wird in einem abgespaltenen Prozess aufgerufen, damit er nur seine eigenen Werte
+    zurückmeldet.
+    """
+    for metric in _metrics.values():
+        metric.reset()
@@ -0,0 +1,62 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from loguru import logger
+
+from src.metrics.registry import render_metrics
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+
+        body = render_metrics().encode("utf-8")
+
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Die regelmäßigen Abfragen sollen das Log nicht füllen.
+        pass
+
+
+class MetricsServer:
+    """
+    Stellt die Metriken unter /metrics im Textformat von Prometheus bereit. Der Server läuft in einem eigenen Thread,
+    sodass Abfragen weder die Event-Loop des Bots noch die der Aktivierung blockieren.
+    """
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.server = None
+        self.thread = None
+
+    def start(self):
+        self.server = ThreadingHTTPServer((self.host, self.port), _MetricsHandler)
+        self.thread = threading.Thread(
+            target=self.server.serve_forever, name="metrics", daemon=True
+        )
+        self.thread.start()
+
+        logger.info(
+            f"Serving metrics on http://{self.host}:{self.server.server_port}/metrics."
+        )
+
+    def stop(self):
+        if self.server is None:
+            return
+
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+        self.server = None
+        self.thread = None
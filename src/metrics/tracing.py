@@ -0,0 +1,269 @@
+import contextlib
+import contextvars
+import datetime
+import heapq
+import json
+import os
+import threading
+import time
+
+from loguru import logger
+
+# Anzahl der langsamsten Accounts in der Zusammenfassung
+SUMMARY_SIZE = 10
+
+# Kategorien der Spans: der gesamte Lauf, ein einzelner Account und die Phasen innerhalb eines Laufs bzw. Accounts
+CATEGORY_RUN = "run"
+CATEGORY_ACCOUNT = "account"
+CATEGORY_PHASE = "phase"
+
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+# Spur (tid im Trace-Format), auf der die Spans der laufenden Task eingetragen werden
+_current_lane = contextvars.ContextVar("current_lane", default=0)
+
+
+class Trace:
+    """
+    Sammelt die Spans eines Aktivierungslaufs als Ereignisse im Trace-Event-Format (Chrome, Perfetto).
+
+    Nebenläufig verarbeitete Accounts und Coupons erhalten jeweils eine eigene Spur, damit sich ihre Spans im Viewer
+    nicht überlagern. Freigegebene Spuren werden wiederverwendet, sodass ein Lauf höchstens so viele Spuren wie
+    gleichzeitig aktive Accounts und Coupons hat.
+    """
+
+    def __init__(self, started_at=None):
+        """
+        :param started_at: Bezugszeitpunkt (time.monotonic()) der Zeitstempel; wird von den Prozessen eines Laufs
+            übernommen, damit deren Spans auf derselben Zeitachse liegen
+        """
+        self.started_at = time.monotonic() if started_at is None else started_at
+        self.created_at = datetime.datetime.now()
+        self.pid = os.getpid()
+        self.events = []
+        self.lane_count = 1
+        self.free_lanes = []
+        self.lock = threading.Lock()
+
+    def acquire_lane(self):
+        with self.lock:
+            if self.free_lanes:
+                return heapq.heappop(self.free_lanes)
+
+            self.lane_count = self.lane_count + 1
+            return self.lane_count - 1
+
+    def release_lane(self, lane):
+        with self.lock:
+            heapq.heappush(self.free_lanes, lane)
+
+    def add(self, name, category, lane, started_at, ended_at, args):
+        self.events.append(
+            {
+                "name": name,
+                "cat": category,
+                "ph": "X",
+                "ts": round((started_at - self.started_at) * 1e6),
+                "dur": round((ended_at - started_at) * 1e6),
+                "pid": self.pid,
+                "tid": lane,
+                "args": args,
+            }
+        )
+
+    def extend(self, events):
+        """
+        Übernimmt die Ereignisse eines anderen Prozesses desselben Laufs.
+        """
+        self.events.extend(events)
+
+    def to_trace_events(self):
+        # Benennung der Prozesse und Spuren für die Anzeige im Viewer
+        metadata = []
+        for pid, lane in sorted(
+            {(event["pid"], event["tid"]) for event in self.events}
+        ):
+            metadata.append(
+                {
+                    "name": "thread_name",
+                    "ph": "M",
+                    "pid": pid,
+                    "tid": lane,
+                    "args": {"name": "run" if lane == 0 else f"lane {lane}"},
+                }
+            )
+
+        return {"traceEvents": metadata + self.events, "displayTimeUnit": "ms"}
+
+
+class _Span:
+    def __init__(self, trace, name, category, new_lane, args):
+        self.trace = trace
+        self.name = name
+        self.category = category
+        self.new_lane = new_lane
+        self.args = args
+
+    def __enter__(self):
+        if self.new_lane:
+            self.lane = self.trace.acquire_lane()
+            self.lane_token = _current_lane.set(self.lane)
+        else:
+            self.lane = _current_lane.get()
+
+        self.started_at = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is not None:
+            self.args["error"] = exc_type.__name__
+
+        self.trace.add(
+            self.name,
+            self.category,
+            self.lane,
+            self.started_at,
+            time.monotonic(),
+            self.args,
+        )
+
+        if self.new_lane:
+            _current_lane.reset(self.lane_token)
+            self.trace.release_lane(self.lane)
+
+        return False
+
+
+_no_span = contextlib.nullcontext()
+
+
+def span(name, category=CATEGORY_PHASE, new_lane=False, **args):
+    """
+    Erfasst die Dauer des umschlossenen Blocks als Span im Trace des laufenden Aktivierungslaufs. Ohne aktiven Trace
+    geschieht nichts.
+
+    :param name: Name der Phase, z.B. "login"
+    :param category: CATEGORY_RUN, CATEGORY_ACCOUNT oder CATEGORY_PHASE
+    :param new_lane: True, wenn der Block nebenläufig zu anderen Blöcken derselben Ebene läuft und daher eine eigene
+        Spur erhält
+    :param args: Zusätzliche Angaben zum Span, z.B. die Coupon-ID
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        return _no_span
+
+    return _Span(trace, name, category, new_lane, args)
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+@contextlib.contextmanager
+def tracing(trace):
+    """
+    Macht den Trace für den umschlossenen Block und alle darin gestarteten Tasks zum aktiven Trace. Bei None bleibt
+    das Tracing ausgeschaltet.
+    """
+    if trace is None:
+        yield
+        return
+
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+
+
+class TraceSummary:
+    """
+    Zusammenfassung aller Traces seit dem Start des Prozesses: die langsamsten Accounts sowie Anzahl, Gesamt- und
+    Höchstdauer je Phase.
+    """
+
+    def __init__(self, size=SUMMARY_SIZE):
+        self.size = size
+        # Min-Heap aus (Dauer, Zeitpunkt, Anbieter, Account), damit der schnellste der gemerkten Accounts als erster
+        # verdrängt wird
+        self.slowest_accounts = []
+        self.phases = {}
+        self.runs = 0
+        self.lock = threading.Lock()
+
+    def add(self, trace):
+        with self.lock:
+            self.runs = self.runs + 1
+
+            for event in trace.events:
+                duration = event["dur"] / 1e6
+
+                if event["cat"] == CATEGORY_ACCOUNT:
+                    entry = (
+                        duration,
+                        trace.created_at.strftime("%d.%m. %H:%M"),
+                        event["args"].get("provider", ""),
+                        event["args"].get("account", ""),
+                    )
+                    if len(self.slowest_accounts) < self.size:
+                        heapq.heappush(self.slowest_accounts, entry)
+                    else:
+                        heapq.heappushpop(self.slowest_accounts, entry)
+                elif event["cat"] == CATEGORY_PHASE:
+                    count, total, maximum = self.phases.get(
+                        event["name"], (0, 0.0, 0.0)
+                    )
+                    self.phases[event["name"]] = (
+                        count + 1,
+                        total + duration,
+                        max(maximum, duration),
+                    )
+
+    def describe(self):
+        """
+        Gibt die Zusammenfassung als lesbaren Text (HTML für Telegram) zurück.
+        """
+        with self.lock:
+            if not self.runs:
+                return "Es wurde noch kein Lauf aufgezeichnet."
+
+            message = f"<b>Langsamste Accounts</b> ({self.runs} Läufe)\n"
+            for duration, started, provider, account in sorted(
+                self.slowest_accounts, reverse=True
+            ):
+                message += f"{duration:.1f} s: {provider} {account} ({started})\n"
+
+            message += "\n<b>Phasen</b> (Anzahl, Durchschnitt, Maximum)\n"
+            for name, (count, total, maximum) in sorted(
+                self.phases.items(), key=lambda item: item[1][1], reverse=True
+            ):
+                message += f"{name}: {count}, {total / count:.2f} s, {maximum:.2f} s\n"
+
+            return message
+
+
+_summary = TraceSummary()
+
+
+def get_trace_summary():
+    return _summary
+
+
+def finish_trace(trace, directory):
+    """
+    Übernimmt den Trace in die Zusammenfassung und schreibt ihn als JSON-Datei in das Verzeichnis. Die Datei kann in
+    chrome://tracing oder https://ui.perfetto.dev geöffnet werden.
+
+    :return: Pfad der geschriebenen Datei
+    """
+    _summary.add(trace)
+
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(
+        directory, f"trace-{trace.created_at.strftime('%Y%m%d-%H%M%S-%f')}.json"
+    )
+
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(trace.to_trace_events(), file)
+
+    logger.info(f"Wrote trace of {len(trace.events)} spans to {path}.")
+    return path
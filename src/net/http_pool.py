@@ -0,0 +1,227 @@
+import asyncio
+import importlib.util
+import re
+import time
+import weakref
+
+import httpx
+from loguru import logger
+
+from src.config import (
+    get_http2_enabled,
+    get_http_keepalive_seconds,
+    get_http_pool_size,
+    get_http_record_file,
+    get_http_replay_file,
+    get_http_replay_speed,
+)
+from src.metrics.registry import Counter, Histogram
+from src.net.rate_control import ThrottledTransport, get_rate_controller
+from src.net.recording import (
+    RecordingTransport,
+    ReplayTransport,
+    get_cassette,
+    get_recorder,
+)
+
+PROVIDER_REQUESTS = Counter(
+    "coupons_provider_requests_total",
+    "Anfragen an die Anbieter",
+    ("provider", "endpoint", "status"),
+)
+PROVIDER_REQUEST_SECONDS = Histogram(
+    "coupons_provider_request_seconds",
+    "Dauer der Anfragen an die Anbieter bis zum Empfang der Antwort-Header",
+    ("provider", "endpoint", "status"),
+)
+
+# Versionsteil der Pfade beider APIs (.../v1/json/getcoupons bzw. .../v2/members/login), nach dem der Endpunkt folgt
+_VERSION_SEGMENT = re.compile(r"^.*/v\d+/(?:json/)?")
+
+
+class PoolStatistics:
+    """
+    Zählt je Anbieter die Anfragen und die dafür neu aufgebauten Verbindungen (TCP- und TLS-Handshakes). Der Anteil
+    der Anfragen ohne neuen Handshake zeigt, wie gut die Verbindungen wiederverwendet werden.
+    """
+
+    def __init__(self, provider):
+        self.provider = provider
+        self.requests = 0
+        self.tcp_handshakes = 0
+        self.tls_handshakes = 0
+
+    @property
+    def reuse_rate(self):
+        if not self.requests:
+            return 0.0
+
+        return max(1 - self.tcp_handshakes / self.requests, 0.0)
+
+    async def trace(self, event_name, info):
+        # Wird von httpcore für jeden Schritt einer Anfrage aufgerufen; nur neue Verbindungen durchlaufen connect_tcp
+        # und start_tls.
+        if event_name == "connection.connect_tcp.complete":
+            self.tcp_handshakes = self.tcp_handshakes + 1
+        elif event_name == "connection.start_tls.complete":
+            self.tls_handshakes = self.tls_handshakes + 1
+
+    def describe(self):
+        return (
+            f"{self.provider}: {self.requests} requests, {self.tcp_handshakes} TCP and {self.tls_handshakes} TLS "
+            f"handshakes ({self.reuse_rate:.0%} reused)"
+        )
+
+
+class CountingTransport(httpx.AsyncBaseTransport):
+    """
+    httpx-Transport, der die Anfragen und Handshakes einer PoolStatistics über die trace-Erweiterung von httpcore
+    erfasst.
+    """
+
+    def __init__(self, statistics, transport):
+        self.statistics = statistics
+        self.transport = transport
+
+    async def handle_async_request(self, request):
+        self.statistics.requests = self.statistics.requests + 1
+        request.extensions["trace"] = self.statistics.trace
+
+        return await self.transport.handle_async_request(request)
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+def endpoint_name(url):
+    """
+    Gibt den Endpunkt einer Anfrage zurück, z.B. "getcoupons" oder "members/coupons/registration".
+    """
+    return _VERSION_SEGMENT.sub("", url.path)
+
+
+class MetricsTransport(httpx.AsyncBaseTransport):
+    """
+    httpx-Transport, der Anzahl und Dauer jeder Anfrage je Anbieter, Endpunkt und Status erfasst. Als Status gilt der
+    HTTP-Statuscode bzw. bei einem Verbindungsfehler der Name des Fehlers.
+    """
+
+    def __init__(self, provider, transport):
+        self.provider = provider
+        self.transport = transport
+
+    async def handle_async_request(self, request):
+        endpoint = endpoint_name(request.url)
+        started_at = time.perf_counter()
+
+        try:
+            response = await self.transport.handle_async_request(request)
+        except Exception as e:
+            self._record(endpoint, type(e).__name__, started_at)
+            raise
+
+        self._record(endpoint, response.status_code, started_at)
+        return response
+
+    def _record(self, endpoint, status, started_at):
+        labels = {"provider": self.provider, "endpoint": endpoint, "status": status}
+
+        PROVIDER_REQUESTS.inc(**labels)
+        PROVIDER_REQUEST_SECONDS.observe(time.perf_counter() - started_at, **labels)
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+_statistics = {}
+# Je Event-Loop ein Client pro Anbieter: Die Verbindungen eines Clients sind an die Loop gebunden, in der sie
+# aufgebaut wurden.
+_clients = weakref.WeakKeyDictionary()
+
+
+def get_pool_statistics():
+    """
+    Gibt die PoolStatistics aller Anbieter zurück, für die in diesem Prozess ein Client erstellt wurde.
+    """
+    return list(_statistics.values())
+
+
+def log_pool_statistics():
+    for statistics in get_pool_statistics():
+        logger.info(f"HTTP connections of {statistics.describe()}.")
+
+
+def _use_http2():
+    if not get_http2_enabled():
+        return False
+
+    if importlib.util.find_spec("h2") is None:
+        logger.warning("HTTP2 is enabled, but the h2 package is missing.")
+        return False
+
+    return True
+
+
+def _create_client(provider, **client_options):
+    statistics = _statistics.setdefault(provider, PoolStatistics(provider))
+    pool_size = get_http_pool_size()
+
+    replay_file = get_http_replay_file()
+    record_file = get_http_record_file()
+
+    if replay_file:
+        # Die Antworten kommen aus einer Aufzeichnung; es werden keine Verbindungen aufgebaut.
+        transport = ReplayTransport(
+            provider, get_cassette(replay_file), get_http_replay_speed()
+        )
+    else:
+        transport = httpx.AsyncHTTPTransport(
+            http2=_use_http2(),
+            limits=httpx.Limits(
+                max_connections=pool_size,
+                max_keepalive_connections=pool_size,
+                keepalive_expiry=get_http_keepalive_seconds(),
+            ),
+        )
+
+    if record_file:
+        transport = RecordingTransport(provider, get_recorder(record_file), transport)
+
+    return httpx.AsyncClient(
+        # Die Metriken erfassen jede einzelne Anfrage (auch nach einer Drosselung wiederholte) ohne die Wartezeit
+        # der Drosselung.
+        transport=ThrottledTransport(
+            get_rate_controller(provider),
+            MetricsTransport(provider, CountingTransport(statistics, transport)),
+        ),
+        **client_options,
+    )
+
+
+def get_http_client(provider, **client_options):
+    """
+    Gibt den gemeinsamen Client des Anbieters für die laufende Event-Loop zurück. Alle API-Clients eines Anbieters
+    teilen sich damit Verbindungspool, Keep-Alive-Verbindungen und (falls aktiviert) HTTP/2-Verbindungen; Angaben
+    eines einzelnen Accounts werden je Anfrage übergeben.
+
+    :param provider: Kennung des Anbieters ("dc" oder "payback")
+    :param client_options: Optionen für httpx.AsyncClient (z.B. headers, timeout), die beim Erstellen verwendet werden
+    """
+    clients = _clients.setdefault(asyncio.get_running_loop(), {})
+
+    client = clients.get(provider)
+    if client is None or client.is_closed:
+        client = _create_client(provider, **client_options)
+        clients[provider] = client
+
+    return client
+
+
+async def close_http_clients():
+    """
+    Schließt die Clients der laufenden Event-Loop. Wird aufgerufen, bevor eine Event-Loop beendet wird.
+    """
+    clients = _clients.pop(asyncio.get_running_loop(), {})
+
+    for client in clients.values():
+        await client.aclose()
@@ -0,0 +1,343 @@
+import asyncio
+import collections
+import email.utils
+import time
+
+import httpx
+from loguru import logger
+
+from src.config import (
+    get_dc_max_concurrent_requests,
+    get_dc_requests_per_second,
+    get_payback_max_concurrent_requests,
+    get_payback_requests_per_second,
+)
+
+# Geglättete Antwortzeit in Sekunden, ab der ein Anbieter als überlastet gilt und die Parallelität verringert wird
+TARGET_LATENCY = 2.0
+# Gewicht einer neuen Beobachtung in den geglätteten Werten für Antwortzeit und Fehlerquote
+SMOOTHING = 0.2
+# Faktor, mit dem die erlaubte Parallelität bei Überlastung multipliziert wird
+DECREASE_FACTOR = 0.5
+# Mindestabstand in Sekunden zwischen zwei Verringerungen, damit eine Welle von Fehlern nur einmal zählt
+DECREASE_COOLDOWN = 1.0
+# Wartezeit in Sekunden nach einer 429-Antwort ohne (lesbaren) Retry-After-Header
+DEFAULT_RETRY_AFTER = 5.0
+# Obergrenze in Sekunden für einen vom Anbieter verlangten Retry-After
+MAX_RETRY_AFTER = 300.0
+# Anzahl der Wiederholungen einer Anfrage, die mit 429 abgelehnt wurde
+MAX_THROTTLE_RETRIES = 3
+# Anzahl der Drosselungsereignisse, die je Anbieter zur Einsicht vorgehalten werden
+EVENT_HISTORY = 50
+
+
+def parse_retry_after(value):
+    """
+    Gibt die Wartezeit in Sekunden aus einem Retry-After-Header zurück. Der Header kann Sekunden oder ein HTTP-Datum
+    enthalten; fehlt er oder ist er nicht lesbar, wird DEFAULT_RETRY_AFTER verwendet.
+    """
+    if not value:
+        return DEFAULT_RETRY_AFTER
+
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            seconds = email.utils.parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError):
+            return DEFAULT_RETRY_AFTER
+
+    return min(max(seconds, 0.0), MAX_RETRY_AFTER)
+
+
+class TokenBucket:
+    """
+    Token-Bucket für einen Endpunkt: Es stehen rate Anfragen pro Sekunde zur Verfügung, kurzfristig bis zu burst
+    Anfragen auf einmal.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        while True:
+            self._refill(time.monotonic())
+
+            if self.tokens >= 1:
+                self.tokens = self.tokens - 1
+                return
+
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class RateController:
+    """
+    Begrenzt die Anfragen an einen Anbieter. Jeder Endpunkt erhält einen eigenen Token-Bucket, zusätzlich ist die
+    Anzahl gleichzeitig laufender Anfragen begrenzt. Diese Grenze wird nach dem AIMD-Verfahren angepasst: Nach jeder
+    erfolgreichen, schnellen Antwort steigt sie additiv (um eins je vollständigem Durchlauf), bei 429, Serverfehlern,
+    Verbindungsfehlern oder zu hoher Antwortzeit wird sie halbiert. Eine 429-Antwort pausiert außerdem alle Anfragen an
+    den Anbieter für die im Retry-After-Header angegebene Dauer.
+
+    Ein RateController wird von allen API-Clients eines Anbieters im selben Prozess geteilt (siehe
+    get_rate_controller).
+    """
+
+    def __init__(self, provider, requests_per_second, max_concurrency):
+        """
+        :param provider: Kennung des Anbieters ("dc" oder "payback")
+        :param requests_per_second: Erlaubte Anfragen pro Sekunde je Endpunkt
+        :param max_concurrency: Obergrenze der gleichzeitig laufenden Anfragen
+        """
+        self.provider = provider
+        self.requests_per_second = requests_per_second
+        self.max_concurrency = max(max_concurrency, 1)
+        # Die Grenze beginnt in der Mitte und tastet sich von dort an die Belastbarkeit des Anbieters heran.
+        self.limit = max(self.max_concurrency / 2, 1.0)
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.last_decrease = 0.0
+        self.buckets = {}
+        self.events = collections.deque(maxlen=EVENT_HISTORY)
+
+        self.requests = 0
+        self.throttled = 0
+        self.errors = 0
+        self.latency = 0.0
+        self.error_rate = 0.0
+
+        self._condition = None
+        self._loop = None
+
+    def _get_condition(self):
+        # asyncio-Primitive sind an eine Event-Loop gebunden; der Controller überdauert aber einzelne asyncio.run-Aufrufe.
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._condition = asyncio.Condition()
+
+        return self._condition
+
+    def _bucket(self, endpoint):
+        bucket = self.buckets.get(endpoint)
+        if bucket is None:
+            bucket = TokenBucket(
+                self.requests_per_second, max(self.requests_per_second, 1)
+            )
+            self.buckets[endpoint] = bucket
+
+        return bucket
+
+    async def _acquire_slot(self):
+        condition = self._get_condition()
+        async with condition:
+            await condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight = self.in_flight + 1
+
+    async def _release_slot(self):
+        condition = self._get_condition()
+        async with condition:
+            self.in_flight = self.in_flight - 1
+            condition.notify_all()
+
+    async def _wait_while_paused(self):
+        while (remaining := self.paused_until - time.monotonic()) > 0:
+            await asyncio.sleep(remaining)
+
+    def _record_event(self, endpoint, kind, **details):
+        self.events.append(
+            {
+                "time": time.time(),
+                "endpoint": endpoint,
+                "event": kind,
+                "limit": int(self.limit),
+                **details,
+            }
+        )
+
+    def _observe(self, latency, failed):
+        self.requests = self.requests + 1
+        self.latency = self.latency + SMOOTHING * (latency - self.latency)
+        self.error_rate = self.error_rate + SMOOTHING * (
+            (1.0 if failed else 0.0) - self.error_rate
+        )
+
+    def _decrease(self, endpoint, reason):
+        now = time.monotonic()
+        if now - self.last_decrease < DECREASE_COOLDOWN:
+            return
+
+        self.last_decrease = now
+        self.limit = max(self.limit * DECREASE_FACTOR, 1.0)
+        self._record_event(endpoint, "decrease", reason=reason)
+        logger.info(
+            f"Reducing {self.provider} concurrency to {int(self.limit)} ({reason} on {endpoint})."
+        )
+
+    def _increase(self):
+        self.limit = min(self.limit + 1 / self.limit, float(self.max_concurrency))
+
+    def _on_response(self, endpoint, status_code, latency):
+        failed = status_code >= 500
+        self._observe(latency, failed)
+
+        if failed:
+            self.errors = self.errors + 1
+            self._decrease(endpoint, f"status {status_code}")
+        elif self.latency > TARGET_LATENCY:
+            self._decrease(endpoint, f"latency {self.latency:.2f}s")
+        else:
+            self._increase()
+
+    def _on_error(self, endpoint, error, latency):
+        self._observe(latency, True)
+        self.errors = self.errors + 1
+        self._decrease(endpoint, type(error).__name__)
+
+    def _on_throttled(self, endpoint, retry_after):
+        self.throttled = self.throttled + 1
+        self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+        self._record_event(endpoint, "throttled", retry_after=retry_after)
+        logger.warning(
+            f"{self.provider} throttled {endpoint}, pausing requests for {retry_after:.1f}s."
+        )
+        self._decrease(endpoint, "status 429")
+
+    async def send(self, request, send):
+        """
+        Führt eine Anfrage unter Einhaltung der Grenzen aus. Wird die Anfrage mit 429 abgelehnt, wird nach Ablauf des
+        Retry-After bis zu MAX_THROTTLE_RETRIES-mal erneut gesendet.
+
+        :param request: httpx.Request
+        :param send: Coroutine-Funktion, die die Anfrage tatsächlich versendet und die Antwort zurückgibt
+        """
+        endpoint = request.url.path.rsplit("/", 1)[-1]
+        bucket = self._bucket(endpoint)
+
+        for attempt in range(MAX_THROTTLE_RETRIES + 1):
+            await self._wait_while_paused()
+            await bucket.acquire()
+            await self._acquire_slot()
+
+            started = time.monotonic()
+            try:
+                response = await send(request)
+            except Exception as e:
+                self._on_error(endpoint, e, time.monotonic() - started)
+                raise
+            finally:
+                await self._release_slot()
+
+            if response.status_code != 429:
+                self._on_response(
+                    endpoint, response.status_code, time.monotonic() - started
+                )
+                return response
+
+            self._on_throttled(
+                endpoint, parse_retry_after(response.headers.get("Retry-After"))
+            )
+
+            if attempt < MAX_THROTTLE_RETRIES:
+                await response.aclose()
+
+        return response
+
+    def snapshot(self):
+        """
+        Gibt den aktuellen Zustand (Grenzen, Zähler und letzte Drosselungsereignisse) als Dictionary zurück.
+        """
+        return {
+            "provider": self.provider,
+            "limit": int(self.limit),
+            "max_concurrency": self.max_concurrency,
+            "in_flight": self.in_flight,
+            "requests_per_second": self.requests_per_second,
+            "paused_for": max(self.paused_until - time.monotonic(), 0.0),
+            "requests": self.requests,
+            "throttled": self.throttled,
+            "errors": self.errors,
+            "latency": self.latency,
+            "error_rate": self.error_rate,
+            "events": list(self.events),
+        }
+
+
+class ThrottledTransport(httpx.AsyncBaseTransport):
+    """
+    httpx-Transport, der alle Anfragen eines Clients über einen RateController leitet.
+    """
+
+    def __init__(self, controller, transport=None):
+        self.controller = controller
+        self.transport = transport or httpx.AsyncHTTPTransport()
+
+    async def handle_async_request(self, request):
+        return await self.controller.send(request, self.transport.handle_async_request)
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+# Einstellungen der Grenzen je Anbieter: Anfragen pro Sekunde je Endpunkt und maximale Parallelität
+_LIMITS = {
+    "dc": (get_dc_requests_per_second, get_dc_max_concurrent_requests),
+    "payback": (get_payback_requests_per_second, get_payback_max_concurrent_requests),
+}
+
+_controllers = {}
+
+
+def get_rate_controller(provider):
+    """
+    Gibt den RateController des Anbieters zurück und legt ihn beim ersten Aufruf im Prozess an.
+    """
+    controller = _controllers.get(provider)
+    if controller is None:
+        requests_per_second, max_concurrency = _LIMITS[provider]
+        controller = RateController(provider, requests_per_second(), max_concurrency())
+        _controllers[provider] = controller
+
+    return controller
+
+
+def get_rate_controllers():
+    """
+    Gibt alle im Prozess angelegten RateController zurück.
+    """
+    return list(_controllers.values())
+
+
+def describe_rate_controllers():
+    """
+    Gibt den Zustand aller RateController als lesbaren Text (HTML für Telegram) zurück.
+    """
+    controllers = get_rate_controllers()
+    if not controllers:
+        return "Es wurden noch keine Anfragen an die Anbieter gestellt."
+
+    message = ""
+    for controller in controllers:
+        state = controller.snapshot()
+
+        message += f"<b>{state['provider']}</b>\n"
+        message += f"Parallelität: {state['limit']}/{state['max_concurrency']} (aktiv: {state['in_flight']})\n"
+        message += f"Anfragen/s je Endpunkt: {state['requests_per_second']}\n"
+        message += f"Anfragen: {state['requests']}, gedrosselt: {state['throttled']}, Fehler: {state['errors']}\n"
+        message += f"Antwortzeit: {state['latency']:.2f}s, Fehlerquote: {state['error_rate']:.0%}\n"
+
+        if state["paused_for"] > 0:
+            message += f"Pausiert für {state['paused_for']:.0f}s\n"
+
+        for event in state["events"][-5:]:
+            message += f" - {time.strftime('%H:%M:%S', time.localtime(event['time']))} {event['event']} {event['endpoint']} (Grenze {event['limit']})\n"
+
+        message += "\n"
+
+    return message
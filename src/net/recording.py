@@ -0,0 +1,376 @@
+import asyncio
+import datetime
+import hashlib
+import hmac
+import json
+import os
+import re
+import secrets
+import threading
+import time
+
+import httpx
+from loguru import logger
+
+# Schlüssel (in Kleinbuchstaben) von Headern und JSON-Feldern, deren Werte vor dem Speichern ersetzt werden
+SENSITIVE_KEYS = {
+    "authorization",
+    "cookie",
+    "set-cookie",
+    "x-api-token",
+    "x-auth-token",
+    "token",
+    "refreshtoken",
+    "credential",
+    "secret",
+    "password",
+    "alias",
+    "cardnumber",
+    "email",
+    "firstname",
+    "lastname",
+    "birthdate",
+    "dateofbirth",
+    "zipcode",
+    "plz",
+    "street",
+}
+
+# Header, die sich auf die übertragene Form des Inhalts beziehen. Gespeichert wird der dekodierte Inhalt, daher
+# werden sie weder aufgezeichnet noch abgespielt.
+_TRANSFER_HEADERS = {"content-encoding", "content-length", "transfer-encoding"}
+
+# Zeitstempel in den Antworten, z.B. "2024-02-22T20:04:32+01:00" (die Angabe der Zeitzone bleibt unverändert)
+_TIMESTAMP = re.compile(r"\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}")
+_TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+# Kürzeste Länge eines Werts, der zusätzlich überall im Inhalt ersetzt wird; kürzere Werte (z.B. eine PLZ) würden
+# auch unbeteiligte Zahlen im Katalog treffen.
+_MIN_SCRUB_LENGTH = 6
+
+
+def _endpoint(url):
+    # Wie bei der Drosselung genügt der letzte Teil des Pfads, um die Endpunkte eines Anbieters zu unterscheiden.
+    return url.path.rsplit("/", 1)[-1]
+
+
+class MissingRecordingError(Exception):
+    """
+    Für eine Anfrage gibt es in der Aufzeichnung keine Antwort.
+    """
+
+    pass
+
+
+class Redactor:
+    """
+    Ersetzt Zugangsdaten und Tokens durch Platzhalter, bevor eine Anfrage und ihre Antwort gespeichert werden.
+
+    Der Platzhalter eines Werts ist ein HMAC mit einem zufälligen Schlüssel des Prozesses: Derselbe Token erhält
+    innerhalb einer Aufzeichnung immer denselben Platzhalter, sodass die Anfragen eines Accounts beim Abspielen
+    zusammengehören, lässt aber keinen Rückschluss auf den Wert zu. Werte aus sensiblen Feldern werden außerdem an
+    jeder anderen Stelle der gespeicherten Inhalte ersetzt. Dazu werden alle bekannten Werte zu einem regulären
+    Ausdruck zusammengefasst, der nur neu erstellt wird, wenn ein Wert hinzukommt.
+    """
+
+    def __init__(self):
+        self.key = secrets.token_bytes(32)
+        self.values = {}
+        self.pattern = None
+        self.lock = threading.Lock()
+
+    def placeholder(self, value):
+        digest = hmac.new(self.key, str(value).encode("utf-8"), hashlib.sha256)
+        return f"redacted-{digest.hexdigest()[:16]}"
+
+    def _remember(self, value):
+        value = str(value)
+        if len(value) >= _MIN_SCRUB_LENGTH:
+            with self.lock:
+                if value not in self.values:
+                    self.values[value] = self.placeholder(value)
+                    self.pattern = None
+
+    def _compiled_pattern(self):
+        with self.lock:
+            if self.pattern is None and self.values:
+                # Längere Werte zuerst, damit ein Wert, der in einem anderen enthalten ist, diesen nicht zerteilt.
+                self.pattern = re.compile(
+                    "|".join(
+                        re.escape(value)
+                        for value in sorted(self.values, key=len, reverse=True)
+                    )
+                )
+
+            return self.pattern
+
+    def redact_data(self, data):
+        """
+        Gibt eine Kopie der JSON-Daten zurück, in der die Werte sensibler Felder durch Platzhalter ersetzt sind.
+        """
+        if isinstance(data, dict):
+            redacted = {}
+            for key, value in data.items():
+                if key.lower() in SENSITIVE_KEYS and isinstance(value, (str, int)):
+                    self._remember(value)
+                    redacted[key] = self.placeholder(value) if value != "" else ""
+                else:
+                    redacted[key] = self.redact_data(value)
+            return redacted
+
+        if isinstance(data, list):
+            return [self.redact_data(value) for value in data]
+
+        return data
+
+    def redact_headers(self, headers):
+        redacted = []
+        for key, value in headers.multi_items():
+            if key.lower() in _TRANSFER_HEADERS:
+                continue
+
+            if key.lower() in SENSITIVE_KEYS and value != "":
+                self._remember(value)
+                value = self.placeholder(value)
+
+            redacted.append([key, value])
+
+        return redacted
+
+    def redact_body(self, content):
+        """
+        Gibt den Inhalt einer Anfrage oder Antwort als Text zurück. JSON-Inhalte werden feldweise bereinigt und nur
+        dann neu serialisiert, wenn sich etwas geändert hat; danach werden alle bekannten sensiblen Werte in einem
+        Durchlauf ersetzt.
+        """
+        text = content.decode("utf-8", errors="replace")
+
+        try:
+            data = json.loads(text)
+        except ValueError:
+            data = None
+
+        if data is not None:
+            redacted = self.redact_data(data)
+            if redacted != data:
+                text = json.dumps(redacted, ensure_ascii=False)
+
+        pattern = self._compiled_pattern()
+        if pattern is None:
+            return text
+
+        return pattern.sub(lambda match: self.values[match.group(0)], text)
+
+
+def _session_of(headers, body):
+    # Die Anfragen eines Accounts tragen den Token des Logins: DeutschlandCard im Header X-Auth-Token, Payback im
+    # Feld authentication.token. Login-Anfragen gehören zu keiner Sitzung.
+    token = headers.get("x-auth-token")
+    if token:
+        return token
+
+    try:
+        data = json.loads(body)
+    except ValueError:
+        return None
+
+    if isinstance(data, dict) and isinstance(data.get("authentication"), dict):
+        return data["authentication"].get("token") or None
+
+    return None
+
+
+class Recorder:
+    """
+    Schreibt die Anfragen an die Anbieter mit ihren Antworten als JSON-Zeilen in eine Datei (Cassette). Zu jeder
+    Anfrage werden Anbieter, Methode, Endpunkt, Sitzung (Platzhalter des Tokens), Status, Header, Inhalt, der
+    Zeitpunkt der Aufzeichnung und die Dauer bis zum vollständigen Empfang der Antwort gespeichert.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.redactor = Redactor()
+        self.lock = threading.Lock()
+
+    def add(self, provider, request, response, content, elapsed):
+        request_headers = httpx.Headers(self.redactor.redact_headers(request.headers))
+        request_body = self.redactor.redact_body(request.content)
+
+        entry = {
+            "provider": provider,
+            "method": request.method,
+            "endpoint": _endpoint(request.url),
+            "session": _session_of(request_headers, request_body),
+            "recorded_at": time.time(),
+            "elapsed": elapsed,
+            "request": {
+                "headers": request_headers.multi_items(),
+                "body": request_body,
+            },
+            "status": response.status_code,
+            "headers": self.redactor.redact_headers(response.headers),
+            "body": self.redactor.redact_body(content),
+        }
+
+        # Aufzeichnungen sind ein Werkzeug zur Entwicklung; das Schreiben in der Event-Loop ist daher vertretbar.
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        with self.lock, open(self.path, "a", encoding="utf-8") as file:
+            file.write(line)
+
+
+class RecordingTransport(httpx.AsyncBaseTransport):
+    """
+    httpx-Transport, der jede Antwort vollständig empfängt, bereinigt in einem Recorder speichert und danach
+    unverändert weitergibt. Gestreamte Antworten werden dabei erst nach dem vollständigen Empfang weitergegeben.
+    """
+
+    def __init__(self, provider, recorder, transport):
+        self.provider = provider
+        self.recorder = recorder
+        self.transport = transport
+
+    async def handle_async_request(self, request):
+        started_at = time.perf_counter()
+
+        response = await self.transport.handle_async_request(request)
+        try:
+            content = await response.aread()
+        finally:
+            await response.aclose()
+
+        self.recorder.add(
+            self.provider, request, response, content, time.perf_counter() - started_at
+        )
+
+        headers = [
+            (key, value)
+            for key, value in response.headers.multi_items()
+            if key.lower() not in _TRANSFER_HEADERS
+        ]
+        return httpx.Response(
+            response.status_code, headers=headers, content=content, request=request
+        )
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+def _shift_timestamps(text, delta):
+    def shift(match):
+        value = datetime.datetime.strptime(match.group(0), _TIMESTAMP_FORMAT)
+        return (value + delta).strftime(_TIMESTAMP_FORMAT)
+
+    return _TIMESTAMP.sub(shift, text)
+
+
+class Cassette:
+    """
+    Aufgezeichnete Antworten zum Abspielen. Eine Anfrage erhält die nächste Antwort auf denselben Endpunkt in
+    derselben Sitzung (bzw. bei Logins die nächste Login-Antwort); ist die Sitzung unbekannt, die nächste Antwort auf
+    den Endpunkt. Sind alle Antworten abgespielt, beginnt die Reihenfolge von vorn. Dieselben Anfragen erhalten damit
+    in jedem Lauf dieselben Antworten.
+
+    Die Zeitstempel der Antworten werden beim Laden um den Abstand zur Aufzeichnung verschoben, damit die Gültigkeit
+    der Coupons beim Abspielen so bewertet wird wie bei der Aufzeichnung.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self.cursors = {}
+        self.lock = threading.Lock()
+
+        now = time.time()
+        with open(path, encoding="utf-8") as file:
+            for line in file:
+                if not line.strip():
+                    continue
+
+                entry = json.loads(line)
+                delta = datetime.timedelta(seconds=round(now - entry["recorded_at"]))
+                entry["content"] = _shift_timestamps(entry["body"], delta).encode(
+                    "utf-8"
+                )
+
+                for key in self._keys(
+                    entry["provider"],
+                    entry["method"],
+                    entry["endpoint"],
+                    entry["session"],
+                ):
+                    self.entries.setdefault(key, []).append(entry)
+
+        logger.info(
+            f"Loaded {sum(len(e) for k, e in self.entries.items() if len(k) == 4)} recorded responses from {path}."
+        )
+
+    @staticmethod
+    def _keys(provider, method, endpoint, session):
+        return [(provider, method, endpoint, session), (provider, method, endpoint)]
+
+    def next_entry(self, provider, method, endpoint, session):
+        for key in self._keys(provider, method, endpoint, session):
+            entries = self.entries.get(key)
+            if entries:
+                with self.lock:
+                    index = self.cursors.get(key, 0)
+                    self.cursors[key] = index + 1
+
+                return entries[index % len(entries)]
+
+        raise MissingRecordingError(
+            f"No recorded response for {provider} {method} {endpoint}"
+        )
+
+
+class ReplayTransport(httpx.AsyncBaseTransport):
+    """
+    httpx-Transport, der statt der Anbieter die Antworten einer Cassette zurückgibt.
+
+    :param speed: Faktor für die aufgezeichnete Dauer der Anfragen: 1 wartet so lange wie bei der Aufzeichnung,
+        0.1 ein Zehntel davon, 0 gar nicht
+    """
+
+    def __init__(self, provider, cassette, speed):
+        self.provider = provider
+        self.cassette = cassette
+        self.speed = speed
+
+    async def handle_async_request(self, request):
+        content = await request.aread()
+        session = _session_of(request.headers, content)
+
+        entry = self.cassette.next_entry(
+            self.provider, request.method, _endpoint(request.url), session
+        )
+
+        if self.speed > 0:
+            await asyncio.sleep(entry["elapsed"] * self.speed)
+
+        return httpx.Response(
+            entry["status"],
+            headers=entry["headers"],
+            content=entry["content"],
+            request=request,
+        )
+
+
+_recorders = {}
+_cassettes = {}
+
+
+def get_recorder(path):
+    path = os.path.abspath(path)
+    if path not in _recorders:
+        _recorders[path] = Recorder(path)
+        logger.warning(f"Recording provider traffic to {path}.")
+
+    return _recorders[path]
+
+
+def get_cassette(path):
+    path = os.path.abspath(path)
+    if path not in _cassettes:
+        _cassettes[path] = Cassette(path)
+
+    return _cassettes[path]
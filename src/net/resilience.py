@@ -0,0 +1,228 @@
+import asyncio
+import functools
+import random
+import time
+
+import httpx
+from loguru import logger
+
+from src.config import (
+    get_circuit_breaker_failure_threshold,
+    get_circuit_breaker_reset_seconds,
+    get_provider_call_attempts,
+)
+
+# Basis und Obergrenze in Sekunden für die exponentiell wachsende Wartezeit zwischen zwei Versuchen
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 10.0
+
+
+class ProviderUnavailableError(Exception):
+    """
+    Wird von den API-Clients ausgelöst, wenn der Anbieter eine Anfrage mit einem vorübergehenden Fehler (5xx)
+    beantwortet.
+    """
+
+
+class ProviderThrottledError(Exception):
+    """
+    Wird von den API-Clients ausgelöst, wenn der Anbieter eine Anfrage auch nach den Wiederholungen der Drosselung
+    (siehe RateController) mit 429 ablehnt. Der Aufruf wird nicht erneut wiederholt.
+    """
+
+
+class CircuitOpenError(Exception):
+    """
+    Wird ausgelöst, wenn ein Aufruf abgelehnt wird, weil der Anbieter als ausgefallen gilt.
+    """
+
+
+# Fehler, nach denen ein Aufruf wiederholt werden kann und die als Ausfall des Anbieters zählen
+TRANSIENT_ERRORS = (httpx.TransportError, ProviderUnavailableError)
+
+
+def raise_if_unavailable(result):
+    """
+    Löst einen ProviderUnavailableError aus, wenn die Antwort auf einen vorübergehenden Fehler des Anbieters hinweist.
+    Eine 429-Antwort wurde bereits vom RateController nach dem Retry-After wiederholt und führt zu einem
+    ProviderThrottledError, damit sich dessen Wartezeiten nicht mit den Wiederholungen von call_with_policy
+    multiplizieren.
+    """
+    if result.status_code == 429:
+        raise ProviderThrottledError(
+            f"{result.request.url.host} is still throttling after retries"
+        )
+
+    if result.status_code >= 500:
+        raise ProviderUnavailableError(
+            f"{result.request.url.host} answered {result.status_code}"
+        )
+
+
+class CircuitBreaker:
+    """
+    Circuit Breaker für einen Anbieter. Nach failure_threshold aufeinanderfolgenden vorübergehenden Fehlern wird der
+    Anbieter für reset_seconds als ausgefallen betrachtet; alle Aufrufe schlagen in dieser Zeit sofort mit
+    CircuitOpenError fehl. Danach wird ein einzelner Probe-Aufruf durchgelassen (half-open): Gelingt er, wird der
+    Breaker wieder geschlossen, andernfalls beginnt die Wartezeit erneut.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, provider, failure_threshold, reset_seconds):
+        self.provider = provider
+        self.failure_threshold = max(failure_threshold, 1)
+        self.reset_seconds = reset_seconds
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+
+    def before_call(self):
+        """
+        Prüft, ob ein Aufruf durchgeführt werden darf. Gibt True zurück, wenn der Aufruf der Probe-Aufruf ist.
+        """
+        if self.state == self.CLOSED:
+            return False
+
+        if (
+            self.state == self.OPEN
+            and time.monotonic() - self.opened_at >= self.reset_seconds
+        ):
+            logger.info(f"Probing {self.provider} after circuit was open.")
+            self.state = self.HALF_OPEN
+
+        if self.state == self.HALF_OPEN and not self.probing:
+            self.probing = True
+            return True
+
+        raise CircuitOpenError(f"{self.provider} is unavailable, failing fast")
+
+    def record_success(self, probe):
+        if probe:
+            self.probing = False
+
+        if self.state != self.CLOSED:
+            logger.info(f"{self.provider} is available again, closing circuit.")
+
+        self.state = self.CLOSED
+        self.failures = 0
+
+    def record_failure(self, probe):
+        if probe:
+            self.probing = False
+
+        self.failures = self.failures + 1
+
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                logger.warning(
+                    f"Opening circuit for {self.provider} after {self.failures} failures."
+                )
+
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+    def release(self, probe):
+        # Ein abgebrochener Probe-Aufruf darf den Breaker nicht dauerhaft im Zustand half-open blockieren.
+        if probe:
+            self.probing = False
+
+    def snapshot(self):
+        return {
+            "provider": self.provider,
+            "state": self.state,
+            "failures": self.failures,
+        }
+
+
+_breakers = {}
+
+
+def get_circuit_breaker(provider):
+    """
+    Gibt den Circuit Breaker des Anbieters zurück und legt ihn beim ersten Aufruf im Prozess an.
+    """
+    breaker = _breakers.get(provider)
+    if breaker is None:
+        breaker = CircuitBreaker(
+            provider,
+            get_circuit_breaker_failure_threshold(),
+            get_circuit_breaker_reset_seconds(),
+        )
+        _breakers[provider] = breaker
+
+    return breaker
+
+
+def backoff_delay(attempt):
+    """
+    Gibt die Wartezeit vor dem Versuch attempt + 1 zurück (exponentiell wachsend mit vollem Jitter).
+    """
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2**attempt))
+
+
+async def call_with_policy(provider, operation, request, attempts):
+    """
+    Führt request unter dem Circuit Breaker des Anbieters aus und wiederholt den Aufruf bei vorübergehenden Fehlern
+    bis zu attempts-mal mit Backoff. Andere Fehler (z.B. ein abgelehnter Token) werden sofort weitergegeben und
+    zählen als erreichbarer Anbieter, da dieser geantwortet hat.
+
+    :param provider: Kennung des Anbieters ("dc" oder "payback")
+    :param operation: Name des Aufrufs für Log-Ausgaben
+    :param request: Coroutine-Funktion ohne Parameter, die den Aufruf durchführt
+    :param attempts: Maximale Anzahl der Versuche (1 = keine Wiederholung)
+    """
+    breaker = get_circuit_breaker(provider)
+
+    for attempt in range(max(attempts, 1)):
+        probe = breaker.before_call()
+
+        try:
+            result = await request()
+        except TRANSIENT_ERRORS as e:
+            breaker.record_failure(probe)
+
+            # Ist der Anbieter inzwischen als ausgefallen markiert, wird nicht mehr gewartet.
+            if attempt + 1 >= attempts or breaker.state == breaker.OPEN:
+                raise
+
+            delay = backoff_delay(attempt)
+            logger.info(
+                f"{provider} {operation} failed ({type(e).__name__}: {e}), retrying in {delay:.1f}s."
+            )
+            await asyncio.sleep(delay)
+            continue
+        except Exception:
+            breaker.record_success(probe)
+            raise
+        except BaseException:
+            breaker.release(probe)
+            raise
+
+        breaker.record_success(probe)
+        return result
+
+
+def provider_call(provider, idempotent=True):
+    """
+    Decorator für die Methoden der API-Clients, der den Aufruf mit call_with_policy ausführt. Nur idempotente Aufrufe
+    werden wiederholt; alle Aufrufe unterliegen dem Circuit Breaker.
+    """
+    attempts = get_provider_call_attempts() if idempotent else 1
+
+    def decorator(method):
+        @functools.wraps(method)
+        async def wrapper(*args, **kwargs):
+            return await call_with_policy(
+                provider,
+                method.__name__,
+                lambda: method(*args, **kwargs),
+                attempts,
+            )
+
+        return wrapper
+
+    return decorator
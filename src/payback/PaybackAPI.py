@@ -1,16 +1,30 @@
-import requests as req
+import httpx
 import logging as log
 import json
 import datetime
+import time
 from enum import Enum
-from dateutil import parser as dateparser
 from loguru import logger
 
+from src.activation.catalog_diff import CatalogSnapshot
+from src.activation.coupon import Coupon
+from src.activation.coupon_metadata import CouponMetadataStore
+from src.activation.history import ActivationHistory
+from src.activation.json_stream import iter_response_array
+from src.activation.pool import as_async_iterable, run_bounded
+from src.auth.token_cache import CachedToken, IssuedToken, UnauthorizedError
 from src.config import (
+    get_payback_api_base_url,
     get_payback_basic_auth_username,
     get_payback_basic_auth_credential,
     get_payback_principal,
+    get_payback_coupon_activation_parallelism,
+    get_payback_token_ttl_seconds,
+    get_stream_coupon_lists,
 )
+from src.metrics.tracing import span
+from src.net.http_pool import get_http_client
+from src.net.resilience import provider_call, raise_if_unavailable
 
 
 class CouponStatus(Enum):
@@ -24,21 +38,48 @@ PAYBACK_BASIC_AUTH_USERNAME = get_payback_basic_auth_username()
 PAYBACK_BASIC_AUTH_CREDENTIAL = get_payback_basic_auth_credential()
 PAYBACK_PRINCIPAL = get_payback_principal()
 
-PAYBACK_API_BASE_URL = f"https://services-ext.payback.de/{PAYBACK_PRINCIPAL}/v1"
+PAYBACK_API_BASE_URL = get_payback_api_base_url()
 
 payback_date_format = "%Y-%m-%dT%H:%M:%S+0200"
 
+# Timeout in Sekunden für einzelne Anfragen an die Payback-Server
+REQUEST_TIMEOUT = 30
+
+
+def _raise_if_unauthorized(result):
+    # Eine abgelaufene oder ungültige Authentifizierung wird mit 401 bzw. 403 abgelehnt.
+    if result.status_code in (401, 403):
+        raise UnauthorizedError(f"Payback rejected token ({result.status_code})")
+
 
 class PaybackApi:
     def __init__(self):
-        self.session = req.Session()
-        self.session.auth = (PAYBACK_BASIC_AUTH_USERNAME, PAYBACK_BASIC_AUTH_CREDENTIAL)
-        self.session.headers = {
-            "Content-Type": "application/json; charset=utf8",
-            "Accept": "application/json; charset=utf-8",
-            "Accept-Encoding": "gzip",
-            "User-Agent": "DSA/24.02.0101(1707819571) iOS/16.1.1",
-        }
+        # Alle Clients teilen sich Verbindungspool und Drosselung der Anfragen an die Payback-Server. Die
+        # Authentifizierung des Accounts wird je Anfrage mitgeschickt.
+        self.session = get_http_client(
+            "payback",
+            auth=(PAYBACK_BASIC_AUTH_USERNAME, PAYBACK_BASIC_AUTH_CREDENTIAL),
+            headers={
+                "Content-Type": "application/json; charset=utf8",
+                "Accept": "application/json; charset=utf-8",
+                "Accept-Encoding": "gzip",
+                "User-Agent": "DSA/24.02.0101(1707819571) iOS/16.1.1",
+            },
+            timeout=REQUEST_TIMEOUT,
+        )
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def close(self):
+        """
+        Gibt den API-Client frei. Die gemeinsame HTTP-Session des Anbieters bleibt geöffnet, damit weitere Accounts
+        ihre Verbindungen wiederverwenden (siehe close_http_clients).
+        """
+        self.session = None
 
     # https://services-ext.payback.de/138/v1/json/secureauthenticate
     # {
@@ -63,7 +104,8 @@ class PaybackApi:
     #   "managedMemberDeviceIdentifiers": []
     # }
 
-    def _login(self, identification, security):
+    @provider_call("payback")
+    async def _login(self, identification, security):
         _data = {
             "consumerIdentification": {
                 "consumerAuthentication": {
@@ -77,9 +119,10 @@ class PaybackApi:
             "managedMemberDeviceIdentifiers": [],
         }
 
-        result = self.session.post(
+        result = await self.session.post(
             f"{PAYBACK_API_BASE_URL}/json/secureauthenticate", json=_data
         )
+        raise_if_unavailable(result)
 
         result_data = result
 
@@ -87,10 +130,14 @@ class PaybackApi:
 
         authentication.pop("refreshToken")
 
-        return authentication
+        # Die Gültigkeitsdauer des Tokens in Sekunden (sofern angegeben) bestimmt, wie lange er zwischengespeichert
+        # wird. Sie wird wie der Refresh-Token nicht mit den weiteren Anfragen verschickt.
+        return IssuedToken(
+            authentication, authentication.pop("tokenValidityDuration", None)
+        )
 
-    def login_with_mail(self, mail, password):
-        return self._login(
+    async def login_with_mail(self, mail, password):
+        return await self._login(
             {
                 "alias": mail,
                 "aliasType": 5,
@@ -98,8 +145,8 @@ class PaybackApi:
             {"secret": password, "secretType": 3},
         )
 
-    def login_with_kdnr(self, kdNr, password):
-        return self._login(
+    async def login_with_kdnr(self, kdNr, password):
+        return await self._login(
             {"alias": kdNr, "aliasType": 1}, {"secret": password, "secretType": 3}
         )
 
@@ -117,7 +164,10 @@ class PaybackApi:
     #             "principal": "XXX"
     #         }
     # }
-    def activate_coupon(self, authentication, couponID):
+    # Die erneute Aktivierung eines bereits aktivierten Coupons hat keine weitere Wirkung; der Aufruf darf daher
+    # wiederholt werden.
+    @provider_call("payback")
+    async def activate_coupon(self, authentication, couponID):
         _data = {
             "activatedAt": datetime.datetime.now().strftime(payback_date_format),
             "authentication": authentication,
@@ -131,9 +181,11 @@ class PaybackApi:
             },
         }
 
-        result = self.session.post(
+        result = await self.session.post(
             f"{PAYBACK_API_BASE_URL}/json/activatecoupon", json=_data
         )
+        raise_if_unavailable(result)
+        _raise_if_unauthorized(result)
 
         return
 
@@ -160,8 +212,8 @@ class PaybackApi:
     #     }
     #   }
     # }
-    def get_coupons(self, authentication):
-        _data = {
+    def _coupon_query(self, authentication):
+        return {
             "authentication": authentication,
             "couponFilter": {"couponDistributionChannel": [5]},
             "couponPeriodFilter": [
@@ -183,14 +235,39 @@ class PaybackApi:
             },
         }
 
-        result = self.session.post(
-            f"{PAYBACK_API_BASE_URL}/json/getcoupons", json=_data
+    @provider_call("payback")
+    async def get_coupons(self, authentication):
+        result = await self.session.post(
+            f"{PAYBACK_API_BASE_URL}/json/getcoupons",
+            json=self._coupon_query(authentication),
         )
+        raise_if_unavailable(result)
+        _raise_if_unauthorized(result)
 
         result_data = result
 
         return result_data.json()
 
+    # Wie get_coupons, gibt aber einen asynchronen Iterator zurück, der die Einträge des Arrays "couponListItem"
+    # einzeln liefert, während die Antwort noch empfangen wird.
+    @provider_call("payback")
+    async def get_coupons_stream(self, authentication):
+        request = self.session.build_request(
+            "POST",
+            f"{PAYBACK_API_BASE_URL}/json/getcoupons",
+            json=self._coupon_query(authentication),
+        )
+        result = await self.session.send(request, stream=True)
+
+        try:
+            raise_if_unavailable(result)
+            _raise_if_unauthorized(result)
+        except Exception:
+            await result.aclose()
+            raise
+
+        return iter_response_array(result, "couponListItem", "payback")
+
     # https://services-ext.payback.de/139/v1/json/getaccountbalance
     # {
     #   "authentication": {
@@ -203,7 +280,8 @@ class PaybackApi:
     #     }
     #   }
     # }
-    def get_account_balance(self, authentication):
+    @provider_call("payback")
+    async def get_account_balance(self, authentication):
         _data = {
             "authentication": authentication,
             "consumerIdentification": {
@@ -214,82 +292,175 @@ class PaybackApi:
             },
         }
 
-        result = self.session.post(
+        result = await self.session.post(
             f"{PAYBACK_API_BASE_URL}/json/getaccountbalance", json=_data
         )
+        raise_if_unavailable(result)
+        _raise_if_unauthorized(result)
 
         json = result.json()
         return json
 
 
-def payback_activate_all_available_coupons(kdnr_or_email, password):
-    api = PaybackApi()
+async def payback_activate_all_available_coupons(
+    kdnr_or_email, password, metadata_store=None, checkpoint=None
+):
+    async with PaybackApi() as api:
+        return await _payback_activate_all_available_coupons(
+            api,
+            kdnr_or_email,
+            password,
+            metadata_store or CouponMetadataStore(),
+            checkpoint,
+        )
 
+
+async def _payback_activate_all_available_coupons(
+    api, kdnr_or_email, password, metadata_store, checkpoint
+):
     # Wir loggen mit der Kundennummer oder der E-Mail-Adresse ein,
     # je nachdem welche Information wir vorliegend haben.
-    if kdnr_or_email.isdigit():
-        authentication = api.login_with_kdnr(kdnr_or_email, password)
-    else:
-        authentication = api.login_with_mail(kdnr_or_email, password)
+    def login():
+        if kdnr_or_email.isdigit():
+            return api.login_with_kdnr(kdnr_or_email, password)
+        else:
+            return api.login_with_mail(kdnr_or_email, password)
+
+    # Die Authentifizierung wird über mehrere Läufe hinweg wiederverwendet und bei Bedarf automatisch erneuert.
+    authentication = CachedToken(
+        "payback", kdnr_or_email, login, get_payback_token_ttl_seconds()
+    )
+
+    # Abfragen der verfügbaren Coupons mit dem Token. Die Coupons werden entweder einzeln aus der noch laufenden
+    # Antwort dekodiert oder vollständig geladen.
+    with span("query coupons"):
+        if get_stream_coupon_lists():
+            coupons = await authentication.call(api.get_coupons_stream)
+        else:
+            coupon_data = await authentication.call(api.get_coupons)
+            coupons = as_async_iterable(coupon_data["couponListItem"])
 
-    # Abfragen der verfügbaren Coupons mit dem Token
-    coupon_data = api.get_coupons(authentication)
+    def format_coupon(coupon):
+        return f"{coupon.coupon_id}:{coupon.partner}:{coupon.status}:{coupon.headline}"
 
     current_datetime = datetime.datetime.now(datetime.timezone.utc)
+    current_timestamp = current_datetime.timestamp()
 
-    coupons = coupon_data["couponListItem"]
+    # Coupons, die bereits in einem früheren Lauf unverändert übersprungen wurden, werden nicht erneut ausgewertet.
+    snapshot = CatalogSnapshot("payback", kdnr_or_email)
+    # Die Ergebnisse der Aktivierungen werden gesammelt und nach dem Lauf des Accounts gemeinsam gespeichert.
+    history = ActivationHistory("payback", kdnr_or_email)
 
-    count_successful = 0
     count_skipped = 0
     count_errored = 0
-    for coupon in coupons:
-        try:
-            coupon = coupon["coupon"]
+    count_resumed = 0
 
-            if coupon["couponStatus"] != CouponStatus.Available.value:
-                logger.info(
-                    f"UNAVAILABLE: {coupon['couponID']}:{coupon['partner'][0]['partnerDisplayName']}:{coupon['couponStatus']}:{coupon['couponContentSet']['textItem'][2]['textValue']} {coupon['couponContentSet']['textItem'][3]['textValue']}".replace(
-                        "\n", " "
-                    )
-                )
-                count_skipped = count_skipped + 1
-                continue
+    def should_activate(coupon):
+        nonlocal count_skipped
+
+        fingerprint = coupon.fingerprint()
+
+        if snapshot.is_unchanged(coupon.coupon_id, fingerprint, current_timestamp):
+            count_skipped = count_skipped + 1
+            return False
+
+        if coupon.status != CouponStatus.Available.value:
+            logger.info(f"UNAVAILABLE: {format_coupon(coupon)}")
+            snapshot.record_skipped(coupon.coupon_id, fingerprint)
+            count_skipped = count_skipped + 1
+            return False
+
+        # Parsen des Beginn- und Enddatums des Coupons
+        begin, end = metadata_store.get_validity(
+            "payback", coupon.coupon_id, coupon.valid_from, coupon.valid_to
+        )
+
+        # Überspringen des Coupons, wenn er nicht gültig ist
+        if not (begin < current_datetime < end):
+            logger.info(f"UNAVAILABLE: {format_coupon(coupon)}")
+            # Ein noch nicht gültiger Coupon muss ab Beginn der Gültigkeit erneut ausgewertet werden.
+            snapshot.record_skipped(
+                coupon.coupon_id,
+                fingerprint,
+                begin.timestamp() if current_datetime <= begin else None,
+            )
+            count_skipped = count_skipped + 1
+            return False
+
+        return True
 
-            # Parsen des Beginn- und Enddatums des Coupons
-            begin = dateparser.parse(coupon["validity"]["validFrom"])
-            end = dateparser.parse(coupon["validity"]["validTo"])
+    async def coupons_to_activate():
+        nonlocal count_errored, count_resumed
 
-            # Überspringen des Coupons, wenn er nicht gültig ist
-            if not (begin < current_datetime < end):
-                logger.info(
-                    f"UNAVAILABLE: {coupon['couponID']}:{coupon['partner'][0]['partnerDisplayName']}:{coupon['couponStatus']}:{coupon['couponContentSet']['textItem'][2]['textValue']} {coupon['couponContentSet']['textItem'][3]['textValue']}".replace(
+        async for item in coupons:
+            try:
+                # Der Coupon wird einmal aus der Antwort erstellt; die Rohdaten werden danach nicht mehr benötigt.
+                coupon = Coupon.from_payback(item["coupon"], metadata_store)
+
+                # Vor einem Neustart bereits aktivierte Coupons werden nicht erneut aktiviert, aber mitgezählt.
+                if checkpoint is not None and checkpoint.is_activated(coupon.coupon_id):
+                    count_resumed = count_resumed + 1
+                    continue
+
+                if not should_activate(coupon):
+                    continue
+            except Exception as e:
+                logger.error(
+                    f"FAILED TO ACTIVATE:{item.get('coupon', {}).get('couponID')}:{e}".replace(
                         "\n", " "
                     )
                 )
-                count_skipped = count_skipped + 1
+                count_errored = count_errored + 1
                 continue
 
-            # Aktivieren des Coupons mit dem Token und der Coupon-ID
-            api.activate_coupon(authentication, coupon["couponID"])
+            # Der Coupon wird sofort aktiviert, während weitere Coupons noch empfangen und ausgewertet werden.
+            yield coupon
 
-            # Erhöhen des Zählers für die aktivierten Coupons um 1
-            count_successful = count_successful + 1
+    async def activate(coupon):
+        started_at = time.perf_counter()
 
-            # Loggen der erfolgreichen Aktivierung des Coupons
-            logger.info(
-                f"ACTIVATED: {coupon['couponID']}:{coupon['partner'][0]['partnerDisplayName']}:{coupon['couponStatus']}:{coupon['couponContentSet']['textItem'][2]['textValue']} {coupon['couponContentSet']['textItem'][3]['textValue']}".replace(
-                    "\n", " "
+        try:
+            # Aktivieren des Coupons mit dem Token und der Coupon-ID. Die Coupons werden gleichzeitig aktiviert und
+            # erhalten daher im Trace eigene Spuren.
+            with span("activate coupon", new_lane=True, coupon_id=coupon.coupon_id):
+                await authentication.call(
+                    lambda auth: api.activate_coupon(auth, coupon.coupon_id)
                 )
-            )
         except Exception as e:
             logger.error(
-                f"FAILED TO ACTIVATE:{coupon['couponID']}:{coupon['partner'][0]['partnerDisplayName']}:{e}".replace(
+                f"FAILED TO ACTIVATE:{coupon.coupon_id}:{coupon.partner}:{e}".replace(
                     "\n", " "
                 )
             )
-            count_errored = count_errored + 1
+            history.record(coupon, False, time.perf_counter() - started_at)
+            return False
+
+        history.record(coupon, True, time.perf_counter() - started_at)
+
+        if checkpoint is not None:
+            checkpoint.record_activated(coupon.coupon_id)
+
+        # Loggen der erfolgreichen Aktivierung des Coupons
+        logger.info(f"ACTIVATED: {format_coupon(coupon)}")
+        return True
+
+    # Die Aktivierungen laufen parallel, jedoch mit höchstens PAYBACK_COUPON_ACTIVATION_PARALLELISM gleichzeitigen
+    # Anfragen.
+    with span("activate coupons"):
+        activated = await run_bounded(
+            coupons_to_activate(),
+            activate,
+            get_payback_coupon_activation_parallelism(),
+        )
+    count_successful = activated.count(True) + count_resumed
+    count_errored = count_errored + activated.count(False)
+
+    with span("store results"):
+        snapshot.save()
+        history.save()
 
-    account_balance = api.get_account_balance(authentication)
+    with span("balance"):
+        account_balance = await authentication.call(api.get_account_balance)
 
     points = account_balance["accountBalanceDetails"][0]["totalPointsAmount"]
     expiring_points = account_balance["accountBalanceDetails"][0]["expiryAnnouncement"][
@@ -1,3 +1,5 @@
+import asyncio
+
 from src.config import get_debug_payback_kdnr, get_debug_payback_password
 from src.payback.PaybackAPI import payback_activate_all_available_coupons
 
@@ -8,8 +10,10 @@ from src.payback.PaybackAPI import payback_activate_all_available_coupons
     points,
     expiring_points,
     points_expiry,
-) = payback_activate_all_available_coupons(
-    get_debug_payback_kdnr(), get_debug_payback_password()
+) = asyncio.run(
+    payback_activate_all_available_coupons(
+        get_debug_payback_kdnr(), get_debug_payback_password()
+    )
 )
 
 print(f"Aktivierte Coupons: {count_activated}")